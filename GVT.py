@@ -1,91 +1,440 @@
+import math
 import os
 import sys
-import json
-from pathlib import Path
+import threading
+import time
+import uuid
+from collections import deque
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QFileDialog, QMessageBox, QVBoxLayout,
-    QHBoxLayout, QPushButton, QLabel, QListWidget, QWidget, QProgressBar,
-    QTabWidget, QComboBox, QGroupBox, QLineEdit
+    QHBoxLayout, QPushButton, QLabel, QListWidget, QListView, QWidget, QProgressBar,
+    QTabWidget, QComboBox, QGroupBox, QLineEdit, QSpinBox, QCheckBox, QInputDialog
 )
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QUrl
-from PyQt6.QtMultimedia import QMediaPlayer, QAudioOutput
-from mutagen import File
-import subprocess
-import vlc
+from PyQt6.QtCore import (
+    Qt, QThread, pyqtSignal, QUrl, QAbstractListModel, QModelIndex, QTimer, QLineF, QObject,
+    QBuffer, QByteArray, QIODevice
+)
+from PyQt6.QtGui import QColor, QPainter
+try:
+    from PyQt6.QtMultimedia import (
+        QAudioFormat, QAudioOutput, QAudioSink, QMediaDevices, QMediaPlayer
+    )
+except ImportError:
+    # Без Qt Multimedia прослушивание идет только через VLC
+    QAudioSink = QMediaPlayer = None
+from gvt_core import (
+    AUDIO_EXTENSIONS, STAGING_DIR, AnalysisCache, BackupStore, EncoderError, JobJournal,
+    LoudnessCache, PathIndex, PcmCache, ProfileStore, ReplacementMapper, ReplacementProcessor, ScanIndex,
+    TranscodeCache, check_durations, duration_mismatch, extract_entry, format_size,
+    load_rename_rules, original_audio_path, plan_tasks, restore_backups, split_archive_path
+)
+
+class AudioListModel(QAbstractListModel):
+    # Виртуальный список: представление запрашивает только видимые строки
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.path_index = PathIndex()
+        self.query = ''
+        self.rows = None  # None - фильтр не задан, иначе номера путей в path_index
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.path_index) if self.rows is None else len(self.rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.ToolTipRole):
+            return self.path_at(index.row())
+        return None
+
+    def path_at(self, row):
+        return self.path_index.paths[row if self.rows is None else self.rows[row]]
+
+    def total_count(self):
+        return len(self.path_index)
+
+    def set_paths(self, paths):
+        self.beginResetModel()
+        self.path_index.clear()
+        self.path_index.extend(paths)
+        self.rows = self.path_index.search(self.query) if self.query.strip() else None
+        self.endResetModel()
+
+    def append_paths(self, paths):
+        if not paths:
+            return
+        start = len(self.path_index)
+        if self.rows is None:
+            self.beginInsertRows(QModelIndex(), start, start + len(paths) - 1)
+            self.path_index.extend(paths)
+            self.endInsertRows()
+            return
+
+        self.path_index.extend(paths)
+        matched = self.path_index.search(self.query, start)
+        if matched:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(matched) - 1)
+            self.rows.extend(matched)
+            self.endInsertRows()
+
+    def set_filter(self, query):
+        self.beginResetModel()
+        self.query = query
+        self.rows = self.path_index.search(query) if query.strip() else None
+        self.endResetModel()
+
 
 class AudioScanner(QThread):
     scan_complete = pyqtSignal(dict)
-    progress_updated = pyqtSignal(int)
+    progress_updated = pyqtSignal(int)  # Количество найденных файлов
+    files_found = pyqtSignal(list)  # Очередная пачка относительных путей
+
+    batch_size = 2000
+    emit_interval = 0.1  # Не чаще 10 обновлений интерфейса в секунду
 
-    def __init__(self, game_path):
+    def __init__(self, game_path, index):
         super().__init__()
         self.game_path = game_path
-        self.audio_extensions = ('.wav', '.ogg', '.mp3', '.flac')
+        self.index = index
+        self.audio_extensions = AUDIO_EXTENSIONS
+        self.cancelled = False
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
 
     def run(self):
         audio_files = {}
-        total_files = 0
-        scanned_files = 0
-
-        # Сначала подсчитываем общее количество файлов для прогресса
-        for root, _, files in os.walk(self.game_path):
-            for file in files:
-                if file.lower().endswith(self.audio_extensions):
-                    total_files += 1
-
-        for root, _, files in os.walk(self.game_path):
-            for file in files:
-                if file.lower().endswith(self.audio_extensions):
-                    full_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(full_path, self.game_path)
-                    audio_files[relative_path] = full_path
-                    scanned_files += 1
-                    self.progress_updated.emit(int(scanned_files / total_files * 100))
-
+        batch = []
+        last_emit = time.monotonic()
+
+        for relative_path, full_path in self.index.scan(
+                self.game_path, self.audio_extensions, self._cancel_event):
+            audio_files[relative_path] = full_path
+            batch.append(relative_path)
+
+            now = time.monotonic()
+            if len(batch) >= self.batch_size or now - last_emit >= self.emit_interval:
+                self.files_found.emit(batch)
+                self.progress_updated.emit(len(audio_files))
+                batch = []
+                last_emit = now
+
+        if batch:
+            self.files_found.emit(batch)
+        self.progress_updated.emit(len(audio_files))
+
+        self.cancelled = self._cancel_event.is_set()
         self.scan_complete.emit(audio_files)
 
 class AudioProcessor(QThread):
     progress_updated = pyqtSignal(int)
     status_message = pyqtSignal(str)
+    stats_updated = pyqtSignal(dict)
     finished = pyqtSignal()
 
-    def __init__(self, tasks):
+    def __init__(self, tasks, max_workers=None, cache=None, force=False, index=None,
+                 backups=None, batch=True, journal=None, run_id=None, plan=None, loudness=None):
         super().__init__()
-        self.tasks = tasks  # Список словарей: {'game_path': '', 'replacements': {}}
+        self.engine = ReplacementProcessor(
+            tasks, max_workers, cache, force,
+            on_progress=self.progress_updated.emit,
+            on_status=self.status_message.emit,
+            index=index, backups=backups,
+            on_stats=self.stats_updated.emit, batch=batch,
+            journal=journal, run_id=run_id, plan=plan, loudness=loudness)
+
+    def cancel(self):
+        self.engine.cancel()
 
     def run(self):
-        total_tasks = sum(len(task['replacements']) for task in self.tasks)
-        processed = 0
+        self.engine.run()
+        self.finished.emit()
 
-        for task in self.tasks:
-            game_path = task['game_path']
-            replacements = task['replacements']
 
-            for original_rel, replacement in replacements.items():
-                original_full = os.path.join(game_path, original_rel)
-                backup_path = original_full + '.bak'
+class BackgroundDecoder(QThread):
+    # Фоновая обработка файлов по одному: анализ волны или декодирование для
+    # прослушивания. Очередь LIFO: при быстрой прокрутке первым
+    # обрабатывается последний выбранный файл. В очереди не больше
+    # max_pending путей - запросы строк, с которых выделение уже ушло,
+    # вытесняются. Путь, который уже в очереди или в работе, повторно не
+    # ставится, а готовый результат (cached) отдается сразу, без очереди
+    done = pyqtSignal(str, object)
+    failed = pyqtSignal(str, str)
 
-                try:
-                    self.status_message.emit(f"Обработка: {original_rel}")
+    def __init__(self, task, cached=None, max_pending=4):
+        super().__init__()
+        self.task = task
+        self.cached = cached
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.current = None
+        self.stopped = False
+        self.condition = threading.Condition()
+
+    def request(self, path):
+        if self.cached is not None:
+            result = self.cached(path)
+            if result is not None:
+                self.done.emit(path, result)
+                return
+        with self.condition:
+            if path == self.current:
+                return
+            if path in self.pending:
+                self.pending.remove(path)
+            self.pending.append(path)
+            if len(self.pending) > self.max_pending:
+                self.pending.popleft()
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
 
-                    # Создаем backup если его нет
-                    if not os.path.exists(backup_path):
-                        os.rename(original_full, backup_path)
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    break
+                path = self.current = self.pending.pop()
+            try:
+                result = self.task(path)
+            except (OSError, EncoderError, ValueError) as e:
+                self.failed.emit(path, str(e))
+                continue
+            finally:
+                with self.condition:
+                    self.current = None
+            self.done.emit(path, result)
+
+
+class PreviewEngine(QObject):
+    # Прослушивание без задержки при переходе по строкам. Соседние строки
+    # заранее декодируются в PCM, и готовый PCM сразу играет QAudioSink.
+    # Пока PCM нет, файл играет VLC, а без VLC - QMediaPlayer
+
+    def __init__(self, pcm_cache, parent=None):
+        super().__init__(parent)
+        self.pcm_cache = pcm_cache
+        self.decoder = BackgroundDecoder(pcm_cache.load, pcm_cache.get)
+        self.decoder.start()
+        self.sink = None
+        self.buffer = None
+        # VLC загружается при первом воспроизведении файла, а не при запуске
+        self.vlc_instance = None
+        self.vlc_player = None
+        self.vlc_failed = False
+        self.qt_player = None
+        # Запись архива для VLC и QMediaPlayer извлекается во временный файл
+        self.extracted = None
+
+    def preload(self, paths):
+        # Последний путь декодируется первым
+        for path in paths:
+            if path:
+                self.decoder.request(path)
+
+    def play(self, path):
+        # Возвращает название способа воспроизведения для строки статуса
+        self.stop()
+        pcm = self.pcm_cache.get(path)
+        if pcm is not None and self.play_pcm(*pcm):
+            return "из памяти"
+        self.decoder.request(path)
+        return self.play_file(path)
+
+    def play_pcm(self, data, sample_rate, channels):
+        if QAudioSink is None:
+            return False
+        audio_format = QAudioFormat()
+        audio_format.setSampleRate(sample_rate)
+        audio_format.setChannelCount(channels)
+        audio_format.setSampleFormat(QAudioFormat.SampleFormat.Int16)
+        device = QMediaDevices.defaultAudioOutput()
+        if device.isNull() or not device.isFormatSupported(audio_format):
+            return False
+        # Устройство открывается заново только при смене формата
+        if self.sink is None or self.sink.format() != audio_format:
+            self.sink = QAudioSink(device, audio_format, self)
+        if self.buffer is None:
+            self.buffer = QBuffer(self)
+        self.buffer.close()
+        self.buffer.setData(QByteArray(data))
+        self.buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+        self.sink.start(self.buffer)
+        return True
+
+    def play_file(self, path):
+        if split_archive_path(path)[1] is not None:
+            path = self.extract(path)
+        player = self.vlc()
+        if player is not None:
+            player.set_media(self.vlc_instance.media_new(path))
+            player.play()
+            return "VLC"
+        if QMediaPlayer is None:
+            raise RuntimeError("нет ни VLC, ни Qt Multimedia")
+        if self.qt_player is None:
+            self.qt_player = QMediaPlayer(self)
+            self.qt_player.setAudioOutput(QAudioOutput(self.qt_player))
+        self.qt_player.setSource(QUrl.fromLocalFile(path))
+        self.qt_player.play()
+        return "Qt Multimedia"
+
+    def extract(self, path):
+        self.remove_extracted()
+        os.makedirs(STAGING_DIR, exist_ok=True)
+        extension = os.path.splitext(split_archive_path(path)[1])[1]
+        self.extracted = os.path.join(STAGING_DIR, f"preview-{uuid.uuid4().hex}{extension}")
+        extract_entry(path, self.extracted)
+        return self.extracted
+
+    def remove_extracted(self):
+        # Вызывается после stop(), когда плеер уже отпустил файл
+        if self.extracted is not None:
+            try:
+                os.remove(self.extracted)
+            except OSError:
+                pass
+            self.extracted = None
+
+    def vlc(self):
+        if self.vlc_player is None and not self.vlc_failed:
+            try:
+                import vlc
+                self.vlc_instance = vlc.Instance()
+                self.vlc_player = self.vlc_instance.media_player_new()
+            except Exception:
+                # Нет модуля python-vlc или самой библиотеки libvlc
+                self.vlc_failed = True
+                self.vlc_instance = self.vlc_player = None
+        return self.vlc_player
+
+    def stop(self):
+        if self.sink is not None:
+            self.sink.stop()
+        if self.vlc_player is not None:
+            self.vlc_player.stop()
+        if self.qt_player is not None:
+            self.qt_player.stop()
+
+    def shutdown(self):
+        self.stop()
+        self.remove_extracted()
+        self.decoder.stop()
+        self.decoder.wait()
+
+
+class DurationChecker(QThread):
+    progress_updated = pyqtSignal(int)
+    check_complete = pyqtSignal(dict)
 
-                    # Конвертируем и заменяем файл
-                    subprocess.run([
-                        "ffmpeg", "-i", replacement, "-c:a", "libvorbis", "-q:a", "5",
-                        original_full
-                    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    def __init__(self, pairs, cache, max_workers=None):
+        super().__init__()
+        self.pairs = pairs
+        self.cache = cache
+        self.max_workers = max_workers
+        self.cancelled = False
+        self._cancel_event = threading.Event()
 
-                    processed += 1
-                    self.progress_updated.emit(int(processed / total_tasks * 100))
+    def cancel(self):
+        self._cancel_event.set()
 
-                except Exception as e:
-                    self.status_message.emit(f"Ошибка: {str(e)}")
+    def run(self):
+        result = check_durations(
+            self.pairs, self.cache, self.max_workers,
+            on_progress=self.progress_updated.emit, cancel_event=self._cancel_event)
+        self.cancelled = self._cancel_event.is_set()
+        self.check_complete.emit(result)
+
+
+class WaveformView(QWidget):
+    # Огибающие оригинала (сверху) и замены (снизу) в общем масштабе времени:
+    # разница в длительности видна без прослушивания
+    colors = {'text': QColor('#ffffff'), 'normal': QColor('#4CAF50'), 'mismatch': QColor('#e74c3c')}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.tracks = [("Оригинал", None), ("Замена", None)]
+        self.results = {}
+        self.setMinimumHeight(110)
+
+    def show_files(self, original_path, replacement_path=None):
+        self.tracks = [("Оригинал", original_path), ("Замена", replacement_path)]
+        self.results = {}
+        self.update()
+
+    def set_result(self, path, result):
+        # result - словарь analyze_audio или текст ошибки
+        if any(path == track_path for _, track_path in self.tracks):
+            self.results[path] = result
+            self.update()
+
+    def describe(self, title, path):
+        if path is None:
+            return f"{title}: -"
+        result = self.results.get(path)
+        if result is None:
+            return f"{title}: анализ..."
+        if isinstance(result, str):
+            return f"{title}: ошибка анализа: {result}"
+        return (f"{title}: {result['duration']:.2f} с, пик {decibels(result['peak']):.1f} dBFS, "
+                f"RMS {decibels(result['rms']):.1f} dBFS")
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        results = [self.results.get(path) for _, path in self.tracks]
+        durations = [result['duration'] for result in results if isinstance(result, dict)]
+        longest = max(durations, default=0) or 1
+        mismatch = len(durations) == 2 and duration_mismatch(*durations)
+        height = self.height() / len(self.tracks)
+        text_height = painter.fontMetrics().height()
+
+        for row, ((title, path), result) in enumerate(zip(self.tracks, results)):
+            top = row * height
+            painter.setPen(self.colors['text'])
+            painter.drawText(4, int(top + text_height), self.describe(title, path))
+            if not isinstance(result, dict) or not result['envelope']:
+                continue
+            envelope = result['envelope']
+            width = (self.width() - 8) * result['duration'] / longest
+            middle = top + text_height + (height - text_height) / 2
+            half = (height - text_height) / 2 - 2
+            step = width / len(envelope)
+            painter.setPen(self.colors['mismatch' if mismatch and row == 1 else 'normal'])
+            painter.drawLines([
+                QLineF(4 + i * step, middle - value / 255 * half,
+                       4 + i * step, middle + value / 255 * half)
+                for i, value in enumerate(envelope)
+            ])
+
+
+def decibels(value):
+    return 20 * math.log10(value) if value > 0 else -math.inf
+
+
+def format_run_stats(stats):
+    phases = stats['phase_seconds']
+    text = (
+        f"Готово: {stats['done']}, пропущено: {stats['skipped']}, ошибок: {stats['failed']} "
+        f"за {stats['elapsed_s']:.1f} с\n"
+        f"Скорость: {stats['files_per_s']:.1f} файл/с, {stats['input_mb_per_s']:.2f} МБ/с на входе, "
+        f"{stats['output_mb_per_s']:.2f} МБ/с на выходе\n"
+        f"Время фаз (сумма по потокам): подготовка {phases['prepare']:.1f} с, "
+        f"громкость {phases['loudness']:.1f} с, backup {phases['backup']:.1f} с, "
+        f"кодирование {phases['encode']:.1f} с, запись {phases['write']:.1f} с"
+    )
+    if stats['slowest']:
+        slowest = stats['slowest'][0]
+        text += f"\nСамый медленный файл: {slowest['target']} ({slowest['total_s']:.2f} с)"
+    return text
 
-        self.finished.emit()
-        self.status_message.emit("Все операции завершены!")
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -96,10 +445,28 @@ class MainWindow(QMainWindow):
         self.setup_style()
         self.current_game_path = ""
         self.audio_files = {}
-        self.vlc_instance = vlc.Instance()
-        self.vlc_player = self.vlc_instance.media_player_new()
-        self.mod_profiles = {}
+        # Индекс имен для автосопоставления строится по текущему списку оригиналов
+        self.mapper = None
+        self.mapper_files = None
+        self.mapper_rules = None
+        self.scan_index = ScanIndex()
+        self.transcode_cache = TranscodeCache()
+        self.backup_store = BackupStore()
+        self.job_journal = JobJournal()
+        self.loudness_cache = LoudnessCache()
+        # Анализ волны идет в фоне; результаты кэшируются в памяти и на диске
+        self.analysis_cache = AnalysisCache()
+        self.analyzer = BackgroundDecoder(self.analysis_cache.analyze, self.analysis_cache.cached)
+        self.analyzer.done.connect(self.waveform_view.set_result)
+        self.analyzer.failed.connect(self.waveform_view.set_result)
+        self.analyzer.start()
+        self.duration_checker = None
+        self.preview = PreviewEngine(PcmCache(), self)
+        self.profile_store = ProfileStore()
         self.load_profiles()
+        self.update_cache_stats()
+        # Предложение продолжить прерванную обработку - после показа окна
+        QTimer.singleShot(0, self.offer_resume)
 
     def setup_ui(self):
         self.tabs = QTabWidget()
@@ -127,33 +494,64 @@ class MainWindow(QMainWindow):
         self.game_path_label = QLabel("Путь к игре: Не выбран")
         self.btn_select_game = QPushButton("Выбрать игру")
         self.btn_scan_audio = QPushButton("Сканировать аудиофайлы")
+        self.btn_cancel_scan = QPushButton("Остановить сканирование")
+        self.btn_cancel_scan.setEnabled(False)
+
+        scan_buttons_layout = QHBoxLayout()
+        scan_buttons_layout.addWidget(self.btn_scan_audio)
+        scan_buttons_layout.addWidget(self.btn_cancel_scan)
         
         game_layout.addWidget(self.game_path_label)
         game_layout.addWidget(self.btn_select_game)
-        game_layout.addWidget(self.btn_scan_audio)
+        game_layout.addLayout(scan_buttons_layout)
         game_group.setLayout(game_layout)
 
         # Группа аудиофайлов
         audio_group = QGroupBox("Управление аудио")
         audio_layout = QVBoxLayout()
         
-        self.original_audio_list = QListWidget()
-        self.original_audio_list.itemDoubleClicked.connect(self.play_original_audio)
+        self.audio_model = AudioListModel(self)
+        self.original_audio_list = QListView()
+        self.original_audio_list.setModel(self.audio_model)
+        self.original_audio_list.setUniformItemSizes(True)
+        self.original_audio_list.doubleClicked.connect(self.play_original_audio)
+
+        self.audio_filter_edit = QLineEdit()
+        self.audio_filter_edit.setPlaceholderText("Фильтр: подстрока или маска, например vo/npc_guard_*")
+        self.audio_count_label = QLabel("")
+        # Фильтр применяется после паузы в наборе, а не на каждую клавишу
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(150)
+        self.filter_timer.timeout.connect(self.apply_audio_filter)
+        self.audio_filter_edit.textChanged.connect(self.filter_timer.start)
+        self.audio_model.rowsInserted.connect(self.update_audio_count)
+        self.audio_model.modelReset.connect(self.update_audio_count)
         self.replacement_audio_list = QListWidget()
         
         self.btn_add_replacement = QPushButton("Добавить замену")
         self.btn_remove_replacement = QPushButton("Удалить замену")
         self.btn_preview_replacement = QPushButton("Прослушать замену")
+        self.btn_map_folder = QPushButton("Сопоставить папку с записями")
+        self.btn_check_durations = QPushButton("Проверить длительности")
+        self.waveform_view = WaveformView()
+        self.autoplay_checkbox = QCheckBox("Прослушивать при выборе строки")
         
         audio_buttons_layout = QHBoxLayout()
         audio_buttons_layout.addWidget(self.btn_add_replacement)
+        audio_buttons_layout.addWidget(self.btn_map_folder)
         audio_buttons_layout.addWidget(self.btn_remove_replacement)
         audio_buttons_layout.addWidget(self.btn_preview_replacement)
+        audio_buttons_layout.addWidget(self.btn_check_durations)
         
         audio_layout.addWidget(QLabel("Оригинальные файлы:"))
+        audio_layout.addWidget(self.audio_filter_edit)
         audio_layout.addWidget(self.original_audio_list)
+        audio_layout.addWidget(self.audio_count_label)
         audio_layout.addWidget(QLabel("Файлы для замены:"))
         audio_layout.addWidget(self.replacement_audio_list)
+        audio_layout.addWidget(self.waveform_view)
+        audio_layout.addWidget(self.autoplay_checkbox)
         audio_layout.addLayout(audio_buttons_layout)
         audio_group.setLayout(audio_layout)
 
@@ -164,24 +562,65 @@ class MainWindow(QMainWindow):
         self.progress_bar = QProgressBar()
         self.status_label = QLabel("Готово к работе")
         self.btn_process = QPushButton("Применить изменения")
+        self.btn_cancel_process = QPushButton("Отменить")
+        self.btn_cancel_process.setEnabled(False)
+
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, 256)
+        self.workers_spin.setValue(os.cpu_count() or 1)
+
+        self.force_checkbox = QCheckBox("Переобработать все (игнорировать манифест)")
+        self.batch_checkbox = QCheckBox("Кодировать мелкие файлы пачками")
+        self.batch_checkbox.setChecked(True)
+        self.normalize_checkbox = QCheckBox("Выравнивать громкость замен по оригиналу")
+
+        workers_layout = QHBoxLayout()
+        workers_layout.addWidget(QLabel("Параллельных конвертаций:"))
+        workers_layout.addWidget(self.workers_spin)
+        workers_layout.addWidget(self.force_checkbox)
+        workers_layout.addWidget(self.batch_checkbox)
+        workers_layout.addWidget(self.normalize_checkbox)
+
+        process_buttons_layout = QHBoxLayout()
+        process_buttons_layout.addWidget(self.btn_process)
+        process_buttons_layout.addWidget(self.btn_cancel_process)
         
+        self.cache_stats_label = QLabel("")
+
         process_layout.addWidget(self.progress_bar)
         process_layout.addWidget(self.status_label)
-        process_layout.addWidget(self.btn_process)
+        process_layout.addWidget(self.cache_stats_label)
+        process_layout.addLayout(workers_layout)
+        process_layout.addLayout(process_buttons_layout)
         process_group.setLayout(process_layout)
 
+        # Группа живой статистики обработки
+        stats_group = QGroupBox("Статистика обработки")
+        stats_layout = QVBoxLayout()
+        self.run_stats_label = QLabel("Нет данных")
+        self.run_stats_label.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        stats_layout.addWidget(self.run_stats_label)
+        stats_group.setLayout(stats_layout)
+
         layout.addWidget(game_group)
         layout.addWidget(audio_group)
         layout.addWidget(process_group)
+        layout.addWidget(stats_group)
         self.main_tab.setLayout(layout)
 
         # Подключение сигналов
         self.btn_select_game.clicked.connect(self.select_game)
         self.btn_scan_audio.clicked.connect(self.scan_audio_files)
+        self.btn_cancel_scan.clicked.connect(self.cancel_scan)
         self.btn_add_replacement.clicked.connect(self.add_replacement)
+        self.btn_map_folder.clicked.connect(self.map_replacement_folder)
         self.btn_remove_replacement.clicked.connect(self.remove_replacement)
         self.btn_preview_replacement.clicked.connect(self.preview_replacement)
+        self.btn_check_durations.clicked.connect(self.check_replacement_durations)
+        self.original_audio_list.selectionModel().currentChanged.connect(self.on_original_selected)
+        self.replacement_audio_list.currentItemChanged.connect(self.on_replacement_selected)
         self.btn_process.clicked.connect(self.process_audio)
+        self.btn_cancel_process.clicked.connect(self.cancel_processing)
 
     def setup_mods_tab(self):
         layout = QVBoxLayout()
@@ -202,12 +641,20 @@ class MainWindow(QMainWindow):
         profile_buttons_layout = QHBoxLayout()
         profile_buttons_layout.addWidget(self.btn_save_profile)
         profile_buttons_layout.addWidget(self.btn_delete_profile)
+
+        self.btn_restore_profile = QPushButton("Восстановить оригиналы профиля")
+        self.btn_restore_all = QPushButton("Восстановить все оригиналы")
+
+        restore_buttons_layout = QHBoxLayout()
+        restore_buttons_layout.addWidget(self.btn_restore_profile)
+        restore_buttons_layout.addWidget(self.btn_restore_all)
         
         profile_layout.addWidget(QLabel("Текущие профили:"))
         profile_layout.addWidget(self.profile_combo)
         profile_layout.addWidget(QLabel("Новый профиль:"))
         profile_layout.addWidget(self.profile_name_edit)
         profile_layout.addLayout(profile_buttons_layout)
+        profile_layout.addLayout(restore_buttons_layout)
         profile_group.setLayout(profile_layout)
 
         # Группа пакетной обработки
@@ -216,6 +663,7 @@ class MainWindow(QMainWindow):
         
         self.batch_progress = QProgressBar()
         self.batch_status = QLabel("Выберите профили для обработки")
+        self.batch_stats_label = QLabel("")
         
         self.profiles_to_process = QListWidget()
         self.profiles_to_process.setSelectionMode(QListWidget.SelectionMode.MultiSelection)
@@ -223,6 +671,8 @@ class MainWindow(QMainWindow):
         self.btn_add_to_batch = QPushButton("Добавить в пакет")
         self.btn_remove_from_batch = QPushButton("Удалить из пакета")
         self.btn_run_batch = QPushButton("Выполнить пакетную обработку")
+        self.btn_cancel_batch = QPushButton("Отменить пакетную обработку")
+        self.btn_cancel_batch.setEnabled(False)
         
         batch_buttons_layout = QHBoxLayout()
         batch_buttons_layout.addWidget(self.btn_add_to_batch)
@@ -230,10 +680,12 @@ class MainWindow(QMainWindow):
         
         batch_layout.addWidget(self.batch_progress)
         batch_layout.addWidget(self.batch_status)
+        batch_layout.addWidget(self.batch_stats_label)
         batch_layout.addWidget(QLabel("Профили в пакете:"))
         batch_layout.addWidget(self.profiles_to_process)
         batch_layout.addLayout(batch_buttons_layout)
         batch_layout.addWidget(self.btn_run_batch)
+        batch_layout.addWidget(self.btn_cancel_batch)
         batch_group.setLayout(batch_layout)
 
         layout.addWidget(profile_group)
@@ -243,20 +695,23 @@ class MainWindow(QMainWindow):
         # Подключение сигналов
         self.btn_save_profile.clicked.connect(self.save_profile)
         self.btn_delete_profile.clicked.connect(self.delete_profile)
+        self.btn_restore_profile.clicked.connect(self.restore_profile)
+        self.btn_restore_all.clicked.connect(self.restore_all)
         self.btn_add_to_batch.clicked.connect(self.add_to_batch)
         self.btn_remove_from_batch.clicked.connect(self.remove_from_batch)
         self.btn_run_batch.clicked.connect(self.run_batch_processing)
+        self.btn_cancel_batch.clicked.connect(self.cancel_batch_processing)
 
     def setup_style(self):
         self.setStyleSheet("""
             QMainWindow, QWidget { background-color: #2b2b2b; }
-            QLabel { color: #ffffff; font-size: 14px; }
+            QLabel, QCheckBox { color: #ffffff; font-size: 14px; }
             QPushButton {
                 background-color: #4CAF50; color: white; border: none;
                 padding: 8px; font-size: 13px; border-radius: 4px;
             }
             QPushButton:hover { background-color: #45a049; }
-            QListWidget, QLineEdit, QComboBox {
+            QListWidget, QListView, QLineEdit, QComboBox {
                 background-color: #3c3c3c; color: #ffffff;
                 border: 1px solid #555; padding: 5px;
             }
@@ -277,36 +732,75 @@ class MainWindow(QMainWindow):
         if path:
             self.current_game_path = path
             self.game_path_label.setText(f"Путь к игре: {path}")
-            self.original_audio_list.clear()
             self.replacement_audio_list.clear()
-            self.status_label.setText("Выбрана новая игра. Нажмите 'Сканировать аудиофайлы'")
+            if not self.show_indexed_files():
+                self.status_label.setText("Выбрана новая игра. Нажмите 'Сканировать аудиофайлы'")
+
+    def show_indexed_files(self):
+        # Уже проиндексированная игра открывается сразу, без обхода диска
+        self.audio_files = self.scan_index.load(self.current_game_path)
+        self.audio_model.set_paths(list(self.audio_files))
+        if self.audio_files:
+            self.status_label.setText(
+                f"Из индекса загружено {len(self.audio_files)} аудиофайлов. "
+                "Нажмите 'Сканировать аудиофайлы' для обновления")
+        return bool(self.audio_files)
 
     def scan_audio_files(self):
         if not self.current_game_path:
             QMessageBox.warning(self, "Ошибка", "Сначала выберите папку с игрой!")
             return
 
-        self.scanner = AudioScanner(self.current_game_path)
+        self.audio_model.set_paths([])
+        self.audio_files = {}
+
+        self.scanner = AudioScanner(self.current_game_path, self.scan_index)
+        self.scanner.files_found.connect(self.audio_model.append_paths)
+        self.scanner.progress_updated.connect(self.on_scan_progress)
         self.scanner.scan_complete.connect(self.on_scan_complete)
-        self.scanner.progress_updated.connect(self.progress_bar.setValue)
+        # Общее число файлов заранее неизвестно, поэтому индикатор "бегущий"
+        self.progress_bar.setRange(0, 0)
+        self.btn_scan_audio.setEnabled(False)
+        self.btn_cancel_scan.setEnabled(True)
         self.status_label.setText("Сканирование аудиофайлов...")
         self.scanner.start()
 
+    def cancel_scan(self):
+        self.scanner.cancel()
+        self.btn_cancel_scan.setEnabled(False)
+
+    def on_scan_progress(self, found):
+        self.status_label.setText(f"Сканирование аудиофайлов... найдено {found}")
+
     def on_scan_complete(self, audio_files):
         self.audio_files = audio_files
-        self.original_audio_list.clear()
-        for rel_path in audio_files.keys():
-            self.original_audio_list.addItem(rel_path)
-        self.status_label.setText(f"Найдено {len(audio_files)} аудиофайлов")
+        self.progress_bar.setRange(0, 100)
         self.progress_bar.setValue(0)
+        self.btn_scan_audio.setEnabled(True)
+        self.btn_cancel_scan.setEnabled(False)
+        if self.scanner.cancelled:
+            self.status_label.setText(f"Сканирование остановлено, найдено {len(audio_files)} аудиофайлов")
+        else:
+            self.status_label.setText(f"Найдено {len(audio_files)} аудиофайлов")
+
+    def apply_audio_filter(self):
+        self.audio_model.set_filter(self.audio_filter_edit.text())
+
+    def update_audio_count(self):
+        total = self.audio_model.total_count()
+        shown = self.audio_model.rowCount()
+        if shown == total:
+            self.audio_count_label.setText(f"Файлов: {total}")
+        else:
+            self.audio_count_label.setText(f"Показано {shown} из {total}")
 
     def add_replacement(self):
-        selected_items = self.original_audio_list.selectedItems()
-        if not selected_items:
+        selected_indexes = self.original_audio_list.selectionModel().selectedIndexes()
+        if not selected_indexes:
             QMessageBox.warning(self, "Ошибка", "Выберите файл для замены!")
             return
 
-        original_rel = selected_items[0].text()
+        original_rel = self.audio_model.path_at(selected_indexes[0].row())
         files, _ = QFileDialog.getOpenFileNames(
             self, "Выберите аудиофайл для замены", "", 
             "Аудио (*.mp3 *.wav *.ogg *.flac)"
@@ -316,6 +810,66 @@ class MainWindow(QMainWindow):
             self.replacement_audio_list.addItem(f"{original_rel} -> {files[0]}")
             self.status_label.setText(f"Добавлена замена для {original_rel}")
 
+    def map_replacement_folder(self):
+        if not self.audio_files:
+            QMessageBox.warning(self, "Ошибка", "Сначала просканируйте аудиофайлы игры!")
+            return
+
+        folder = QFileDialog.getExistingDirectory(self, "Выберите папку с записями")
+        if not folder:
+            return
+
+        try:
+            rules = load_rename_rules()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось прочитать rename_rules.json: {e}")
+            return
+
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            # Правила влияют и на ключи оригиналов, поэтому их смена тоже
+            # требует перестроить индекс
+            rules_key = [(pattern.pattern, replace) for pattern, replace in rules]
+            if (self.mapper is None or self.mapper_files is not self.audio_files
+                    or self.mapper_rules != rules_key):
+                self.mapper = ReplacementMapper(self.audio_files, rules)
+                self.mapper_files = self.audio_files
+                self.mapper_rules = rules_key
+            result = self.mapper.match_folder(folder)
+
+            # Найденные пары дополняют список, заменяя записи для тех же оригиналов
+            replacements = {}
+            for i in range(self.replacement_audio_list.count()):
+                original_rel, replacement_path = self.replacement_audio_list.item(i).text().split(" -> ")
+                replacements[original_rel] = replacement_path
+            replacements.update(result['matched'])
+            self.replacement_audio_list.clear()
+            self.replacement_audio_list.addItems(
+                [f"{original_rel} -> {replacement_path}"
+                 for original_rel, replacement_path in replacements.items()])
+        finally:
+            QApplication.restoreOverrideCursor()
+
+        unmatched, ambiguous = result['unmatched'], result['ambiguous']
+        self.status_label.setText(
+            f"Сопоставлено {len(result['matched'])}, не найдено {len(unmatched)}, "
+            f"неоднозначно {len(ambiguous)}")
+        if unmatched or ambiguous:
+            box = QMessageBox(self)
+            box.setIcon(QMessageBox.Icon.Warning)
+            box.setWindowTitle("Автосопоставление")
+            box.setText(
+                f"Сопоставлено записей: {len(result['matched'])}\n"
+                f"Без пары в игре: {len(unmatched)}\n"
+                f"Неоднозначных: {len(ambiguous)}")
+            details = [f"Не найдено: {path}" for path in unmatched]
+            details += [
+                f"Неоднозначно: {path} -> {', '.join(candidates)}"
+                for path, candidates in ambiguous.items()
+            ]
+            box.setDetailedText("\n".join(details))
+            box.exec()
+
     def remove_replacement(self):
         selected_items = self.replacement_audio_list.selectedItems()
         if not selected_items:
@@ -326,33 +880,109 @@ class MainWindow(QMainWindow):
             self.replacement_audio_list.takeItem(self.replacement_audio_list.row(item))
         self.status_label.setText("Замена удалена")
 
-    def play_original_audio(self, item):
-        rel_path = item.text()
-        full_path = self.audio_files[rel_path]
-        
+    def original_full_path(self, row):
+        return os.path.join(self.current_game_path, self.audio_model.path_at(row))
+
+    def play_preview(self, path, text):
         try:
-            media = self.vlc_instance.media_new(full_path)
-            self.vlc_player.set_media(media)
-            self.vlc_player.play()
-            self.status_label.setText(f"Воспроизведение: {rel_path}")
+            backend = self.preview.play(path)
+            self.status_label.setText(f"{text} ({backend})")
         except Exception as e:
             self.status_label.setText(f"Ошибка воспроизведения: {str(e)}")
 
+    def play_original_audio(self, index):
+        rel_path = self.audio_model.path_at(index.row())
+        self.play_preview(self.original_full_path(index.row()), f"Воспроизведение: {rel_path}")
+
+    def play_replacement(self, replacement_path):
+        self.play_preview(
+            replacement_path, f"Воспроизведение замены: {os.path.basename(replacement_path)}")
+
     def preview_replacement(self):
         selected_items = self.replacement_audio_list.selectedItems()
         if not selected_items:
             QMessageBox.warning(self, "Ошибка", "Выберите замену для прослушивания!")
             return
 
-        replacement_path = selected_items[0].text().split(" -> ")[1]
-        
-        try:
-            media = self.vlc_instance.media_new(replacement_path)
-            self.vlc_player.set_media(media)
-            self.vlc_player.play()
-            self.status_label.setText(f"Воспроизведение замены: {os.path.basename(replacement_path)}")
-        except Exception as e:
-            self.status_label.setText(f"Ошибка воспроизведения: {str(e)}")
+        self.play_replacement(selected_items[0].text().split(" -> ")[1])
+
+    def show_waveforms(self, original_rel, replacement_path=None):
+        original_path = original_audio_path(self.current_game_path, original_rel, self.backup_store)
+        self.waveform_view.show_files(original_path, replacement_path)
+        for path in (replacement_path, original_path):
+            if path:
+                self.analyzer.request(path)
+
+    def on_original_selected(self, current, previous):
+        if not current.isValid():
+            return
+        row = current.row()
+        self.show_waveforms(self.audio_model.path_at(row))
+        # Соседние строки декодируются заранее, текущая - первой
+        rows = [r for r in (row - 1, row + 1, row) if 0 <= r < self.audio_model.rowCount()]
+        self.preview.preload([self.original_full_path(r) for r in rows])
+        if self.autoplay_checkbox.isChecked():
+            self.play_original_audio(current)
+
+    def on_replacement_selected(self, current, previous):
+        if current is None:
+            return
+        original_rel, replacement_path = current.text().split(" -> ")
+        self.show_waveforms(original_rel, replacement_path)
+        row = self.replacement_audio_list.row(current)
+        rows = [r for r in (row - 1, row + 1, row) if 0 <= r < self.replacement_audio_list.count()]
+        self.preview.preload(
+            [self.replacement_audio_list.item(r).text().split(" -> ")[1] for r in rows])
+        if self.autoplay_checkbox.isChecked():
+            self.play_replacement(replacement_path)
+
+    def check_replacement_durations(self):
+        if self.replacement_audio_list.count() == 0:
+            QMessageBox.warning(self, "Ошибка", "Нет файлов для замены!")
+            return
+
+        pairs = []
+        for i in range(self.replacement_audio_list.count()):
+            original_rel, replacement_path = self.replacement_audio_list.item(i).text().split(" -> ")
+            pairs.append((
+                original_rel,
+                original_audio_path(self.current_game_path, original_rel, self.backup_store),
+                replacement_path))
+
+        self.duration_checker = DurationChecker(pairs, self.analysis_cache, self.workers_spin.value())
+        self.duration_checker.progress_updated.connect(self.progress_bar.setValue)
+        self.duration_checker.check_complete.connect(self.on_durations_checked)
+        self.btn_check_durations.setEnabled(False)
+        self.duration_checker.start()
+        self.status_label.setText(f"Анализ длительностей: {len(pairs)} замен...")
+
+    def on_durations_checked(self, result):
+        self.btn_check_durations.setEnabled(True)
+        self.progress_bar.setValue(0)
+        if self.duration_checker.cancelled:
+            return
+
+        # Подсветка сбрасывается у исправленных строк и ставится у проблемных
+        mismatches = {label: (original, replacement)
+                      for label, original, replacement in result['mismatches']}
+        errors = dict(result['errors'])
+        for i in range(self.replacement_audio_list.count()):
+            item = self.replacement_audio_list.item(i)
+            original_rel = item.text().split(" -> ")[0]
+            if original_rel in mismatches:
+                original, replacement = mismatches[original_rel]
+                item.setForeground(QColor('#e74c3c'))
+                item.setToolTip(
+                    f"Замена длиннее оригинала: {replacement:.2f} с вместо {original:.2f} с")
+            elif original_rel in errors:
+                item.setForeground(QColor('#f39c12'))
+                item.setToolTip(f"Ошибка анализа: {errors[original_rel]}")
+            else:
+                item.setData(Qt.ItemDataRole.ForegroundRole, None)
+                item.setToolTip("")
+        self.status_label.setText(
+            f"Проверено замен: {self.replacement_audio_list.count()}, "
+            f"длиннее оригинала: {len(mismatches)}, ошибок анализа: {len(errors)}")
 
     def process_audio(self):
         if not self.current_game_path:
@@ -374,26 +1004,66 @@ class MainWindow(QMainWindow):
             'replacements': replacements
         }
 
-        self.processor = AudioProcessor([task])
+        self.processor = AudioProcessor(
+            [task], self.workers_spin.value(), self.transcode_cache,
+            self.force_checkbox.isChecked(), self.scan_index, self.backup_store,
+            self.batch_checkbox.isChecked(), self.job_journal,
+            loudness=self.loudness_cache if self.normalize_checkbox.isChecked() else None)
         self.processor.progress_updated.connect(self.progress_bar.setValue)
         self.processor.status_message.connect(self.status_label.setText)
+        self.processor.stats_updated.connect(
+            lambda stats: self.run_stats_label.setText(format_run_stats(stats)))
         self.processor.finished.connect(self.on_processing_finished)
+        self.btn_process.setEnabled(False)
+        self.btn_cancel_process.setEnabled(True)
         self.processor.start()
         self.status_label.setText("Начата обработка...")
 
+    def cancel_processing(self):
+        self.processor.cancel()
+        self.btn_cancel_process.setEnabled(False)
+        self.status_label.setText("Отмена обработки...")
+
     def on_processing_finished(self):
-        QMessageBox.information(self, "Готово", "Все аудиофайлы успешно заменены!")
+        self.btn_process.setEnabled(True)
+        self.btn_cancel_process.setEnabled(False)
+        self.show_processing_result(self.processor, "Все аудиофайлы успешно заменены!")
         self.progress_bar.setValue(0)
 
+    def update_cache_stats(self):
+        stats = self.transcode_cache.stats()
+        self.cache_stats_label.setText(
+            f"Кэш конвертаций: попаданий {stats['hits']}, промахов {stats['misses']}, "
+            f"сэкономлено {format_size(stats['bytes_saved'])}, "
+            f"занято {format_size(stats['size'])} ({stats['entries']} файлов)")
+        loudness = self.loudness_cache.stats()
+        if loudness['measured'] or loudness['hits']:
+            self.cache_stats_label.setText(
+                self.cache_stats_label.text()
+                + f"\nГромкость: измерено {loudness['measured']}, из кэша {loudness['hits']}")
+
+    def show_processing_result(self, processor, success_text):
+        self.update_cache_stats()
+        report_text = ""
+        if processor.engine.report_paths:
+            report_text = f"\n\nОтчет: {os.path.abspath(processor.engine.report_paths[0])}"
+        if processor.engine.cancelled:
+            QMessageBox.information(self, "Отменено", "Обработка отменена пользователем")
+        elif processor.engine.errors:
+            details = "\n".join(f"{rel}: {error}" for rel, error in processor.engine.errors[:50])
+            QMessageBox.warning(
+                self, "Завершено с ошибками",
+                f"Не удалось обработать файлов: {len(processor.engine.errors)}\n\n{details}"
+                f"{report_text}"
+            )
+        else:
+            QMessageBox.information(self, "Готово", success_text)
+
     # Функции для работы с профилями модов
     def load_profiles(self):
-        try:
-            with open('mod_profiles.json', 'r') as f:
-                self.mod_profiles = json.load(f)
-            self.profile_combo.clear()
-            self.profile_combo.addItems(self.mod_profiles.keys())
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.mod_profiles = {}
+        # Замены профиля загружаются только при его выборе (load_profile)
+        self.profile_combo.clear()
+        self.profile_combo.addItems(self.profile_store.names())
 
     def save_profile(self):
         profile_name = self.profile_name_edit.text()
@@ -411,23 +1081,19 @@ class MainWindow(QMainWindow):
             original_rel, replacement_path = text.split(" -> ")
             replacements[original_rel] = replacement_path
 
-        self.mod_profiles[profile_name] = {
-            'game_path': self.current_game_path,
-            'replacements': replacements
-        }
+        self.profile_store.save_profile(profile_name, self.current_game_path, replacements)
 
-        with open('mod_profiles.json', 'w') as f:
-            json.dump(self.mod_profiles, f)
-
-        self.profile_combo.addItem(profile_name)
+        if self.profile_combo.findText(profile_name) == -1:
+            self.profile_combo.addItem(profile_name)
         self.profile_name_edit.clear()
         self.status_label.setText(f"Профиль '{profile_name}' сохранен")
 
     def load_profile(self, profile_name):
-        if profile_name in self.mod_profiles:
-            profile = self.mod_profiles[profile_name]
+        profile = self.profile_store.get(profile_name) if profile_name else None
+        if profile is not None:
             self.current_game_path = profile['game_path']
             self.game_path_label.setText(f"Путь к игре: {self.current_game_path}")
+            self.show_indexed_files()
             
             self.replacement_audio_list.clear()
             for original_rel, replacement_path in profile['replacements'].items():
@@ -447,13 +1113,45 @@ class MainWindow(QMainWindow):
         )
         
         if reply == QMessageBox.StandardButton.Yes:
-            self.mod_profiles.pop(profile_name)
-            with open('mod_profiles.json', 'w') as f:
-                json.dump(self.mod_profiles, f)
+            self.profile_store.delete(profile_name)
             
             self.profile_combo.removeItem(self.profile_combo.currentIndex())
             self.status_label.setText(f"Профиль '{profile_name}' удален")
 
+    def restore_profile(self):
+        profile_name = self.profile_combo.currentText()
+        profile = self.profile_store.get(profile_name) if profile_name else None
+        if profile is None:
+            QMessageBox.warning(self, "Ошибка", "Выберите профиль!")
+            return
+        self.run_restore(
+            f"Вернуть оригиналы файлов, замененных профилем '{profile_name}'?",
+            profile['game_path'], list(profile['replacements']))
+
+    def restore_all(self):
+        self.run_restore("Вернуть оригиналы во всех играх?", None, None)
+
+    def run_restore(self, question, game_path, targets):
+        reply = QMessageBox.question(
+            self, "Подтверждение", question,
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            restored, errors = restore_backups(game_path, targets, self.backup_store)
+        finally:
+            QApplication.restoreOverrideCursor()
+
+        if errors:
+            details = "\n".join(f"{rel}: {error}" for rel, error in errors[:50])
+            QMessageBox.warning(
+                self, "Восстановление",
+                f"Восстановлено файлов: {restored}, ошибок: {len(errors)}\n\n{details}")
+        self.status_label.setText(f"Восстановлено оригиналов: {restored}")
+
     # Функции пакетной обработки
     def add_to_batch(self):
         selected_items = [self.profile_combo.itemText(i) for i in range(self.profile_combo.count())
@@ -488,20 +1186,84 @@ class MainWindow(QMainWindow):
         tasks = []
         for i in range(self.profiles_to_process.count()):
             profile_name = self.profiles_to_process.item(i).text()
-            tasks.append(self.mod_profiles[profile_name])
+            profile = self.profile_store.get(profile_name)
+            if profile is not None:
+                tasks.append(profile)
 
-        self.batch_processor = AudioProcessor(tasks)
+        # Перед запуском показываем, сколько работы останется после объединения
+        plan = plan_tasks(tasks, self.scan_index)
+        reply = QMessageBox.question(
+            self, "План обработки",
+            f"Замен в выбранных профилях: {plan['requested']}\n"
+            f"Файлов игр к замене: {plan['planned']}\n"
+            f"Конвертаций после объединения одинаковых: {plan['encodes']}\n\n"
+            "Начать обработку?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            return
+
+        self.start_batch(tasks, self.force_checkbox.isChecked(), self.batch_checkbox.isChecked(),
+                         self.normalize_checkbox.isChecked(), plan=plan)
+
+    def start_batch(self, tasks, force, batch, normalize, run_id=None, plan=None):
+        self.batch_processor = AudioProcessor(
+            tasks, self.workers_spin.value(), self.transcode_cache, force,
+            self.scan_index, self.backup_store, batch, self.job_journal, run_id, plan,
+            self.loudness_cache if normalize else None)
         self.batch_processor.progress_updated.connect(self.batch_progress.setValue)
         self.batch_processor.status_message.connect(self.batch_status.setText)
+        self.batch_processor.stats_updated.connect(
+            lambda stats: self.batch_stats_label.setText(format_run_stats(stats)))
         self.batch_processor.finished.connect(self.on_batch_complete)
+        self.btn_run_batch.setEnabled(False)
+        self.btn_cancel_batch.setEnabled(True)
         self.batch_processor.start()
         self.batch_status.setText("Пакетная обработка начата...")
 
+    def offer_resume(self):
+        runs = self.job_journal.unfinished()
+        if not runs:
+            return
+        run_id, created, total, remaining = runs[0]
+        started = time.strftime('%d.%m.%Y %H:%M', time.localtime(created))
+        reply = QMessageBox.question(
+            self, "Прерванная обработка",
+            f"Обработка, начатая {started}, не была завершена: осталось {remaining} из {total} замен.\n"
+            "Продолжить с места остановки?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if reply != QMessageBox.StandardButton.Yes:
+            self.job_journal.discard(run_id)
+            return
+
+        # Продолжение идет с параметрами прерванного запуска
+        tasks, options = self.job_journal.pending(run_id)
+        self.tabs.setCurrentWidget(self.mods_tab)
+        self.start_batch(tasks, options.get('force', False), options.get('batch', True),
+                         options.get('normalize', False), run_id)
+
+    def cancel_batch_processing(self):
+        self.batch_processor.cancel()
+        self.btn_cancel_batch.setEnabled(False)
+        self.batch_status.setText("Отмена пакетной обработки...")
+
     def on_batch_complete(self):
-        QMessageBox.information(self, "Готово", "Пакетная обработка завершена!")
+        self.btn_run_batch.setEnabled(True)
+        self.btn_cancel_batch.setEnabled(False)
+        self.show_processing_result(self.batch_processor, "Пакетная обработка завершена!")
         self.batch_progress.setValue(0)
         self.batch_status.setText("Готово к новой обработке")
 
+    def closeEvent(self, event):
+        if self.duration_checker is not None:
+            self.duration_checker.cancel()
+            self.duration_checker.wait()
+        self.analyzer.stop()
+        self.analyzer.wait()
+        self.preview.shutdown()
+        super().closeEvent(event)
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = MainWindow()
@@ -0,0 +1,447 @@
+# Бенчмарки ядра GVT на синтетическом дереве игры: сканирование, применение
+# замен, сохранение/загрузка профилей, автосопоставление записей, анализ
+# волны и замена записей в архиве. Результаты
+# пишутся в JSON, чтобы прогоны разных версий можно было сравнить (--compare).
+#
+#   python benchmarks/bench_gvt.py --files 20000 --replacements 2000
+#   python benchmarks/bench_gvt.py --real-ffmpeg --output after.json --compare before.json
+#
+# По умолчанию вместо ffmpeg используется заглушка, которая просто копирует
+# вход в выход: так видно время оркестрации без времени кодирования.
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import wave
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gvt_core  # noqa: E402
+
+# Заголовок страницы Ogg с идентификатором Vorbis. Настоящий поток не нужен:
+# сканер смотрит только на имена, а в замены попадают WAV-файлы
+OGG_STUB = b'OggS\x00\x02' + bytes(20) + b'\x01\x1e\x01vorbis' + bytes(22)
+
+# Заглушка ffmpeg: i-й вход (-i) копируется в i-й выход. Выход - аргумент
+# не после опции со значением. Запуск интерпретатора по стоимости близок
+# к запуску настоящего ffmpeg, поэтому видна и цена процесса на файл
+FAKE_FFMPEG_PY = '''import shutil, sys
+args = sys.argv[1:]
+flags = {'-y', '-nostdin', '-hide_banner'}
+inputs, outputs = [], []
+for prev, arg in zip([''] + args, args):
+    if prev == '-i':
+        inputs.append(arg)
+    elif not arg.startswith('-') and (not prev.startswith('-') or prev in flags):
+        outputs.append(arg)
+if len(inputs) != len(outputs):
+    sys.exit('inputs/outputs mismatch')
+for source, target in zip(inputs, outputs):
+    shutil.copyfile(source, target)
+'''
+
+
+def write_wav(path, frames=64, sample_rate=22050, value=0):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(value.to_bytes(2, 'little', signed=True) * frames)
+
+
+def make_fake_ffmpeg(directory):
+    script = os.path.join(directory, 'fake_ffmpeg.py')
+    with open(script, 'w') as f:
+        f.write(FAKE_FFMPEG_PY)
+    if os.name == 'nt':
+        path = os.path.join(directory, 'fake_ffmpeg.cmd')
+        with open(path, 'w') as f:
+            f.write(f'@"{sys.executable}" "{script}" %*\n')
+    else:
+        path = os.path.join(directory, 'fake_ffmpeg')
+        with open(path, 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+        os.chmod(path, 0o755)
+    return path
+
+
+def make_game_tree(root, files, depth, fanout):
+    # Файлы раскладываются по листовым каталогам дерева глубины depth;
+    # каждый второй файл - OGG, остальные - WAV
+    leaves = ['']
+    for level in range(depth):
+        if len(leaves) * fanout > files:
+            break
+        leaves = [os.path.join(leaf, f"d{level}_{i}") for leaf in leaves for i in range(fanout)]
+    for leaf in leaves:
+        os.makedirs(os.path.join(root, leaf), exist_ok=True)
+
+    relative_paths = []
+    for i in range(files):
+        ext = '.ogg' if i % 2 else '.wav'
+        relative_path = os.path.join(leaves[i % len(leaves)], f"vo_line_{i:06d}{ext}")
+        full_path = os.path.join(root, relative_path)
+        if ext == '.wav':
+            write_wav(full_path)
+        else:
+            with open(full_path, 'wb') as f:
+                f.write(OGG_STUB)
+        relative_paths.append(relative_path)
+    return relative_paths
+
+
+def make_replacements(directory, targets):
+    os.makedirs(directory, exist_ok=True)
+    replacements = {}
+    for i, original_rel in enumerate(targets):
+        path = os.path.join(directory, f"rec_{i:06d}.wav")
+        # Другая частота, чтобы замена шла через ffmpeg, а не копированием
+        write_wav(path, frames=96, sample_rate=44100, value=i % 1000)
+        replacements[original_rel] = path
+    return replacements
+
+
+def make_profiles(game_path, count, entries):
+    return {
+        f"profile_{p}": {
+            'game_path': game_path,
+            'replacements': {
+                os.path.join('sound', 'vo', f"npc_{p}_{i:06d}.ogg"):
+                    os.path.join('C:\\', 'dub', f"profile_{p}", f"line_{i:06d}.wav")
+                for i in range(entries)
+            },
+        }
+        for p in range(count)
+    }
+
+
+def summarize(samples, items):
+    best = min(samples)
+    return {
+        'runs': [round(sample, 6) for sample in samples],
+        'best': round(best, 6),
+        'median': round(statistics.median(samples), 6),
+        'items': items,
+        'items_per_s': round(items / best, 1) if best > 0 else None,
+    }
+
+
+def reset_dirs(*paths):
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def bench_scan(game_path, file_count, repeat):
+    results = {}
+    samples = []
+    for _ in range(repeat):
+        reset_dirs('scan_index.sqlite', 'scan_index.sqlite-wal', 'scan_index.sqlite-shm')
+        index = gvt_core.ScanIndex()
+        start = time.perf_counter()
+        found = sum(1 for _ in index.scan(game_path, gvt_core.AUDIO_EXTENSIONS))
+        samples.append(time.perf_counter() - start)
+        assert found == file_count, (found, file_count)
+    results['scan_cold'] = summarize(samples, file_count)
+
+    # Повторное сканирование без изменений - работа индекса по mtime каталогов
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sum(1 for _ in index.scan(game_path, gvt_core.AUDIO_EXTENSIONS))
+        samples.append(time.perf_counter() - start)
+    results['scan_warm'] = summarize(samples, file_count)
+    return results
+
+
+def run_processor(tasks, workers, batch=True):
+    processor = gvt_core.ReplacementProcessor(
+        tasks, workers, gvt_core.TranscodeCache(), index=gvt_core.ScanIndex(), report_dir=None,
+        batch=batch)
+    start = time.perf_counter()
+    processor.run()
+    elapsed = time.perf_counter() - start
+    if processor.errors:
+        raise RuntimeError(f"Ошибки при применении: {processor.errors[:3]}")
+    return elapsed, processor
+
+
+def bench_apply(game_path, replacements, workers, repeat):
+    tasks = [{'game_path': game_path, 'replacements': replacements}]
+    count = len(replacements)
+    cold, single, cached, noop = [], [], [], []
+    for _ in range(repeat):
+        # Холодный прогон с ffmpeg на каждый файл - для сравнения с пачками
+        reset_dirs(gvt_core.CACHE_DIR, gvt_core.MANIFEST_DIR)
+        elapsed, _ = run_processor(tasks, workers, batch=False)
+        single.append(elapsed)
+        gvt_core.restore_backups(game_path)
+
+        # Холодный прогон: пустые кэш, манифест и хранилище копий
+        reset_dirs(gvt_core.CACHE_DIR, gvt_core.MANIFEST_DIR)
+        elapsed, _ = run_processor(tasks, workers)
+        cold.append(elapsed)
+
+        # Без изменений: все замены пропускаются по манифесту
+        elapsed, processor = run_processor(tasks, workers)
+        assert processor.skipped == count, (processor.skipped, count)
+        noop.append(elapsed)
+
+        # После отката: результат берется из кэша конвертаций
+        gvt_core.restore_backups(game_path)
+        elapsed, _ = run_processor(tasks, workers)
+        cached.append(elapsed)
+        gvt_core.restore_backups(game_path)
+
+    return {
+        'apply_cold': summarize(cold, count),
+        'apply_cold_single': summarize(single, count),
+        'apply_noop': summarize(noop, count),
+        'apply_cached': summarize(cached, count),
+    }
+
+
+def bench_profiles(game_path, count, entries, repeat):
+    profiles = make_profiles(game_path, count, entries)
+    db_files = [gvt_core.PROFILES_DB + suffix for suffix in ('', '-wal', '-shm')]
+    save, load, open_one, save_one = [], [], [], []
+    for _ in range(repeat):
+        reset_dirs(*db_files)
+        store = gvt_core.ProfileStore()
+        start = time.perf_counter()
+        store.save(profiles)
+        save.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        loaded = store.load()
+        load.append(time.perf_counter() - start)
+        assert len(loaded) == count
+
+        # Запуск GUI и выбор одного профиля: список имен и замены только его
+        start = time.perf_counter()
+        names = store.names()
+        profile = store.get(names[-1])
+        open_one.append(time.perf_counter() - start)
+
+        # Сохранение одного профиля не перезаписывает остальные
+        start = time.perf_counter()
+        store.save_profile(names[-1], profile['game_path'], profile['replacements'])
+        save_one.append(time.perf_counter() - start)
+    return {
+        'profiles_save': summarize(save, count * entries),
+        'profiles_load': summarize(load, count * entries),
+        'profile_open': summarize(open_one, entries),
+        'profile_save_one': summarize(save_one, entries),
+    }
+
+
+def bench_map(relative_paths, repeat):
+    # Записи называются иначе, чем оригиналы (префикс, регистр, дефисы),
+    # и приводятся к ним правилами переименования; диск не участвует
+    rules = [(re.compile('^ru_'), '')]
+    recordings = []
+    for relative_path in relative_paths:
+        folder, name = os.path.split(relative_path)
+        name = 'RU-' + os.path.splitext(name)[0].upper().replace('_', '-') + '.wav'
+        recordings.append((os.path.join(folder, name), os.path.join('dub', folder, name)))
+    build, match = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        mapper = gvt_core.ReplacementMapper(relative_paths, rules)
+        build.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        result = mapper.match(recordings)
+        match.append(time.perf_counter() - start)
+        assert len(result['matched']) == len(relative_paths), len(result['matched'])
+    return {
+        'map_index': summarize(build, len(relative_paths)),
+        'map_match': summarize(match, len(recordings)),
+    }
+
+
+def bench_analysis(directory, count, repeat):
+    # Пятисекундные реплики: холодный анализ, повтор из памяти и из SQLite
+    # (новый экземпляр кэша, как при следующем запуске программы)
+    reset_dirs(directory)
+    os.makedirs(directory)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f'line_{i:05d}.wav')
+        write_wav(path, frames=5 * 22050, value=1000 + i % 1000)
+        paths.append(path)
+    cold, memory, disk = [], [], []
+    for _ in range(repeat):
+        db_path = os.path.join(directory, 'analysis.sqlite')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        cache = gvt_core.AnalysisCache(db_path)
+        for samples, current in ((cold, cache), (memory, cache),
+                                 (disk, gvt_core.AnalysisCache(db_path))):
+            start = time.perf_counter()
+            for path in paths:
+                current.analyze(path)
+            samples.append(time.perf_counter() - start)
+    return {
+        'analysis_cold': summarize(cold, count),
+        'analysis_memory': summarize(memory, count),
+        'analysis_disk': summarize(disk, count),
+    }
+
+
+def bench_archive(directory, count, replacements, repeat):
+    # Пакет из односекундных реплик (половина без сжатия, половина deflate):
+    # чтение всех записей и перезапись пакета с заменой части из них
+    reset_dirs(directory)
+    os.makedirs(directory)
+    source = os.path.join(directory, 'line.wav')
+    write_wav(source, frames=22050, value=1000)
+    with open(source, 'rb') as f:
+        data = f.read()
+    archive_path = os.path.join(directory, 'voice.pk3')
+    pristine_path = archive_path + '.orig'
+    with zipfile.ZipFile(pristine_path, 'w') as archive:
+        for i in range(count):
+            compression = zipfile.ZIP_STORED if i % 2 else zipfile.ZIP_DEFLATED
+            archive.writestr(f'sound/vo/line_{i:05d}.wav', data, compress_type=compression)
+    dub = os.path.join(directory, 'dub.wav')
+    write_wav(dub, frames=22050, value=2000)
+    updates = {f'sound/vo/line_{i:05d}.wav': dub for i in range(0, count, max(1, count // replacements))}
+
+    read, rewrite = [], []
+    for _ in range(repeat):
+        shutil.copyfile(pristine_path, archive_path)
+        names = [name for name, _, _ in gvt_core.list_archive(archive_path, gvt_core.AUDIO_EXTENSIONS)]
+        start = time.perf_counter()
+        for name in names:
+            with gvt_core.open_audio_data(f'{archive_path}{gvt_core.ARCHIVE_SEPARATOR}{name}') as entry:
+                len(entry)
+        read.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        gvt_core.rewrite_archive(archive_path, updates)
+        rewrite.append(time.perf_counter() - start)
+    return {
+        'archive_read': summarize(read, count),
+        'archive_rewrite': summarize(rewrite, len(updates)),
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    print(f"{'бенчмарк':<16}{'было, с':>12}{'стало, с':>12}{'изменение':>12}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['median'], result['median']
+        change = f"{(after / before - 1) * 100:+.1f}%" if before else "-"
+        print(f"{name:<16}{before:>12.4f}{after:>12.4f}{change:>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки ядра Game Voiceover Toolkit")
+    parser.add_argument('--files', type=int, default=10000, help="аудиофайлов в синтетической игре")
+    parser.add_argument('--depth', type=int, default=4, help="глубина дерева каталогов")
+    parser.add_argument('--fanout', type=int, default=8, help="подкаталогов на уровень")
+    parser.add_argument('--replacements', type=int, default=1000, help="замен в применяемом профиле")
+    parser.add_argument('--profiles', type=int, default=20, help="профилей в хранилище профилей")
+    parser.add_argument('--profile-entries', type=int, default=10000, help="замен в каждом профиле")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="параллельных конвертаций")
+    parser.add_argument('--repeat', type=int, default=3, help="повторов каждого замера")
+    parser.add_argument('--real-ffmpeg', action='store_true', help="кодировать настоящим ffmpeg")
+    parser.add_argument('--analysis-files', type=int, default=200, help="файлов для анализа волны")
+    parser.add_argument('--archive-entries', type=int, default=5000, help="записей в синтетическом архиве")
+    parser.add_argument('--archive-replacements', type=int, default=100, help="замен в архиве")
+    parser.add_argument('--only', nargs='+',
+                        choices=('scan', 'apply', 'profiles', 'map', 'analysis', 'archive'),
+                        help="запустить только указанные группы")
+    parser.add_argument('--workdir', help="папка для синтетических данных (по умолчанию временная)")
+    parser.add_argument('--output', default='bench_results.json', help="файл с результатами")
+    parser.add_argument('--compare', help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    groups = set(args.only or ('scan', 'apply', 'profiles', 'map', 'analysis', 'archive'))
+    workdir = args.workdir or tempfile.mkdtemp(prefix='gvt_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    previous_cwd = os.getcwd()
+    # Индекс, кэш, манифесты и копии ядро держит в текущей папке
+    os.chdir(workdir)
+    try:
+        if not args.real_ffmpeg:
+            gvt_core.FFMPEG = make_fake_ffmpeg(workdir)
+
+        game_path = os.path.join(workdir, 'game')
+        reset_dirs(game_path)
+        start = time.perf_counter()
+        relative_paths = make_game_tree(game_path, args.files, args.depth, args.fanout)
+        wav_targets = [path for path in relative_paths if path.endswith('.wav')]
+        replacements = make_replacements(
+            os.path.join(workdir, 'dub'), wav_targets[:args.replacements])
+        print(f"Синтетическая игра: {args.files} файлов за {time.perf_counter() - start:.2f} с",
+              file=sys.stderr)
+
+        results = {}
+        if 'scan' in groups:
+            results.update(bench_scan(game_path, args.files, args.repeat))
+        if 'apply' in groups:
+            results.update(bench_apply(game_path, replacements, args.workers, args.repeat))
+        if 'profiles' in groups:
+            results.update(bench_profiles(game_path, args.profiles, args.profile_entries, args.repeat))
+        if 'map' in groups:
+            results.update(bench_map(relative_paths, args.repeat))
+        if 'analysis' in groups:
+            if gvt_core.load_numpy() is None and not args.real_ffmpeg:
+                # Без NumPy WAV декодирует ffmpeg, а заглушка этого не умеет
+                print("Анализ волны пропущен: нужен NumPy или --real-ffmpeg", file=sys.stderr)
+            else:
+                results.update(bench_analysis(
+                    os.path.join(workdir, 'analysis'), args.analysis_files, args.repeat))
+        if 'archive' in groups:
+            results.update(bench_archive(
+                os.path.join(workdir, 'archive'), args.archive_entries,
+                args.archive_replacements, args.repeat))
+    finally:
+        os.chdir(previous_cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'encoder': 'ffmpeg' if args.real_ffmpeg else 'fake',
+            'params': {
+                'files': args.files, 'depth': args.depth, 'fanout': args.fanout,
+                'replacements': len(replacements), 'profiles': args.profiles,
+                'profile_entries': args.profile_entries, 'workers': args.workers,
+                'analysis_files': args.analysis_files, 'archive_entries': args.archive_entries,
+                'archive_replacements': args.archive_replacements, 'repeat': args.repeat,
+            },
+        },
+        'results': results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    for name, result in results.items():
+        print(f"{name:<16}{result['median']:>10.4f} с  {result['items_per_s'] or 0:>12.1f} шт/с")
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+# Консольный режим Game Voiceover Toolkit для сборочных агентов без GUI.
+# Импортирует только ядро (gvt_core), поэтому не требует Qt и VLC.
+#
+#   python gvt_cli.py scan <путь к игре>
+#   python gvt_cli.py apply <профиль>
+#   python gvt_cli.py batch <профиль> [<профиль> ...]
+#   python gvt_cli.py restore <профиль> [<профиль> ...] | --game <путь к игре> | --all
+#   python gvt_cli.py map <путь к игре> <папка с записями> [--profile <профиль>]
+#   python gvt_cli.py resume [--discard]
+#   python gvt_cli.py check <профиль> [<профиль> ...]
+import argparse
+import os
+import sys
+import threading
+import time
+
+from gvt_core import (
+    AUDIO_EXTENSIONS, DURATION_RATIO, DURATION_SLACK, RENAME_RULES_FILE, REPORT_DIR,
+    AnalysisCache, BackupStore, JobJournal, LoudnessCache, ProfileStore, ReplacementMapper,
+    ReplacementProcessor, ScanIndex, TranscodeCache, check_durations, format_size,
+    load_rename_rules, original_audio_path, plan_tasks, restore_backups
+)
+
+
+def print_status(text):
+    print(text, file=sys.stderr, flush=True)
+
+
+def make_progress_printer():
+    last = [-1]
+
+    def on_progress(percent):
+        # Печатаем только изменения, чтобы не засорять лог
+        if percent != last[0]:
+            last[0] = percent
+            print(f"[{percent:3d}%]", file=sys.stderr, flush=True)
+    return on_progress
+
+
+def load_selected_profiles(names):
+    store = ProfileStore()
+    profiles = [store.get(name) for name in names]
+    missing = [name for name, profile in zip(names, profiles) if profile is None]
+    if missing:
+        raise SystemExit(f"Профиль не найден: {', '.join(missing)}")
+    return profiles
+
+
+def cmd_scan(args):
+    index = ScanIndex()
+    count = 0
+    for relative_path, _ in index.scan(args.game_path, AUDIO_EXTENSIONS):
+        count += 1
+        if args.list:
+            print(relative_path)
+    print_status(f"Найдено {count} аудиофайлов")
+    return 0
+
+
+def run_tasks(tasks, args, journal=None, run_id=None):
+    cache = None if args.no_cache else TranscodeCache()
+    loudness = LoudnessCache() if args.normalize else None
+    index = ScanIndex()
+    plan = plan_tasks(tasks, index)
+    print_status(
+        f"План: замен {plan['requested']}, файлов игр {plan['planned']}, "
+        f"конвертаций после объединения {plan['encodes']}")
+    processor = ReplacementProcessor(
+        tasks, args.jobs, cache, args.force,
+        on_progress=make_progress_printer(),
+        on_status=print_status if args.verbose else None,
+        index=index,
+        report_dir=None if args.no_report else args.report_dir,
+        batch=not args.no_batch,
+        journal=journal if journal is not None else JobJournal(),
+        run_id=run_id,
+        plan=plan,
+        loudness=loudness)
+    # Обработка идет в отдельном потоке, чтобы Ctrl+C в основном потоке
+    # отменял оставшиеся задачи, а не ждал их завершения
+    worker = threading.Thread(target=processor.run)
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(0.2)
+    except KeyboardInterrupt:
+        processor.cancel()
+        worker.join()
+        print_status("Обработка отменена")
+        return 130
+
+    for original_rel, error in processor.errors:
+        print_status(f"Ошибка: {original_rel}: {error}")
+    summary = processor.report.summary()
+    phases = summary['phase_seconds']
+    print_status(
+        f"Обработано замен: {summary['done']}, "
+        f"пропущено без изменений: {summary['skipped']}, ошибок: {len(processor.errors)}")
+    print_status(
+        f"Время: {summary['elapsed_s']:.2f} с, {summary['files_per_s']:.1f} файл/с, "
+        f"{summary['input_mb_per_s']:.2f} МБ/с на входе; фазы: "
+        + ", ".join(f"{phase} {seconds:.2f} с" for phase, seconds in phases.items()))
+    if processor.report_paths:
+        print_status(f"Отчет: {', '.join(processor.report_paths)}")
+    if cache is not None:
+        stats = cache.stats()
+        print_status(
+            f"Кэш конвертаций: попаданий {stats['hits']}, промахов {stats['misses']}, "
+            f"сэкономлено {format_size(stats['bytes_saved'])}")
+    if loudness is not None:
+        stats = loudness.stats()
+        print_status(f"Громкость: измерено {stats['measured']}, из кэша {stats['hits']}")
+    return 1 if processor.errors else 0
+
+
+def cmd_apply(args):
+    return run_tasks(load_selected_profiles([args.profile]), args)
+
+
+def cmd_batch(args):
+    return run_tasks(load_selected_profiles(args.profiles), args)
+
+
+def cmd_resume(args):
+    journal = JobJournal()
+    runs = journal.unfinished()
+    if not runs:
+        print_status("Прерванных запусков нет")
+        return 0
+    run_id, created, total, remaining = runs[0]
+    started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))
+    if args.discard:
+        journal.discard(run_id)
+        print_status(f"Запуск от {started} закрыт без продолжения")
+        return 0
+
+    tasks, options = journal.pending(run_id)
+    print_status(f"Продолжение запуска от {started}: осталось {remaining} из {total} замен")
+    # Продолжение идет с теми же параметрами, что и прерванный запуск
+    args.force = options.get('force', False)
+    args.no_batch = not options.get('batch', True)
+    args.normalize = options.get('normalize', False)
+    return run_tasks(tasks, args, journal, run_id)
+
+
+def cmd_restore(args):
+    if args.all:
+        targets = [(None, None)]
+    elif args.game:
+        targets = [(args.game, None)]
+    elif args.profiles:
+        targets = [
+            (profile['game_path'], list(profile['replacements']))
+            for profile in load_selected_profiles(args.profiles)
+        ]
+    else:
+        raise SystemExit("Укажите профили, --game или --all")
+
+    failed = False
+    for game_path, files in targets:
+        restored, errors = restore_backups(game_path, files)
+        for original_rel, error in errors:
+            print_status(f"Ошибка: {original_rel}: {error}")
+        print_status(f"{game_path or 'Все игры'}: восстановлено файлов: {restored}")
+        failed = failed or bool(errors)
+    return 1 if failed else 0
+
+
+def cmd_map(args):
+    # В профиль пишутся абсолютные пути, как при выборе папок в GUI
+    game_path = os.path.abspath(args.game_path)
+    originals = [relative_path for relative_path, _ in ScanIndex().scan(game_path, AUDIO_EXTENSIONS)]
+    mapper = ReplacementMapper(originals, load_rename_rules(args.rules))
+    result = mapper.match_folder(os.path.abspath(args.folder))
+
+    for path in result['unmatched']:
+        print_status(f"Не найдено: {path}")
+    for path, candidates in result['ambiguous'].items():
+        print_status(f"Неоднозначно: {path} -> {', '.join(candidates)}")
+    print_status(
+        f"Сопоставлено {len(result['matched'])}, не найдено {len(result['unmatched'])}, "
+        f"неоднозначно {len(result['ambiguous'])}")
+
+    if args.profile:
+        # Пары добавляются к заменам профиля, если он уже есть для этой игры
+        store = ProfileStore()
+        profile = store.get(args.profile)
+        replacements = {}
+        if profile is not None and profile['game_path'] == game_path:
+            replacements = profile['replacements']
+        replacements.update(result['matched'])
+        store.save_profile(args.profile, game_path, replacements)
+        print_status(f"Профиль '{args.profile}' сохранен: {len(replacements)} замен")
+    else:
+        for original_rel, replacement_path in result['matched'].items():
+            print(f"{original_rel} -> {replacement_path}")
+    return 0
+
+
+def cmd_check(args):
+    backups = BackupStore()
+    pairs = [
+        (original_rel, original_audio_path(profile['game_path'], original_rel, backups), replacement)
+        for profile in load_selected_profiles(args.profiles)
+        for original_rel, replacement in profile['replacements'].items()
+    ]
+    result = check_durations(
+        pairs, AnalysisCache(), args.jobs, on_progress=make_progress_printer(),
+        ratio=args.ratio, slack=args.slack)
+
+    for original_rel, original, replacement in result['mismatches']:
+        print(f"{original_rel}: {replacement:.2f} с вместо {original:.2f} с")
+    for original_rel, error in result['errors']:
+        print_status(f"Ошибка: {original_rel}: {error}")
+    print_status(
+        f"Проверено замен: {len(pairs)}, длиннее оригинала: {len(result['mismatches'])}, "
+        f"ошибок анализа: {len(result['errors'])}")
+    return 1 if result['mismatches'] or result['errors'] else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="gvt_cli.py", description="Game Voiceover Toolkit без графического интерфейса")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    scan = commands.add_parser('scan', help="просканировать аудиофайлы игры")
+    scan.add_argument('game_path', help="папка с игрой")
+    scan.add_argument('--list', action='store_true', help="вывести найденные пути")
+    scan.set_defaults(handler=cmd_scan)
+
+    def add_processing_options(command):
+        command.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                             help="число параллельных конвертаций (по умолчанию - число ядер)")
+        command.add_argument('--force', action='store_true',
+                             help="обработать все замены, не глядя в манифест")
+        command.add_argument('--no-cache', action='store_true',
+                             help="не использовать кэш конвертаций")
+        command.add_argument('--no-batch', action='store_true',
+                             help="запускать ffmpeg на каждый файл, без пачек мелких файлов")
+        command.add_argument('--normalize', action='store_true',
+                             help="выравнивать громкость замен по оригиналам (EBU R128)")
+        command.add_argument('-v', '--verbose', action='store_true',
+                             help="выводить сообщение по каждому файлу")
+        command.add_argument('--report-dir', default=REPORT_DIR,
+                             help="папка для отчетов JSON и Prometheus (по умолчанию reports)")
+        command.add_argument('--no-report', action='store_true', help="не сохранять отчет о запуске")
+
+    apply = commands.add_parser('apply', help="применить профиль")
+    apply.add_argument('profile', help="название профиля")
+    add_processing_options(apply)
+    apply.set_defaults(handler=cmd_apply)
+
+    batch = commands.add_parser('batch', help="пакетно применить несколько профилей")
+    batch.add_argument('profiles', nargs='+', help="названия профилей")
+    add_processing_options(batch)
+    batch.set_defaults(handler=cmd_batch)
+
+    resume = commands.add_parser('resume', help="продолжить последний прерванный запуск")
+    resume.add_argument('--discard', action='store_true',
+                        help="не продолжать, а закрыть прерванный запуск")
+    add_processing_options(resume)
+    resume.set_defaults(handler=cmd_resume)
+
+    restore = commands.add_parser('restore', help="вернуть оригинальные файлы из резервных копий")
+    restore.add_argument('profiles', nargs='*', help="профили, замены которых нужно откатить")
+    restore.add_argument('--game', help="откатить все замены в папке игры")
+    restore.add_argument('--all', action='store_true', help="откатить все замены во всех играх")
+    restore.set_defaults(handler=cmd_restore)
+
+    map_command = commands.add_parser(
+        'map', help="сопоставить папку с записями оригиналам игры по именам")
+    map_command.add_argument('game_path', help="папка с игрой")
+    map_command.add_argument('folder', help="папка с записями")
+    map_command.add_argument('--profile', help="сохранить найденные пары в профиль")
+    map_command.add_argument('--rules', default=RENAME_RULES_FILE,
+                             help="файл правил переименования (по умолчанию rename_rules.json)")
+    map_command.set_defaults(handler=cmd_map)
+
+    check = commands.add_parser('check', help="найти замены, которые заметно длиннее оригиналов")
+    check.add_argument('profiles', nargs='+', help="названия профилей")
+    check.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                       help="число параллельных анализов (по умолчанию - число ядер)")
+    check.add_argument('--ratio', type=float, default=DURATION_RATIO,
+                       help=f"во сколько раз замена может быть длиннее (по умолчанию {DURATION_RATIO})")
+    check.add_argument('--slack', type=float, default=DURATION_SLACK,
+                       help=f"допустимая разница в секундах (по умолчанию {DURATION_SLACK})")
+    check.set_defaults(handler=cmd_check)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2831 @@
+# Ядро Game Voiceover Toolkit: сканирование, применение замен и профили.
+# Модуль не зависит от Qt и VLC и используется как GUI (GVT.py), так и
+# консольным режимом (gvt_cli.py).
+import os
+import json
+import hashlib
+import heapq
+import io
+import math
+import mmap
+import operator
+import re
+import shutil
+import sqlite3
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+
+PROFILES_FILE = 'mod_profiles.json'
+PROFILES_DB = 'profiles.sqlite'
+INDEX_FILE = 'scan_index.sqlite'
+CACHE_DIR = 'transcode_cache'
+CACHE_MAX_BYTES = 5 * 1024 ** 3
+MANIFEST_DIR = 'manifests'
+BACKUP_DIR = 'backups'
+REPORT_DIR = 'reports'
+RENAME_RULES_FILE = 'rename_rules.json'
+JOURNAL_FILE = 'jobs.sqlite'
+ANALYSIS_DB = 'analysis.sqlite'
+ANALYSIS_RATE = 8000  # Частота, до которой ffmpeg понижает звук для анализа
+WAVEFORM_POINTS = 256
+# Замена считается слишком длинной, если она длиннее оригинала в DURATION_RATIO
+# раз и при этом больше чем на DURATION_SLACK секунд
+DURATION_RATIO = 1.25
+DURATION_SLACK = 0.5
+# Декодированный для прослушивания звук: формат ffmpeg-выхода и объем кэша в памяти
+PREVIEW_RATE = 48000
+PREVIEW_CACHE_BYTES = 256 * 1024 ** 2
+# Выравнивание громкости замены по оригиналу (EBU R128): усиление не больше
+# LOUDNESS_MAX_GAIN дБ в любую сторону, и истинный пик после него не выше
+# LOUDNESS_PEAK_CEILING dBTP. Тише LOUDNESS_SILENCE LUFS - тишина, ее не трогаем
+LOUDNESS_MAX_GAIN = 20.0
+LOUDNESS_PEAK_CEILING = -1.0
+LOUDNESS_SILENCE = -70.0
+STAGING_DIR = 'staging'
+AUDIO_EXTENSIONS = ('.wav', '.ogg', '.mp3', '.flac')
+# Игровые пакеты на основе ZIP; аудио в них адресуется как 'архив::запись'
+ARCHIVE_EXTENSIONS = ('.zip', '.pk3', '.pak')
+ARCHIVE_SEPARATOR = '::'
+ARCHIVE_DIRECTORY_CACHE = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+# Пути к ffmpeg/ffprobe можно переопределить (например, заглушкой в бенчмарках)
+FFMPEG = os.environ.get('GVT_FFMPEG', 'ffmpeg')
+FFPROBE = os.environ.get('GVT_FFPROBE', 'ffprobe')
+
+# Параметры кодирования по кодеку оригинала; PCM и ADPCM кодируются
+# одноименным кодировщиком ffmpeg
+ENCODER_ARGS = {
+    'vorbis': ['-c:a', 'libvorbis', '-q:a', '5'],
+    'opus': ['-c:a', 'libopus', '-b:a', '96k'],
+    'mp3': ['-c:a', 'libmp3lame', '-q:a', '2'],
+    'flac': ['-c:a', 'flac'],
+}
+# Кодек по расширению, если оригинал определить не удалось
+DEFAULT_CODECS = {'.ogg': 'vorbis', '.mp3': 'mp3', '.flac': 'flac', '.wav': 'pcm_s16le'}
+MUTAGEN_CODECS = {
+    'OggVorbis': 'vorbis', 'OggOpus': 'opus', 'MP3': 'mp3', 'FLAC': 'flac', 'OggFLAC': 'flac',
+}
+WAV_FORMAT_TAGS = {2: 'adpcm_ms', 6: 'pcm_alaw', 7: 'pcm_mulaw', 0x11: 'adpcm_ima_wav'}
+
+
+@contextmanager
+def open_db(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    if split_archive_path(path)[1] is not None:
+        with open_audio_data(path) as data:
+            return hashlib.sha256(data).hexdigest()
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def format_size(size):
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if size < 1024 or unit == "ГБ":
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+FICLONE = 0x40049409  # ioctl клонирования файла в Linux (Btrfs, XFS, bcachefs)
+
+
+def reflink(source, destination):
+    # Копия с общими блоками данных: мгновенно и без удвоения места,
+    # при этом файлы остаются независимыми (copy-on-write)
+    if not sys.platform.startswith('linux'):
+        raise OSError("reflink не поддерживается на этой платформе")
+    import fcntl
+    try:
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+
+
+def place_file(source, destination, link=True):
+    # Кладет файл на место назначения атомарно: сначала во временный файл
+    # рядом, затем os.replace. Данные по возможности не копируются: сначала
+    # пробуется reflink, затем жесткая ссылка; если ФС не поддерживает ни то,
+    # ни другое (или это другой диск), файл копируется.
+    temp_path = f"{destination}.{uuid.uuid4().hex}.part"
+    try:
+        try:
+            reflink(source, temp_path)
+        except OSError:
+            if not link:
+                shutil.copyfile(source, temp_path)
+            else:
+                try:
+                    os.link(source, temp_path)
+                except OSError:
+                    shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
+        # Если destination уже жесткая ссылка на source, rename ничего не
+        # делает и временное имя остается
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def split_archive_path(path):
+    # 'data.pk3::sound/vo/a.wav' -> ('data.pk3', 'sound/vo/a.wav');
+    # у обычного файла записи нет: (path, None)
+    archive, separator, entry = path.partition(ARCHIVE_SEPARATOR)
+    return (archive, entry) if separator else (path, None)
+
+
+_archive_directories = OrderedDict()
+_archive_lock = threading.Lock()
+
+
+def archive_entries(archive_path):
+    # {имя записи: ZipInfo} из central directory; данные записей не читаются.
+    # Несколько последних архивов держатся в памяти, пока не изменятся
+    stat = os.stat(archive_path)
+    key = (os.path.abspath(archive_path), stat.st_size, stat.st_mtime_ns)
+    with _archive_lock:
+        entries = _archive_directories.get(key)
+        if entries is not None:
+            _archive_directories.move_to_end(key)
+            return entries
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            entries = {info.filename: info for info in archive.infolist() if not info.is_dir()}
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"{archive_path}: {e}")
+    with _archive_lock:
+        _archive_directories[key] = entries
+        while len(_archive_directories) > ARCHIVE_DIRECTORY_CACHE:
+            _archive_directories.popitem(last=False)
+    return entries
+
+
+def archive_entry(path):
+    archive, entry = split_archive_path(path)
+    info = archive_entries(archive).get(entry)
+    if info is None:
+        raise FileNotFoundError(f"Нет записи {entry} в архиве {archive}")
+    return archive, info
+
+
+def local_record(data, info):
+    # Начало данных записи и конец всей записи (с data descriptor) в архиве
+    header = bytes(data[info.header_offset:info.header_offset + 30])
+    if len(header) < 30 or header[:4] != b'PK\x03\x04':
+        raise ValueError(f"Поврежден локальный заголовок записи {info.filename}")
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    start = info.header_offset + 30 + name_length + extra_length
+    end = start + info.compress_size
+    if info.flag_bits & 0x08:
+        if bytes(data[end:end + 4]) == b'PK\x07\x08':
+            end += 4
+        # Размеры в descriptor 8-байтовые, если у записи есть поле zip64
+        local_extra = bytes(data[start - extra_length:start])
+        zip64 = (info.compress_size >= ZIP64_LIMIT or info.file_size >= ZIP64_LIMIT
+                 or strip_zip64_extra(local_extra) != local_extra)
+        end += 20 if zip64 else 12
+    return start, end
+
+
+@contextmanager
+def mapped_file(path):
+    # Файл целиком как буфер без копирования; пустой файл mmap не отображает
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield data
+        finally:
+            try:
+                data.close()
+            except BufferError:
+                pass  # Срез еще где-то используется - закроется сборщиком мусора
+
+
+@contextmanager
+def open_audio_data(path):
+    # Содержимое файла или записи архива. Несжатая запись отдается срезом
+    # отображенного в память архива, без копирования; сжатая распаковывается
+    archive, entry = split_archive_path(path)
+    if entry is None:
+        with mapped_file(path) as data:
+            yield data
+        return
+    archive, info = archive_entry(path)
+    if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        with zipfile.ZipFile(archive) as zf:
+            yield zf.read(info)
+        return
+    with mapped_file(archive) as data:
+        start, _ = local_record(data, info)
+        view = memoryview(data)[start:start + info.compress_size]
+        try:
+            if info.compress_type == zipfile.ZIP_STORED:
+                yield view
+            else:
+                yield zlib.decompress(view, -15, info.file_size or zlib.DEF_BUF_SIZE)
+        finally:
+            view.release()
+
+
+def list_archive(archive_path, extensions):
+    # Аудиозаписи архива: (имя, размер, CRC32) по central directory
+    return [
+        (name, info.file_size, info.CRC)
+        for name, info in archive_entries(archive_path).items()
+        if name.lower().endswith(extensions)
+    ]
+
+
+def audio_stat(path):
+    # (размер, метка изменения) файла или записи архива. У записи вместо mtime
+    # берется CRC32: перезапись архива не меняет неизмененные записи
+    archive, entry = split_archive_path(path)
+    if entry is None:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    _, info = archive_entry(path)
+    return info.file_size, info.CRC
+
+
+def extract_entry(path, destination):
+    # Запись архива в отдельный файл (атомарно, как place_file)
+    temp_path = f"{destination}.{uuid.uuid4().hex}.part"
+    try:
+        with open_audio_data(path) as data, open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11 | minute << 5 | second // 2,
+            max(0, year - 1980) << 9 | month << 5 | day)
+
+
+def strip_zip64_extra(extra):
+    # Старое поле zip64 (id 1) заменяется новым с актуальными значениями
+    result = b''
+    pos = 0
+    while pos + 4 <= len(extra):
+        field_id, size = struct.unpack('<HH', extra[pos:pos + 4])
+        if field_id != 1:
+            result += extra[pos:pos + 4 + size]
+        pos += 4 + size
+    return result
+
+
+def central_record(info, offset, fields):
+    # Запись central directory; fields - CRC, размеры и прочее, что у
+    # замененной записи отличается от исходного ZipInfo
+    crc, compress_size, file_size, flag_bits, date_time, extract_version = fields
+    extra = strip_zip64_extra(info.extra)
+    zip64 = []
+    if file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT:
+        zip64 += [file_size, compress_size]
+        file_size = compress_size = 0xFFFFFFFF
+    if offset >= ZIP64_LIMIT:
+        zip64.append(offset)
+        offset = 0xFFFFFFFF
+    if zip64:
+        extra = struct.pack(f'<HH{len(zip64)}Q', 1, 8 * len(zip64), *zip64) + extra
+        extract_version = max(extract_version, 45)
+    name = info.orig_filename.encode('utf-8' if flag_bits & 0x800 else 'cp437')
+    dos_time, dos_date = dos_date_time(date_time)
+    return struct.pack(
+        '<4s4B4HL2L5H2L', b'PK\x01\x02', info.create_version, info.create_system,
+        extract_version, info.reserved, flag_bits, info.compress_type, dos_time, dos_date,
+        crc, compress_size, file_size, len(name), len(extra), len(info.comment), 0,
+        info.internal_attr, info.external_attr, offset) + name + extra + info.comment
+
+
+def write_entry(out, info, source):
+    # Новое содержимое записи тем же методом сжатия; размеры и CRC известны
+    # заранее, поэтому data descriptor не нужен
+    with open(source, 'rb') as f:
+        data = f.read()
+    crc = zlib.crc32(data)
+    if info.compress_type == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        packed = compressor.compress(data) + compressor.flush()
+    else:
+        packed = data
+    flag_bits = info.flag_bits & ~0x08
+    date_time = time.localtime()[:6]
+    extract_version = max(info.extract_version, 20)
+    extra = b''
+    compress_size, file_size = len(packed), len(data)
+    if file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT:
+        extra = struct.pack('<HHQQ', 1, 16, file_size, compress_size)
+        extract_version = 45
+        compress_size = file_size = 0xFFFFFFFF
+    name = info.orig_filename.encode('utf-8' if flag_bits & 0x800 else 'cp437')
+    dos_time, dos_date = dos_date_time(date_time)
+    out.write(struct.pack(
+        '<4s2B4HL2L2H', b'PK\x03\x04', extract_version, info.reserved, flag_bits,
+        info.compress_type, dos_time, dos_date, crc, compress_size, file_size,
+        len(name), len(extra)) + name + extra)
+    out.write(packed)
+    return crc, len(packed), len(data), flag_bits, date_time, extract_version
+
+
+def rewrite_archive(archive_path, updates):
+    # Заменяет содержимое записей архива: updates - {имя записи: файл с новым
+    # содержимым}. Архив переписывается одним последовательным проходом во
+    # временный файл рядом: неизмененные записи копируются как есть (заголовок
+    # и сжатые данные прямо из mmap), затем пишется central directory, и
+    # временный файл атомарно подменяет архив. zip64 включается, когда
+    # смещения, размеры или число записей не помещаются в поля ZIP
+    entries = archive_entries(archive_path)
+    missing = [name for name in updates if name not in entries]
+    if missing:
+        raise FileNotFoundError(f"Нет записей в архиве {archive_path}: {', '.join(missing)}")
+    with zipfile.ZipFile(archive_path) as archive:
+        comment = archive.comment
+    # Записи идут в порядке расположения в файле, чтобы чтение было последовательным
+    ordered = sorted(entries.values(), key=lambda info: info.header_offset)
+
+    temp_path = f"{archive_path}.{uuid.uuid4().hex}.part"
+    try:
+        with mapped_file(archive_path) as data, open(temp_path, 'wb') as out:
+            view = memoryview(data)
+            offsets = {}
+            fields = {}
+            try:
+                for info in ordered:
+                    offsets[info.filename] = out.tell()
+                    source = updates.get(info.filename)
+                    if source is not None:
+                        fields[info.filename] = write_entry(out, info, source)
+                        continue
+                    _, end = local_record(data, info)
+                    out.write(view[info.header_offset:end])
+            finally:
+                view.release()
+
+            directory_start = out.tell()
+            for info in entries.values():
+                out.write(central_record(info, offsets[info.filename], fields.get(info.filename) or (
+                    info.CRC, info.compress_size, info.file_size, info.flag_bits, info.date_time,
+                    info.extract_version)))
+            directory_end = out.tell()
+
+            count = len(entries)
+            directory_size = directory_end - directory_start
+            if count >= 0xFFFF or directory_size >= ZIP64_LIMIT or directory_start >= ZIP64_LIMIT:
+                out.write(struct.pack(
+                    '<4sQ2H2L4Q', b'PK\x06\x06', 44, 45, 45, 0, 0, count, count,
+                    directory_size, directory_start))
+                out.write(struct.pack('<4sLQL', b'PK\x06\x07', 0, directory_end, 1))
+            out.write(struct.pack(
+                '<4s4H2LH', b'PK\x05\x06', 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                min(directory_size, 0xFFFFFFFF), min(directory_start, 0xFFFFFFFF),
+                len(comment)) + comment)
+        os.replace(temp_path, archive_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def parse_wav(data):
+    # Чанки RIFF в буфере: (содержимое fmt, начало и конец data); None - не WAV
+    if len(data) < 12 or bytes(data[:4]) != b'RIFF' or bytes(data[8:12]) != b'WAVE':
+        return None
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = bytes(data[pos:pos + 4])
+        chunk_size = int.from_bytes(data[pos + 4:pos + 8], 'little')
+        if chunk_id == b'fmt ':
+            fmt = bytes(data[pos + 8:pos + 8 + min(chunk_size, 40)])
+        elif chunk_id == b'data' and fmt is not None:
+            return fmt, pos + 8, min(pos + 8 + chunk_size, len(data))
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return (fmt, None, None) if fmt is not None else None
+
+
+def wav_format(fmt):
+    # (тег формата, каналы, частота, бит на сэмпл) из чанка fmt
+    tag, channels, sample_rate = struct.unpack('<HHI', fmt[:8])
+    bits = struct.unpack('<H', fmt[14:16])[0]
+    if tag == 0xFFFE and len(fmt) >= 26:
+        # WAVE_FORMAT_EXTENSIBLE: реальный формат в начале GUID подформата
+        tag = struct.unpack('<H', fmt[24:26])[0]
+    return tag, channels, sample_rate, bits
+
+
+def probe_wav(path):
+    # Читает только заголовок: файл или запись архива отображается в память
+    with open_audio_data(path) as data:
+        chunks = parse_wav(data)
+    if chunks is None or len(chunks[0]) < 16:
+        return None
+    tag, channels, sample_rate, bits = wav_format(chunks[0])
+    if tag == 1:
+        codec = 'pcm_u8' if bits == 8 else f'pcm_s{bits}le'
+    elif tag == 3:
+        codec = f'pcm_f{bits}le'
+    else:
+        codec = WAV_FORMAT_TAGS.get(tag)
+    if codec is None:
+        return None
+    return {'codec': codec, 'sample_rate': sample_rate, 'channels': channels}
+
+
+def probe_mutagen(path):
+    try:
+        from mutagen import File as MutagenFile
+    except ImportError:
+        return None
+    try:
+        if split_archive_path(path)[1] is None:
+            audio = MutagenFile(path)
+        else:
+            with open_audio_data(path) as data:
+                audio = MutagenFile(io.BytesIO(data))
+    except Exception:
+        return None
+    codec = MUTAGEN_CODECS.get(type(audio).__name__) if audio is not None else None
+    if codec is None:
+        return None
+    return {
+        'codec': codec,
+        'sample_rate': getattr(audio.info, 'sample_rate', None),
+        'channels': getattr(audio.info, 'channels', None),
+    }
+
+
+def run_on_audio(before, path, after):
+    # Запускает ffmpeg/ffprobe над файлом; запись архива передается через
+    # stdin прямо из отображенного в память архива
+    if split_archive_path(path)[1] is None:
+        return subprocess.run(before + [path] + after, capture_output=True)
+    with open_audio_data(path) as data:
+        return subprocess.run(before + ["pipe:0"] + after, input=data, capture_output=True)
+
+
+def probe_ffprobe(path):
+    try:
+        result = run_on_audio([
+            FFPROBE, "-v", "error", "-select_streams", "a:0",
+            "-show_entries", "stream=codec_name,sample_rate,channels", "-of", "json"
+        ], path, [])
+        if result.returncode != 0:
+            return None
+        stream = json.loads(result.stdout)['streams'][0]
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+    return {
+        'codec': stream.get('codec_name'),
+        'sample_rate': int(stream['sample_rate']) if stream.get('sample_rate') else None,
+        'channels': stream.get('channels'),
+    }
+
+
+def probe_audio(path, ext=None):
+    # Кодек, частота и число каналов: сначала без запуска процессов
+    # (заголовок WAV или mutagen), затем через ffprobe. ext нужен для файлов
+    # без расширения, например объектов в хранилище резервных копий
+    ext = ext or os.path.splitext(path)[1].lower()
+    try:
+        if ext == '.wav':
+            info = probe_wav(path)
+        else:
+            info = probe_mutagen(path)
+    except (OSError, ValueError):
+        info = None
+    return info or probe_ffprobe(path)
+
+
+def encoder_settings(audio_format, ext):
+    # Аргументы ffmpeg, дающие файл того же формата, что и оригинал
+    codec = audio_format.get('codec') if audio_format else None
+    if codec not in ENCODER_ARGS and not (codec or '').startswith(('pcm_', 'adpcm_')):
+        codec = DEFAULT_CODECS.get(ext, 'vorbis')
+    settings = list(ENCODER_ARGS.get(codec, ['-c:a', codec]))
+    if audio_format and audio_format.get('sample_rate'):
+        settings += ['-ar', str(audio_format['sample_rate'])]
+    if audio_format and audio_format.get('channels'):
+        settings += ['-ac', str(audio_format['channels'])]
+    return settings
+
+
+def same_format(first, second):
+    return bool(first and second) and all(
+        first.get(key) == second.get(key) for key in ('codec', 'sample_rate', 'channels'))
+
+
+class ScanIndex:
+    # Постоянный индекс аудиофайлов игр (лежит рядом с базой профилей).
+    # Для каждого каталога хранится его mtime: если он не изменился, состав
+    # каталога берется из индекса и диск повторно не читается.
+
+    def __init__(self, db_path=INDEX_FILE):
+        self.db_path = db_path
+        with open_db(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS games (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS dirs (
+                    game_id INTEGER NOT NULL,
+                    rel_dir TEXT NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    PRIMARY KEY (game_id, rel_dir)
+                );
+                CREATE TABLE IF NOT EXISTS files (
+                    game_id INTEGER NOT NULL,
+                    rel_path TEXT NOT NULL,
+                    rel_dir TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    codec TEXT,
+                    sample_rate INTEGER,
+                    channels INTEGER,
+                    PRIMARY KEY (game_id, rel_path)
+                );
+                CREATE INDEX IF NOT EXISTS files_by_dir ON files (game_id, rel_dir);
+            """)
+            # Формат оригинала определяется один раз и хранится вместе с файлом;
+            # индексы старых версий дополняются недостающими колонками
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(files)")}
+            for column, column_type in (('codec', 'TEXT'), ('sample_rate', 'INTEGER'),
+                                        ('channels', 'INTEGER')):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE files ADD COLUMN {column} {column_type}")
+
+    @staticmethod
+    def game_key(game_path):
+        return os.path.normcase(os.path.abspath(game_path))
+
+    def game_id(self, conn, game_path, create=False):
+        key = self.game_key(game_path)
+        row = conn.execute("SELECT id FROM games WHERE path = ?", (key,)).fetchone()
+        if row:
+            return row[0]
+        if create:
+            return conn.execute("INSERT INTO games (path) VALUES (?)", (key,)).lastrowid
+        return None
+
+    def load(self, game_path):
+        with open_db(self.db_path) as conn:
+            game_id = self.game_id(conn, game_path)
+            if game_id is None:
+                return {}
+            rows = conn.execute("SELECT rel_path FROM files WHERE game_id = ?", (game_id,))
+            return {rel_path: os.path.join(game_path, rel_path) for (rel_path,) in rows}
+
+    def get_format(self, game_path, rel_path):
+        with open_db(self.db_path) as conn:
+            game_id = self.game_id(conn, game_path)
+            row = conn.execute(
+                "SELECT codec, sample_rate, channels FROM files WHERE game_id = ? AND rel_path = ?",
+                (game_id, rel_path)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return {'codec': row[0], 'sample_rate': row[1], 'channels': row[2]}
+
+    def load_formats(self, game_path):
+        # Известные форматы всех файлов игры одним запросом: {путь: формат}
+        with open_db(self.db_path) as conn:
+            game_id = self.game_id(conn, game_path)
+            rows = conn.execute(
+                "SELECT rel_path, codec, sample_rate, channels FROM files "
+                "WHERE game_id = ? AND codec IS NOT NULL", (game_id,))
+            return {
+                rel_path: {'codec': codec, 'sample_rate': sample_rate, 'channels': channels}
+                for rel_path, codec, sample_rate, channels in rows
+            }
+
+    def set_format(self, game_path, rel_path, audio_format):
+        with open_db(self.db_path) as conn:
+            game_id = self.game_id(conn, game_path)
+            conn.execute(
+                "UPDATE files SET codec = ?, sample_rate = ?, channels = ? "
+                "WHERE game_id = ? AND rel_path = ?",
+                (audio_format['codec'], audio_format['sample_rate'], audio_format['channels'],
+                 game_id, rel_path))
+
+    def scan(self, game_path, extensions, cancel_event=None, archives=ARCHIVE_EXTENSIONS):
+        # Генератор пар (относительный путь, полный путь) с попутным
+        # обновлением индекса: читаются только каталоги с изменившимся mtime.
+        # Из архивов (archives) берется только central directory, записи
+        # попадают в индекс как 'архив::запись' с CRC32 вместо mtime
+        with open_db(self.db_path) as conn:
+            game_id = self.game_id(conn, game_path, create=True)
+            known_dirs = dict(conn.execute(
+                "SELECT rel_dir, mtime_ns FROM dirs WHERE game_id = ?", (game_id,)))
+            children = {}
+            for rel_dir in known_dirs:
+                if rel_dir:
+                    children.setdefault(os.path.dirname(rel_dir), []).append(rel_dir)
+
+            visited = set()
+            scanned = []
+            stack = ['']
+            while stack:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                rel_dir = stack.pop()
+                full_dir = os.path.join(game_path, rel_dir) if rel_dir else game_path
+                try:
+                    mtime_ns = os.stat(full_dir).st_mtime_ns
+                except OSError:
+                    continue
+                visited.add(rel_dir)
+
+                if known_dirs.get(rel_dir) == mtime_ns:
+                    stack.extend(children.get(rel_dir, ()))
+                    rows = conn.execute(
+                        "SELECT rel_path FROM files WHERE game_id = ? AND rel_dir = ?",
+                        (game_id, rel_dir)).fetchall()
+                    for (rel_path,) in rows:
+                        yield rel_path, os.path.join(game_path, rel_path)
+                    continue
+
+                found = []
+                try:
+                    with os.scandir(full_dir) as entries:
+                        for entry in entries:
+                            rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                            try:
+                                if entry.is_dir(follow_symlinks=False):
+                                    stack.append(rel_path)
+                                elif entry.name.lower().endswith(extensions):
+                                    stat = entry.stat()
+                                    found.append((rel_path, entry.path, stat.st_size, stat.st_mtime_ns))
+                                elif archives and entry.name.lower().endswith(archives):
+                                    found.extend(
+                                        (rel_path + ARCHIVE_SEPARATOR + name,
+                                         entry.path + ARCHIVE_SEPARATOR + name, size, crc)
+                                        for name, size, crc in list_archive(entry.path, extensions))
+                            except (OSError, ValueError):
+                                # ValueError - файл с расширением архива, но не ZIP
+                                continue
+                except OSError:
+                    continue
+
+                indexed = {
+                    rel_path: (size, file_mtime)
+                    for rel_path, size, file_mtime in conn.execute(
+                        "SELECT rel_path, size, mtime_ns FROM files WHERE game_id = ? AND rel_dir = ?",
+                        (game_id, rel_dir))
+                }
+                # Замена строки сбрасывает и сохраненный формат измененного файла
+                conn.executemany(
+                    "INSERT OR REPLACE INTO files (game_id, rel_path, rel_dir, size, mtime_ns) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(game_id, rel_path, rel_dir, size, file_mtime)
+                     for rel_path, _, size, file_mtime in found
+                     if indexed.pop(rel_path, None) != (size, file_mtime)])
+                conn.executemany(
+                    "DELETE FROM files WHERE game_id = ? AND rel_path = ?",
+                    [(game_id, rel_path) for rel_path in indexed])
+                scanned.append((game_id, rel_dir, mtime_ns))
+
+                for rel_path, full_path, _, _ in found:
+                    yield rel_path, full_path
+
+            # mtime каталогов сохраняется только после полного обхода: после
+            # отмены неизменный каталог скрыл бы подкаталоги, до которых
+            # обход не дошел. Строки файлов верны и так и остаются в индексе
+            conn.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", scanned)
+
+            # Каталоги, которые исчезли с диска
+            for rel_dir in known_dirs.keys() - visited:
+                conn.execute("DELETE FROM dirs WHERE game_id = ? AND rel_dir = ?", (game_id, rel_dir))
+                conn.execute("DELETE FROM files WHERE game_id = ? AND rel_dir = ?", (game_id, rel_dir))
+
+
+class TranscodeCache:
+    # Кэш результатов ffmpeg, адресуемый содержимым: ключ - хэш исходного
+    # файла плюс параметры кодирования. Общий для всех игр и профилей,
+    # размер ограничен, вытесняются давно не использованные записи (LRU).
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.db_path = os.path.join(cache_dir, 'cache.sqlite')
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, 'tmp'), exist_ok=True)
+        with open_db(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    ext TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_by_use ON entries (last_used);
+                CREATE TABLE IF NOT EXISTS stats (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            """)
+
+    @staticmethod
+    def make_key(source_hash, settings):
+        digest = hashlib.sha256(source_hash.encode())
+        digest.update(json.dumps(settings).encode())
+        return digest.hexdigest()
+
+    def entry_path(self, key, ext):
+        return os.path.join(self.cache_dir, key[:2], key + ext)
+
+    def temp_path(self, ext):
+        # Расширение сохраняется: по нему ffmpeg выбирает контейнер
+        return os.path.join(self.cache_dir, 'tmp', uuid.uuid4().hex + ext)
+
+    def bump(self, conn, name, amount):
+        conn.execute(
+            "INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+            (name, amount, amount))
+
+    def fetch(self, key, ext, destination):
+        # Кладет закэшированный результат в destination; False - промах
+        path = self.entry_path(key, ext)
+        with open_db(self.db_path) as conn:
+            row = conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                try:
+                    place_file(path, destination)
+                except FileNotFoundError:
+                    # Запись вытеснена параллельно или удалена вручную
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    row = None
+            if row is None:
+                self.bump(conn, 'misses', 1)
+                return False
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.bump(conn, 'hits', 1)
+            self.bump(conn, 'bytes_saved', row[0])
+            return True
+
+    def store(self, key, ext, produced_path):
+        path = self.entry_path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(produced_path, path)
+        with open_db(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, ext, os.path.getsize(path), time.time()))
+        self.evict()
+        return path
+
+    def evict(self):
+        with self._lock, open_db(self.db_path) as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for key, ext, size in conn.execute(
+                    "SELECT key, ext, size FROM entries ORDER BY last_used").fetchall():
+                try:
+                    os.remove(self.entry_path(key, ext))
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self):
+        with open_db(self.db_path) as conn:
+            result = dict(conn.execute("SELECT name, value FROM stats"))
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            'hits': result.get('hits', 0),
+            'misses': result.get('misses', 0),
+            'bytes_saved': result.get('bytes_saved', 0),
+            'entries': entries,
+            'size': size,
+        }
+
+
+class ReplacementManifest:
+    # Манифест замен одной игры: для каждого целевого файла хранится хэш и
+    # mtime замены, параметры кодирования и хэш результата. По нему повторное
+    # применение профиля пропускает уже актуальные замены.
+
+    def __init__(self, game_path, manifest_dir=MANIFEST_DIR):
+        self.game_path = game_path
+        name = hashlib.sha1(ScanIndex.game_key(game_path).encode()).hexdigest()
+        self.path = os.path.join(manifest_dir, name + '.json')
+        self.entries = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('entries', {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    @staticmethod
+    def matches(path, size, mtime_ns, digest):
+        # Сначала сравниваются размер и mtime (у записи архива - CRC32); хэш
+        # считается, только если изменилось время (например, файл просто
+        # перезаписали тем же)
+        try:
+            current_size, current_mtime_ns = audio_stat(path)
+        except (OSError, ValueError):
+            return False
+        if current_size != size:
+            return False
+        return current_mtime_ns == mtime_ns or file_sha256(path) == digest
+
+    def is_up_to_date(self, original_rel, replacement, settings):
+        entry = self.entries.get(original_rel)
+        if entry is None or entry['replacement'] != replacement or entry['settings'] != settings:
+            return False
+        return (
+            self.matches(replacement, entry['replacement_size'],
+                         entry['replacement_mtime_ns'], entry['replacement_hash'])
+            and self.matches(os.path.join(self.game_path, original_rel), entry['output_size'],
+                             entry['output_mtime_ns'], entry['output_hash'])
+        )
+
+    def output_changed(self, original_rel):
+        # В игре лежит не тот файл, что записан прошлым применением: его
+        # подменила игра (обновление, проверка файлов), и это новый оригинал
+        entry = self.entries.get(original_rel)
+        if entry is None:
+            return False
+        path = os.path.join(self.game_path, original_rel)
+        try:
+            audio_stat(path)
+        except (OSError, ValueError):
+            return False  # Файла нет - новой копии снимать не с чего
+        return not self.matches(path, entry['output_size'], entry['output_mtime_ns'],
+                                entry['output_hash'])
+
+    def record(self, original_rel, replacement, replacement_hash, settings, output_hash=None):
+        output = os.path.join(self.game_path, original_rel)
+        replacement_stat = os.stat(replacement)
+        output_size, output_mtime_ns = audio_stat(output)
+        entry = {
+            'replacement': replacement,
+            'replacement_hash': replacement_hash,
+            'replacement_size': replacement_stat.st_size,
+            'replacement_mtime_ns': replacement_stat.st_mtime_ns,
+            'settings': settings,
+            'output_hash': output_hash or file_sha256(output),
+            'output_size': output_size,
+            'output_mtime_ns': output_mtime_ns,
+        }
+        with self._lock:
+            self.entries[original_rel] = entry
+            self.dirty = True
+
+    def forget(self, original_rel):
+        with self._lock:
+            if self.entries.pop(original_rel, None) is not None:
+                self.dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'game_path': self.game_path, 'entries': self.entries}, f)
+            os.replace(temp_path, self.path)
+            self.dirty = False
+
+
+class PathIndex:
+    # Компактное хранилище путей с поиском по подстроке и маске.
+    # Все пути склеиваются в одну строку, поэтому поиск выполняет
+    # регулярное выражение на C, а не цикл Python по каждому пути.
+
+    glob_chars = ('*', '?', '[')
+
+    def __init__(self, paths=()):
+        self.paths = list(paths)
+        self._blob = None
+        self._starts = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def clear(self):
+        self.paths = []
+        self._blob = None
+        self._starts = None
+
+    def extend(self, paths):
+        self.paths.extend(paths)
+        self._blob = None
+
+    @staticmethod
+    def normalize(path):
+        return path.replace('\\', '/').lower()
+
+    @classmethod
+    def compile(cls, query):
+        query = cls.normalize(query.strip())
+        if not query:
+            return None
+        if not any(char in query for char in cls.glob_chars):
+            return re.compile(re.escape(query))
+
+        # Маска ищется внутри пути, как подстрока; '*' и '?' не выходят за его пределы
+        pattern = []
+        i = 0
+        while i < len(query):
+            char = query[i]
+            if char == '*':
+                pattern.append('[^\n]*')
+            elif char == '?':
+                pattern.append('[^\n]')
+            elif char == '[' and ']' in query[i + 2:]:
+                end = query.index(']', i + 2)
+                body = query[i + 1:end].replace('\\', '\\\\')
+                if body.startswith('!'):
+                    body = '^\\n' + body[1:]
+                pattern.append('[' + body + ']')
+                i = end
+            else:
+                pattern.append(re.escape(char))
+            i += 1
+        return re.compile(''.join(pattern))
+
+    @classmethod
+    def build(cls, paths):
+        # Длина пути после lower() может измениться, поэтому смещения
+        # считаются по нормализованным строкам
+        normalized = [cls.normalize(path) for path in paths]
+        starts = [0]
+        for path in normalized[:-1]:
+            starts.append(starts[-1] + len(path) + 1)
+        blob = '\n'.join(normalized)
+        return blob, starts
+
+    def search(self, query, start=0):
+        # Возвращает номера путей (начиная с start), подходящих под запрос
+        pattern = self.compile(query)
+        if pattern is None:
+            return list(range(start, len(self.paths)))
+
+        if start == 0:
+            if self._blob is None:
+                self._blob, self._starts = self.build(self.paths)
+            blob, starts = self._blob, self._starts
+        else:
+            blob, starts = self.build(self.paths[start:])
+
+        result = []
+        pos = 0
+        while True:
+            match = pattern.search(blob, pos)
+            if match is None:
+                break
+            row = bisect_right(starts, match.start()) - 1
+            result.append(start + row)
+            # Остаток совпавшей строки пропускаем
+            if row + 1 >= len(starts):
+                break
+            pos = starts[row + 1]
+        return result
+
+
+def load_rename_rules(path=RENAME_RULES_FILE):
+    # Правила переименования для автосопоставления: список объектов
+    # {"pattern": "регулярное выражение", "replace": "замена"}, которые по
+    # порядку применяются к нормализованному имени файла без расширения
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            rules = json.load(f)
+    except FileNotFoundError:
+        return []
+    return [(re.compile(rule['pattern']), rule.get('replace', '')) for rule in rules]
+
+
+class ReplacementMapper:
+    # Сопоставление папки с записями оригиналам игры по именам. Индекс по
+    # нормализованному пути и имени строится один раз, после чего каждая
+    # запись ищется словарными поисками, без перебора всех оригиналов.
+    # Порядок: полный относительный путь, затем имя; если одно имя у
+    # нескольких оригиналов, выбирается тот, у кого длиннее совпадающий
+    # хвост каталогов. Остальное попадает в unmatched или ambiguous.
+
+    repeats = re.compile('__+')
+
+    def __init__(self, originals, rules=()):
+        self.rules = list(rules)
+        self.by_path = {}
+        self.by_stem = {}
+        originals = list(originals)
+        for original_rel, (dirs, stem) in zip(originals, self.split_all(originals)):
+            self.by_path.setdefault(dirs + '/' + stem, []).append(original_rel)
+            self.by_stem.setdefault(stem, []).append(original_rel)
+
+    def split_all(self, relative_paths):
+        # [('каталоги/через/слэш', нормализованное имя без расширения)].
+        # Пробелы, дефисы и точки в имени - то же, что '_', повторы
+        # схлопываются. Все пути обрабатываются одним циклом с минимумом
+        # вызовов: на 100 тыс. файлов это заметно быстрее пофайловых функций
+        repeats = self.repeats.sub
+        rules = self.rules
+        result = []
+        append = result.append
+        for relative_path in relative_paths:
+            dirs, _, name = relative_path.replace('\\', '/').lower().rpartition('/')
+            stem, dot, _ = name.rpartition('.')
+            if not dot:
+                stem = name
+            stem = stem.replace('-', '_').replace('.', '_').replace(' ', '_')
+            if '__' in stem:
+                stem = repeats('_', stem)
+            for pattern, replace in rules:
+                stem = pattern.sub(replace, stem)
+            append((dirs, stem))
+        return result
+
+    def match_one(self, dirs, stem):
+        candidates = self.by_path.get(dirs + '/' + stem) or self.by_stem.get(stem)
+        if not candidates or len(candidates) == 1:
+            return candidates
+
+        dirs = dirs.split('/')
+
+        def common_tail(original_rel):
+            original_dirs = self.split_all([original_rel])[0][0].split('/')
+            length = 0
+            while (length < len(dirs) and length < len(original_dirs)
+                   and dirs[-1 - length] == original_dirs[-1 - length]):
+                length += 1
+            return length
+
+        scores = [(common_tail(original_rel), original_rel) for original_rel in candidates]
+        best = max(score for score, _ in scores)
+        return [original_rel for score, original_rel in scores if score == best]
+
+    def match(self, recordings):
+        # recordings - пары (путь относительно папки записей, полный путь).
+        # Результат: {'matched': {оригинал: запись}, 'unmatched': [запись],
+        # 'ambiguous': {запись: [оригиналы]}}
+        matched = {}
+        unmatched = []
+        ambiguous = {}
+        claimed = {}
+        recordings = list(recordings)
+        keys = self.split_all([relative_path for relative_path, _ in recordings])
+        for (_, full_path), (dirs, stem) in zip(recordings, keys):
+            candidates = self.match_one(dirs, stem)
+            if not candidates:
+                unmatched.append(full_path)
+            elif len(candidates) > 1:
+                ambiguous[full_path] = candidates
+            else:
+                claimed.setdefault(candidates[0], []).append(full_path)
+
+        # Несколько записей на один оригинал - тоже неоднозначность
+        for original_rel, full_paths in claimed.items():
+            if len(full_paths) == 1:
+                matched[original_rel] = full_paths[0]
+            else:
+                for full_path in full_paths:
+                    ambiguous[full_path] = [original_rel]
+        return {'matched': matched, 'unmatched': unmatched, 'ambiguous': ambiguous}
+
+    def match_folder(self, folder, extensions=AUDIO_EXTENSIONS):
+        return self.match(iter_files(folder, extensions))
+
+
+class EncoderError(RuntimeError):
+    # Ошибка ffmpeg; в log - хвост его stderr для диагностики
+    def __init__(self, message, log):
+        super().__init__(message)
+        self.log = log
+
+
+@contextmanager
+def timed(metrics, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics[phase + '_s'] += time.perf_counter() - start
+
+
+class RunReport:
+    # Метрики одного запуска: время фаз по каждому файлу, диагностика ffmpeg
+    # для ошибок и общая пропускная способность. Сохраняется в JSON и в
+    # текстовом формате Prometheus (подходит для textfile collector).
+
+    phases = ('prepare', 'loudness', 'backup', 'encode', 'write')
+    duration_buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.elapsed = None
+        self.files = []
+        self.status_counts = {}
+        self.method_counts = {}
+        self.phase_totals = dict.fromkeys(self.phases, 0.0)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.bucket_counts = [0] * len(self.duration_buckets)
+        self.duration_sum = 0.0
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def new_file(cls, game_path, original_rel, replacement):
+        metrics = {
+            'game_path': game_path,
+            'target': original_rel,
+            'replacement': replacement,
+            'status': None,
+            'method': None,  # encode, cache или copy
+            'gain_db': None,  # Усиление при выравнивании громкости
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'total_s': 0.0,
+        }
+        metrics.update((phase + '_s', 0.0) for phase in cls.phases)
+        return metrics
+
+    def add(self, metrics):
+        with self._lock:
+            self.files.append(metrics)
+            status = metrics['status']
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            if metrics['method']:
+                self.method_counts[metrics['method']] = self.method_counts.get(metrics['method'], 0) + 1
+            for phase in self.phases:
+                self.phase_totals[phase] += metrics[phase + '_s']
+            if status == 'done':
+                self.bytes_in += metrics['bytes_in']
+                self.bytes_out += metrics['bytes_out']
+            self.duration_sum += metrics['total_s']
+            for i, bound in enumerate(self.duration_buckets):
+                if metrics['total_s'] <= bound:
+                    self.bucket_counts[i] += 1
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self._start
+
+    def summary(self):
+        with self._lock:
+            elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self._start
+            done = self.status_counts.get('done', 0)
+            slowest = heapq.nlargest(5, self.files, key=lambda metrics: metrics['total_s'])
+            return {
+                'files': len(self.files),
+                'done': done,
+                'skipped': self.status_counts.get('skipped', 0),
+                'failed': self.status_counts.get('error', 0),
+                'cancelled': self.status_counts.get('cancelled', 0),
+                'elapsed_s': elapsed,
+                'files_per_s': done / elapsed if elapsed > 0 else 0.0,
+                'input_mb_per_s': self.bytes_in / 1024 ** 2 / elapsed if elapsed > 0 else 0.0,
+                'output_mb_per_s': self.bytes_out / 1024 ** 2 / elapsed if elapsed > 0 else 0.0,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'phase_seconds': dict(self.phase_totals),
+                'methods': dict(self.method_counts),
+                'slowest': [
+                    {'target': metrics['target'], 'total_s': metrics['total_s'],
+                     'method': metrics['method'], 'status': metrics['status']}
+                    for metrics in slowest
+                ],
+            }
+
+    def prometheus_text(self):
+        summary = self.summary()
+        lines = [
+            "# HELP gvt_run_files Files handled by the last run, by status.",
+            "# TYPE gvt_run_files gauge",
+        ]
+        for status in ('done', 'skipped', 'failed', 'cancelled'):
+            lines.append(f'gvt_run_files{{status="{status}"}} {summary[status]}')
+        lines += [
+            "# HELP gvt_run_duration_seconds Wall-clock duration of the last run.",
+            "# TYPE gvt_run_duration_seconds gauge",
+            f"gvt_run_duration_seconds {summary['elapsed_s']:.6f}",
+            "# HELP gvt_run_phase_seconds Time spent in each phase, summed over all files.",
+            "# TYPE gvt_run_phase_seconds gauge",
+        ]
+        for phase, seconds in summary['phase_seconds'].items():
+            lines.append(f'gvt_run_phase_seconds{{phase="{phase}"}} {seconds:.6f}')
+        lines += [
+            "# HELP gvt_run_files_per_second Processed files per second of wall-clock time.",
+            "# TYPE gvt_run_files_per_second gauge",
+            f"gvt_run_files_per_second {summary['files_per_s']:.3f}",
+            "# HELP gvt_run_bytes_per_second Replacement input and written output per second.",
+            "# TYPE gvt_run_bytes_per_second gauge",
+            f'gvt_run_bytes_per_second{{direction="in"}} {summary["input_mb_per_s"] * 1024 ** 2:.1f}',
+            f'gvt_run_bytes_per_second{{direction="out"}} {summary["output_mb_per_s"] * 1024 ** 2:.1f}',
+            "# HELP gvt_file_duration_seconds Per-file processing time.",
+            "# TYPE gvt_file_duration_seconds histogram",
+        ]
+        for bound, count in zip(self.duration_buckets, self.bucket_counts):
+            lines.append(f'gvt_file_duration_seconds_bucket{{le="{bound}"}} {count}')
+        lines += [
+            f'gvt_file_duration_seconds_bucket{{le="+Inf"}} {summary["files"]}',
+            f"gvt_file_duration_seconds_sum {self.duration_sum:.6f}",
+            f"gvt_file_duration_seconds_count {summary['files']}",
+            "# HELP gvt_run_timestamp_seconds Start time of the last run.",
+            "# TYPE gvt_run_timestamp_seconds gauge",
+            f"gvt_run_timestamp_seconds {self.started_at:.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, report_dir=REPORT_DIR):
+        # run-<время>.json и .prom; latest.prom всегда указывает на последний запуск
+        os.makedirs(report_dir, exist_ok=True)
+        name = time.strftime('run-%Y%m%d-%H%M%S', time.localtime(self.started_at))
+        json_path = os.path.join(report_dir, name + '.json')
+        prom_path = os.path.join(report_dir, name + '.prom')
+        with self._lock:
+            files = list(self.files)
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+                'summary': self.summary(),
+                'files': files,
+            }, f, ensure_ascii=False, indent=1)
+        text = self.prometheus_text()
+        with open(prom_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        latest = os.path.join(report_dir, 'latest.prom')
+        with open(latest + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(latest + '.tmp', latest)
+        return json_path, prom_path
+
+
+class JobJournal:
+    # Журнал заданий для продолжения прерванной обработки. Для каждой замены
+    # запуска хранится последнее пройденное состояние: planned, backed_up,
+    # encoded (с путем к временному результату) и committed. Все шаги
+    # повторяемы: backup не перезаписывает сохраненный оригинал, результат
+    # ffmpeg лежит во временном файле и попадает в игру через os.replace.
+    # Поэтому состояния копятся в памяти и пишутся одной транзакцией
+    # (flush): после сбоя теряется лишь короткий хвост, который выполнится
+    # еще раз. Запуск, дошедший до конца или отмененный, закрывается.
+    # Новый запуск перекрывает открытые старые: их замены тех же файлов
+    # больше не продолжаются, а запуск, у которого замен не осталось,
+    # закрывается.
+
+    def __init__(self, db_path=JOURNAL_FILE):
+        self.db_path = db_path
+        self._pending = []
+        self._lock = threading.Lock()
+        with open_db(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY,
+                    created REAL NOT NULL,
+                    options TEXT NOT NULL,
+                    closed INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS items (
+                    run_id INTEGER NOT NULL,
+                    game_path TEXT NOT NULL,
+                    original_rel TEXT NOT NULL,
+                    replacement TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    output TEXT,
+                    error TEXT,
+                    replacement_hash TEXT,
+                    settings TEXT,
+                    PRIMARY KEY (run_id, game_path, original_rel)
+                ) WITHOUT ROWID;
+            """)
+
+    def start(self, tasks, options):
+        with open_db(self.db_path) as conn:
+            # Закрытые запуски для продолжения не нужны
+            conn.execute("DELETE FROM items WHERE run_id IN (SELECT id FROM runs WHERE closed = 1)")
+            conn.execute("DELETE FROM runs WHERE closed = 1")
+            run_id = conn.execute(
+                "INSERT INTO runs (created, options) VALUES (?, ?)",
+                (time.time(), json.dumps(options))).lastrowid
+            conn.executemany(
+                "INSERT OR REPLACE INTO items (run_id, game_path, original_rel, replacement, state) "
+                "VALUES (?, ?, ?, ?, 'planned')",
+                ((run_id, task['game_path'], original_rel, replacement)
+                 for task in tasks for original_rel, replacement in task['replacements'].items()))
+            covered = """
+                run_id IN (SELECT id FROM runs WHERE closed = 0 AND id != :run_id)
+                AND (game_path, original_rel) IN
+                    (SELECT game_path, original_rel FROM items WHERE run_id = :run_id)
+            """
+            stale = conn.execute(
+                f"SELECT output FROM items WHERE state = 'encoded' AND output IS NOT NULL AND {covered}",
+                {'run_id': run_id}).fetchall()
+            conn.execute(f"DELETE FROM items WHERE {covered}", {'run_id': run_id})
+            conn.execute(
+                "UPDATE runs SET closed = 1 WHERE closed = 0 AND id != ? "
+                "AND id NOT IN (SELECT run_id FROM items)", (run_id,))
+        # Временные результаты перекрытых замен больше не понадобятся
+        for (output,) in stale:
+            try:
+                os.remove(output)
+            except OSError:
+                pass
+        return run_id
+
+    def mark(self, run_id, game_path, original_rel, state=None, output=None, error=None,
+             replacement_hash=None, settings=None):
+        # state=None - только запомнить ошибку, не меняя состояние. Для
+        # committed хранятся хэш замены и настройки, чтобы восстановить
+        # запись манифеста, если он не успел сохраниться
+        settings = json.dumps(settings) if settings is not None else None
+        with self._lock:
+            self._pending.append((state, output, error, replacement_hash, settings,
+                                  run_id, game_path, original_rel))
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            with open_db(self.db_path) as conn:
+                conn.executemany(
+                    "UPDATE items SET state = COALESCE(?, state), output = COALESCE(?, output), "
+                    "error = ?, replacement_hash = COALESCE(?, replacement_hash), "
+                    "settings = COALESCE(?, settings) "
+                    "WHERE run_id = ? AND game_path = ? AND original_rel = ?",
+                    pending)
+
+    def close(self, run_id):
+        self.flush()
+        with open_db(self.db_path) as conn:
+            conn.execute("UPDATE runs SET closed = 1 WHERE id = ?", (run_id,))
+
+    def unfinished(self):
+        # [(run_id, время запуска, всего замен, осталось)] - от последнего к первому
+        with open_db(self.db_path) as conn:
+            return conn.execute("""
+                SELECT runs.id, runs.created, COUNT(*), SUM(items.state != 'committed')
+                FROM runs JOIN items ON items.run_id = runs.id
+                WHERE runs.closed = 0
+                GROUP BY runs.id ORDER BY runs.id DESC
+            """).fetchall()
+
+    def pending(self, run_id):
+        # Незавершенные замены запуска в виде задач и параметры запуска
+        with open_db(self.db_path) as conn:
+            row = conn.execute("SELECT options FROM runs WHERE id = ?", (run_id,)).fetchone()
+            rows = conn.execute(
+                "SELECT game_path, original_rel, replacement FROM items "
+                "WHERE run_id = ? AND state != 'committed'", (run_id,)).fetchall()
+        tasks = {}
+        for game_path, original_rel, replacement in rows:
+            task = tasks.setdefault(game_path, {'game_path': game_path, 'replacements': {}})
+            task['replacements'][original_rel] = replacement
+        return list(tasks.values()), json.loads(row[0]) if row else {}
+
+    def encoded_outputs(self, run_id):
+        # {(папка игры, относительный путь): готовый результат ffmpeg}
+        with open_db(self.db_path) as conn:
+            rows = conn.execute(
+                "SELECT game_path, original_rel, output FROM items "
+                "WHERE run_id = ? AND state = 'encoded' AND output IS NOT NULL", (run_id,))
+            return {(game_path, original_rel): output for game_path, original_rel, output in rows}
+
+    def committed(self, run_id):
+        # [(папка игры, относительный путь, замена, хэш замены, настройки)]
+        with open_db(self.db_path) as conn:
+            rows = conn.execute(
+                "SELECT game_path, original_rel, replacement, replacement_hash, settings FROM items "
+                "WHERE run_id = ? AND state = 'committed' AND settings IS NOT NULL", (run_id,))
+            return [row[:4] + (json.loads(row[4]),) for row in rows]
+
+    def discard(self, run_id):
+        # Отказ от продолжения: временные результаты больше не нужны
+        for output in self.encoded_outputs(run_id).values():
+            try:
+                os.remove(output)
+            except OSError:
+                pass
+        self.close(run_id)
+
+
+def plan_tasks(tasks, index=None):
+    # План пакетной обработки: профили разворачиваются в список назначений
+    # (если несколько профилей пишут в один файл игры, побеждает последний),
+    # назначения с одним исходником и одним целевым форматом объединяются в
+    # одну конвертацию, а конвертации упорядочиваются от больших исходников
+    # к маленьким - так крупные файлы не остаются хвостом в конце. Формат
+    # берется из индекса; если он неизвестен, оценка идет по расширению, а
+    # точное совпадение (хэш и настройки) проверяется уже при обработке
+    destinations = {}
+    total = 0
+    for task in tasks:
+        for original_rel, replacement in task['replacements'].items():
+            destinations[(task['game_path'], original_rel)] = replacement
+            total += 1
+
+    formats = {}
+    sizes = {}
+    groups = {}
+    for (game_path, original_rel), replacement in destinations.items():
+        if game_path not in formats:
+            formats[game_path] = index.load_formats(game_path) if index is not None else {}
+        source = os.path.normcase(os.path.abspath(replacement))
+        if source not in sizes:
+            try:
+                sizes[source] = os.path.getsize(source)
+            except OSError:
+                sizes[source] = 0
+        ext = os.path.splitext(original_rel)[1].lower()
+        audio_format = formats[game_path].get(original_rel)
+        target = tuple(encoder_settings(audio_format, ext)) + (ext,) if audio_format else (ext,)
+        groups.setdefault((source, target), []).append((game_path, original_rel, replacement))
+
+    ordered = sorted(groups.items(), key=lambda item: sizes[item[0][0]], reverse=True)
+    return {
+        'jobs': [destination for _, group in ordered for destination in group],
+        'requested': total,  # Замен во всех профилях
+        'planned': len(destinations),  # Уникальных файлов игр
+        'encodes': len(groups),  # Конвертаций после объединения одинаковых
+    }
+
+
+class ReplacementProcessor:
+    # Применение замен без GUI: прогресс и сообщения отдаются через колбэки,
+    # которые вызываются только из потока, запустившего run().
+    # Файл проходит две стадии: подготовка (формат, манифест, backup, кэш или
+    # копирование) и, если нужен ffmpeg, кодирование. Мелкие замены
+    # кодируются пачками - один процесс ffmpeg с несколькими входами и
+    # выходами, потому что запуск процесса дороже кодирования короткой реплики.
+    # Работа идет по плану plan_tasks, а одинаковые конвертации (хэш
+    # исходника и настройки) выполняются один раз: результат первой
+    # раскладывается по остальным назначениям.
+    # Результаты для записей архивов собираются в STAGING_DIR, и каждый
+    # архив переписывается один раз, когда все конвертации закончены.
+    # С LoudnessCache громкость оригинала и замены измеряется перед
+    # кодированием (параллельно, как и все остальное), а усиление попадает
+    # в настройки кодирования - и тем самым в ключ кэша и объединения
+    # конвертаций; манифест помнит только, что громкость выравнивалась
+
+    stats_interval = 0.5  # Как часто отдавать живую статистику и писать журнал, секунд
+    manifest_interval = 10  # Как часто сохранять манифесты во время обработки, секунд
+    batch_file_bytes = 512 * 1024  # Замены меньше этого размера кодируются пачками
+    batch_max_bytes = 8 * 1024 * 1024  # Суммарный размер входов одной пачки
+    batch_max_files = 64
+
+    def __init__(self, tasks, max_workers=None, cache=None, force=False,
+                 on_progress=None, on_status=None, index=None, backups=None,
+                 on_stats=None, report_dir=REPORT_DIR, batch=True, journal=None, run_id=None,
+                 plan=None, loudness=None):
+        self.tasks = tasks  # Список словарей: {'game_path': '', 'replacements': {}}
+        self.on_progress = on_progress or (lambda percent: None)
+        self.on_status = on_status or (lambda text: None)
+        self.on_stats = on_stats or (lambda summary: None)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cache = cache
+        self.force = force  # Обработать все замены, не глядя в манифест
+        self.index = index  # ScanIndex для хранения форматов оригиналов
+        self.backups = backups if backups is not None else BackupStore()
+        self.report_dir = report_dir  # None - отчеты не сохраняются
+        self.batch = batch  # False - один процесс ffmpeg на каждый файл
+        self.journal = journal  # JobJournal; None - без журнала
+        self.run_id = run_id  # Номер прерванного запуска, который продолжается
+        self.resumed_outputs = {}
+        self.plan = plan  # Готовый результат plan_tasks; иначе строится в run()
+        self.loudness = loudness  # LoudnessCache; None - без выравнивания громкости
+        self.report = RunReport()
+        self.report_paths = None
+        self.errors = []  # Список пар (относительный путь, текст ошибки)
+        self.skipped = 0
+        self.staged = {}  # Архив -> задания, ждущие его перезаписи
+        self.cancelled = False
+        self._cancel_event = threading.Event()
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        self._cancel_event.set()
+        with self._lock:
+            for proc in self._processes:
+                proc.terminate()
+
+    def original_source(self, game_path, original_rel):
+        # Путь к настоящему оригиналу и его хэш, если он уже известен: после
+        # первого применения оригинал лежит в хранилище резервных копий
+        digest = self.backups.original_hash(game_path, original_rel)
+        if digest is not None:
+            return self.backups.object_path(digest), digest
+        original_full = os.path.join(game_path, original_rel)
+        if os.path.exists(original_full + '.bak'):
+            return original_full + '.bak', None
+        return original_full, None
+
+    def target_format(self, game_path, original_rel):
+        if self.index is not None:
+            audio_format = self.index.get_format(game_path, original_rel)
+            if audio_format:
+                return audio_format
+        source = self.original_source(game_path, original_rel)[0]
+        audio_format = probe_audio(source, os.path.splitext(original_rel)[1].lower())
+        if audio_format and self.index is not None:
+            self.index.set_format(game_path, original_rel, audio_format)
+        return audio_format
+
+    def loudness_gain(self, game_path, original_rel, replacement, replacement_hash):
+        original = self.loudness.measure(*self.original_source(game_path, original_rel))
+        return loudness_gain(original, self.loudness.measure(replacement, replacement_hash))
+
+    def stage(self, job, step, *args):
+        # Выполняет стадию обработки файла. Итоговый статус (строка) или
+        # ошибка попадает в отчет; задание на кодирование - еще нет
+        metrics = job['metrics']
+        started = time.perf_counter()
+        try:
+            result = step(job, *args)
+        except Exception as e:
+            metrics['status'] = 'error'
+            metrics['error'] = str(e)
+            metrics['ffmpeg_log'] = getattr(e, 'log', None)
+            self.mark(job, error=str(e))
+            raise
+        else:
+            # 'staged' - запись архива ждет перезаписи архива, итога еще нет
+            if isinstance(result, str) and result != 'staged':
+                metrics['status'] = result
+        finally:
+            metrics['total_s'] += time.perf_counter() - started
+            if metrics['status'] is not None:
+                self.report.add(metrics)
+        return result
+
+    def mark(self, job, state=None, output=None, error=None, **extra):
+        if self.journal is not None:
+            self.journal.mark(self.run_id, job['game_path'], job['original_rel'], state, output, error,
+                              **extra)
+
+    def convert(self, game_path, original_rel, replacement, manifest):
+        # Возвращает статус файла или задание для encode_jobs
+        job = {
+            'game_path': game_path,
+            'original_rel': original_rel,
+            'replacement': replacement,
+            'manifest': manifest,
+            'metrics': RunReport.new_file(game_path, original_rel, replacement),
+        }
+        return self.stage(job, self.convert_file)
+
+    def convert_file(self, job):
+        if self._cancel_event.is_set():
+            return 'cancelled'
+        game_path, original_rel, replacement = job['game_path'], job['original_rel'], job['replacement']
+        metrics = job['metrics']
+        original_full = os.path.join(game_path, original_rel)
+        ext = os.path.splitext(original_full)[1].lower()
+        archive, entry = split_archive_path(original_full)
+        if entry is not None:
+            # Все ниже пишет результат в original_full: для записи архива
+            # это файл в STAGING_DIR, который потом попадет в архив
+            os.makedirs(STAGING_DIR, exist_ok=True)
+            original_full = os.path.join(STAGING_DIR, uuid.uuid4().hex + ext)
+            job.update(archive=archive, archive_entry=entry)
+
+        with timed(metrics, 'prepare'):
+            target_format = self.target_format(game_path, original_rel)
+            args = encoder_settings(target_format, ext)
+            # В манифесте отмечается только, выравнивалась ли громкость: при
+            # тех же замене и оригинале усиление выйдет тем же, поэтому
+            # неизмененная замена пропускается без хэширования и измерений
+            settings = args + [ext] + (['normalize'] if self.loudness is not None else [])
+            # Замена и результат не менялись с прошлого применения
+            if not self.force and job['manifest'].is_up_to_date(original_rel, replacement, settings):
+                self.mark(job, 'committed')
+                return 'skipped'
+            metrics['bytes_in'] = os.path.getsize(replacement)
+            job.update(original_full=original_full, ext=ext, settings=settings,
+                       replacement_hash=file_sha256(replacement))
+
+        # Создаем backup если его нет
+        with timed(metrics, 'backup'):
+            self.backups.backup(game_path, original_rel,
+                                refresh=job['manifest'].output_changed(original_rel))
+        self.mark(job, 'backed_up')
+
+        # Громкость меряется после backup: оригинал уже в хранилище, и его
+        # хэш известен из журнала копий
+        if self.loudness is not None:
+            with timed(metrics, 'loudness'):
+                metrics['gain_db'] = self.loudness_gain(game_path, original_rel, replacement,
+                                                        job['replacement_hash'])
+            if metrics['gain_db'] is not None:
+                args = args + ['-af', f"volume={metrics['gain_db']}dB"]
+        # Ключ кэша и объединения конвертаций учитывает само усиление
+        job.update(args=args, encode_settings=args + [ext])
+
+        with timed(metrics, 'prepare'):
+            copy_as_is = (metrics['gain_db'] is None
+                          and os.path.splitext(replacement)[1].lower() == ext
+                          and same_format(probe_audio(replacement), target_format))
+
+        if copy_as_is:
+            # Замена уже в нужном формате - копируем без перекодирования
+            metrics['method'] = 'copy'
+            job['output_hash'] = job['replacement_hash']
+            with timed(metrics, 'write'):
+                self.note_outputs([(job, replacement)])
+                place_file(replacement, original_full, link=False)
+            return self.commit(job)
+
+        if self.cache is None:
+            # Оригинал может быть жесткой ссылкой на объект в хранилище
+            # резервных копий, поэтому поверх него не пишем: результат
+            # кладется рядом и подменяет файл через os.replace
+            job['output'] = f"{original_full}.{uuid.uuid4().hex}.part{ext}"
+        else:
+            # Тот же исходник с теми же настройками уже кодировался - берем из кэша
+            job['key'] = self.cache.make_key(job['replacement_hash'], job['encode_settings'])
+            with timed(metrics, 'write'):
+                cached = self.cache.entry_path(job['key'], ext)
+                if os.path.exists(cached):
+                    self.note_outputs([(job, cached)])
+                cache_hit = self.cache.fetch(job['key'], ext, original_full)
+            if cache_hit:
+                metrics['method'] = 'cache'
+                return self.commit(job)
+            job['output'] = self.cache.temp_path(ext)
+
+        # Прерванный запуск: результат ffmpeg уже готов во временном файле
+        resumed = self.resumed_outputs.get((game_path, original_rel))
+        if resumed and os.path.exists(resumed):
+            metrics['method'] = 'resume'
+            job['output'] = resumed
+            return self.finish_file(job, True)
+        metrics['method'] = 'encode'
+        return job
+
+    def finish_file(self, job, outcome):
+        # Вторая стадия после ffmpeg: outcome - True, False (отмена) или ошибка
+        metrics = job['metrics']
+        output = job['output']
+        try:
+            if isinstance(outcome, Exception):
+                raise outcome
+            if not outcome:
+                return 'cancelled'
+            with timed(metrics, 'write'):
+                if self.cache is None:
+                    self.note_outputs([(job, output)])
+                    os.replace(output, job['original_full'])
+                else:
+                    cached = self.cache.store(job['key'], job['ext'], output)
+                    self.note_outputs([(job, cached)])
+                    place_file(cached, job['original_full'])
+        finally:
+            if os.path.exists(output):
+                os.remove(output)
+        return self.commit(job)
+
+    def share_result(self, job, leader, status):
+        # Назначение с той же конвертацией, что у leader: его результат
+        # копируется сюда без повторного запуска ffmpeg. Результат записи
+        # архива ('staged') лежит в STAGING_DIR до перезаписи архивов
+        if isinstance(status, Exception):
+            raise EncoderError(str(status), getattr(status, 'log', None))
+        if status not in ('done', 'staged'):
+            return self.finish_file(job, False)
+        job['metrics']['method'] = 'shared'
+        job['output_hash'] = leader.get('output_hash')
+        with timed(job['metrics'], 'write'):
+            self.note_outputs([(job, leader['original_full'])])
+            place_file(leader['original_full'], job['original_full'])
+        return self.commit(job)
+
+    def note_outputs(self, placements):
+        # placements - пары (задание, файл, который сейчас попадет в игру).
+        # Если замена ложится поверх результата прошлого применения, ее хэш
+        # запоминается в хранилище копий до записи: после сбоя до сохранения
+        # манифеста файл отличается от записанного в манифесте, и backup по
+        # этому хэшу узнает нашу замену, а не обновление игры
+        outputs = []
+        for job, source in placements:
+            if job['original_rel'] in job['manifest'].entries:
+                job['output_hash'] = job.get('output_hash') or file_sha256(source)
+                outputs.append((job['game_path'], job['original_rel'], job['output_hash']))
+        if outputs:
+            self.backups.note_outputs(outputs)
+
+    def fan_out(self, leader, jobs, status):
+        results = []
+        for job in jobs:
+            try:
+                results.append((job['original_rel'], self.stage(job, self.share_result, leader, status)))
+            except Exception as e:
+                results.append((job['original_rel'], e))
+        return results
+
+    def commit(self, job):
+        if job.get('archive'):
+            with self._lock:
+                self.staged.setdefault(job['archive'], []).append(job)
+            return 'staged'
+        return self.record(job)
+
+    def record(self, job):
+        with timed(job['metrics'], 'write'):
+            job['manifest'].record(job['original_rel'], job['replacement'], job['replacement_hash'],
+                                   job['settings'], job.get('output_hash'))
+        self.mark(job, 'committed', replacement_hash=job['replacement_hash'], settings=job['settings'])
+        job['metrics']['bytes_out'] = os.path.getsize(job['original_full'])
+        return 'done'
+
+    def write_archives(self):
+        # Каждый архив переписывается один раз со всеми своими записями.
+        # Результат - список пар (относительный путь, статус или ошибка)
+        results = []
+        for archive, jobs in self.staged.items():
+            outcome = False
+            share = 0.0
+            if not self._cancel_event.is_set():
+                self.on_status(f"Запись архива: {archive} ({len(jobs)} замен)")
+                started = time.perf_counter()
+                try:
+                    self.note_outputs([(job, job['original_full']) for job in jobs])
+                    rewrite_archive(archive, {job['archive_entry']: job['original_full'] for job in jobs})
+                    outcome = True
+                except (OSError, ValueError) as e:
+                    outcome = e
+                share = (time.perf_counter() - started) / len(jobs)
+            for job in jobs:
+                job['metrics']['write_s'] += share
+                job['metrics']['total_s'] += share
+                try:
+                    results.append((job['original_rel'], self.stage(job, self.finish_archive_entry, outcome)))
+                except Exception as e:
+                    results.append((job['original_rel'], e))
+                finally:
+                    if os.path.exists(job['original_full']):
+                        os.remove(job['original_full'])
+        self.staged = {}
+        return results
+
+    def finish_archive_entry(self, job, outcome):
+        if isinstance(outcome, Exception):
+            raise outcome
+        if not outcome:
+            return 'cancelled'
+        return self.record(job)
+
+    def encode_jobs(self, jobs):
+        # Кодирует задания одним процессом ffmpeg и завершает их. Если пачка
+        # не удалась, файлы кодируются по одному: ошибка одного файла не
+        # мешает остальным и попадает в отчет именно к нему.
+        # Результат - список пар (относительный путь, статус или ошибка)
+        outcomes = None
+        if len(jobs) > 1:
+            started = time.perf_counter()
+            try:
+                outcomes = [self.run_ffmpeg(self.ffmpeg_command(jobs))] * len(jobs)
+            except EncoderError:
+                pass
+            # Время общего процесса делится между файлами пачки поровну
+            share = (time.perf_counter() - started) / len(jobs)
+            for job in jobs:
+                job['metrics']['encode_s'] += share
+                job['metrics']['total_s'] += share
+                job['metrics']['batch_size'] = len(jobs)
+
+        if outcomes is None:
+            outcomes = []
+            for job in jobs:
+                job['metrics']['batch_size'] = 1
+                started = time.perf_counter()
+                try:
+                    outcomes.append(self.run_ffmpeg(self.ffmpeg_command([job])))
+                except EncoderError as e:
+                    outcomes.append(e)
+                elapsed = time.perf_counter() - started
+                job['metrics']['encode_s'] += elapsed
+                job['metrics']['total_s'] += elapsed
+
+        results = []
+        for job, outcome in zip(jobs, outcomes):
+            if outcome is True:
+                self.mark(job, 'encoded', job['output'])
+            try:
+                results.append((job['original_rel'], self.stage(job, self.finish_file, outcome)))
+            except Exception as e:
+                results.append((job['original_rel'], e))
+        return results
+
+    def ffmpeg_command(self, jobs):
+        command = [FFMPEG, "-hide_banner", "-nostdin", "-y"]
+        for job in jobs:
+            command += ["-i", job['replacement']]
+        if len(jobs) == 1:
+            return command + [*jobs[0]['args'], jobs[0]['output']]
+        # i-й вход кодируется в i-й выход со своими настройками
+        for i, job in enumerate(jobs):
+            command += ["-map", f"{i}:a:0", *job['args'], job['output']]
+        return command
+
+    def run_ffmpeg(self, command):
+        # Возвращает False при отмене; stderr ffmpeg сохраняется для отчета об ошибке
+        proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        with self._lock:
+            self._processes.add(proc)
+            # Отмена могла прийти между проверкой и запуском процесса
+            if self._cancel_event.is_set():
+                proc.terminate()
+        try:
+            _, stderr = proc.communicate()
+        finally:
+            with self._lock:
+                self._processes.discard(proc)
+
+        if self._cancel_event.is_set():
+            return False
+        if proc.returncode != 0:
+            log = stderr.decode('utf-8', 'replace')[-4000:]
+            last_line = log.strip().splitlines()[-1] if log.strip() else ''
+            raise EncoderError(f"ffmpeg завершился с кодом {proc.returncode}: {last_line}", log)
+        return True
+
+    def report_results(self, results):
+        # Возвращает, сколько файлов получило итоговый статус
+        count = 0
+        for original_rel, result in results:
+            if isinstance(result, Exception):
+                self.errors.append((original_rel, str(result)))
+                self.on_status(f"Ошибка: {original_rel}: {str(result)}")
+            elif result == 'staged':
+                continue  # Учитывается после перезаписи архива
+            elif result == 'skipped':
+                self.skipped += 1
+            else:
+                self.on_status(f"Обработано: {original_rel}")
+            count += 1
+        return count
+
+    def recover_manifests(self, manifests):
+        # Замены, примененные до сбоя, могли не попасть в сохраненный манифест
+        for game_path, original_rel, replacement, replacement_hash, settings in \
+                self.journal.committed(self.run_id):
+            if game_path not in manifests:
+                manifests[game_path] = ReplacementManifest(game_path)
+            manifest = manifests[game_path]
+            if original_rel not in manifest.entries:
+                try:
+                    manifest.record(original_rel, replacement, replacement_hash, settings)
+                except OSError:
+                    pass
+
+    def save_manifests(self, manifests):
+        for manifest in manifests.values():
+            try:
+                manifest.save()
+            except OSError as e:
+                self.errors.append((manifest.path, str(e)))
+
+    def run(self):
+        if self.plan is None:
+            self.plan = plan_tasks(self.tasks, self.index)
+        manifests = {}
+        jobs = []
+        for game_path, original_rel, replacement in self.plan['jobs']:
+            if game_path not in manifests:
+                manifests[game_path] = ReplacementManifest(game_path)
+            jobs.append((game_path, original_rel, replacement, manifests[game_path]))
+        total_tasks = len(jobs)
+        processed = 0
+        last_stats = last_manifest_save = time.monotonic()
+
+        if self.journal is not None:
+            if self.run_id is None:
+                self.run_id = self.journal.start(
+                    self.tasks, {'force': self.force, 'batch': self.batch,
+                                 'normalize': self.loudness is not None})
+            else:
+                self.resumed_outputs = self.journal.encoded_outputs(self.run_id)
+                self.recover_manifests(manifests)
+
+        # Пачка не больше, чем нужно, чтобы работа досталась всем потокам
+        batch_limit = 1
+        if self.batch:
+            batch_limit = max(1, min(self.batch_max_files, -(-total_tasks // self.max_workers)))
+        batch = []
+        batch_bytes = 0
+        preparing = total_tasks
+        # Конвертация -> (первое задание, его итог или None, пока идет) и
+        # задания, ждущие ее результата
+        shared = {}
+        waiting = {}
+
+        def drop(job):
+            # Отмененное задание завершается вместе с повторами, ждущими его
+            # результата; итог конвертации запоминается, чтобы повтор,
+            # подготовленный позже, не встал в уже снятую очередь
+            key = job.get('share_key')
+            followers = []
+            if key is not None:
+                followers = waiting.pop(key, [])
+                shared[key] = (job, 'cancelled')
+            for dropped in [job] + followers:
+                self.stage(dropped, self.finish_file, False)
+
+        # ffmpeg работает в отдельных процессах, поэтому потоков достаточно для
+        # загрузки всех ядер; сигналы отправляются только из этого потока
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.convert, *job): ('prepare', job[1]) for job in jobs}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                if self._cancel_event.is_set():
+                    for future in futures:
+                        future.cancel()
+                    # Задания, не дошедшие до ffmpeg, тоже попадают в отчет
+                    for job in batch:
+                        drop(job)
+                    batch = []
+
+                for future in done:
+                    stage, payload = futures.pop(future)
+                    if stage == 'prepare':
+                        preparing -= 1
+                    if future.cancelled():
+                        if stage != 'prepare':
+                            for job in payload:
+                                drop(job)
+                        continue
+
+                    if stage == 'fanout':
+                        results = future.result()
+                    elif stage == 'encode':
+                        results = future.result()
+                        for job, (_, status) in zip(payload, results):
+                            shared[job['share_key']] = (job, status)
+                            followers = waiting.pop(job['share_key'], None)
+                            if followers:
+                                futures[pool.submit(self.fan_out, job, followers, status)] = \
+                                    ('fanout', followers)
+                    else:
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            result = e
+                        if isinstance(result, dict) and self._cancel_event.is_set():
+                            # После отмены подготовленное задание уже не кодируется
+                            result = self.stage(result, self.finish_file, False)
+                        if isinstance(result, dict):
+                            key = (result['replacement_hash'], tuple(result['encode_settings']))
+                            if key in shared:
+                                leader, status = shared[key]
+                                if status is None:
+                                    waiting[key].append(result)
+                                else:
+                                    futures[pool.submit(self.fan_out, leader, [result], status)] = \
+                                        ('fanout', [result])
+                                continue
+                            shared[key] = (result, None)
+                            waiting[key] = []
+                            result['share_key'] = key
+
+                        if not isinstance(result, dict):
+                            results = [(payload, result)]
+                        elif result['metrics']['bytes_in'] >= self.batch_file_bytes or batch_limit == 1:
+                            # Крупный файл кодируется отдельным процессом сразу
+                            futures[pool.submit(self.encode_jobs, [result])] = ('encode', [result])
+                            continue
+                        else:
+                            batch.append(result)
+                            batch_bytes += result['metrics']['bytes_in']
+                            if len(batch) >= batch_limit or batch_bytes >= self.batch_max_bytes:
+                                futures[pool.submit(self.encode_jobs, batch)] = ('encode', batch)
+                                batch = []
+                                batch_bytes = 0
+                            continue
+
+                    processed += self.report_results(results)
+                    self.on_progress(int(processed / total_tasks * 100))
+                    if time.monotonic() - last_stats >= self.stats_interval:
+                        self.on_stats(self.report.summary())
+                        if self.journal is not None:
+                            self.journal.flush()
+                        last_stats = time.monotonic()
+                    if time.monotonic() - last_manifest_save >= self.manifest_interval:
+                        # Чтобы после сбоя готовые замены не пришлось повторять
+                        self.save_manifests(manifests)
+                        last_manifest_save = time.monotonic()
+
+                # Все файлы подготовлены - неполная пачка кодируется без ожидания
+                if batch and not preparing:
+                    futures[pool.submit(self.encode_jobs, batch)] = ('encode', batch)
+                    batch = []
+                    batch_bytes = 0
+
+        if self.staged:
+            processed += self.report_results(self.write_archives())
+            self.on_progress(int(processed / total_tasks * 100))
+
+        # Манифест сохраняется и при отмене: готовые замены не придется повторять
+        self.save_manifests(manifests)
+        # Старые копии оригиналов удаляются, только когда замены уже в манифесте
+        self.backups.remove_superseded()
+        if self.journal is not None:
+            self.journal.close(self.run_id)
+
+        self.report.finish()
+        self.on_stats(self.report.summary())
+        if self.report_dir is not None:
+            try:
+                self.report_paths = self.report.write(self.report_dir)
+            except OSError as e:
+                self.errors.append((self.report_dir, str(e)))
+
+        self.cancelled = self._cancel_event.is_set()
+        skipped_text = f", без изменений пропущено: {self.skipped}" if self.skipped else ""
+        if self.cancelled:
+            self.on_status(f"Обработка отменена ({processed} из {total_tasks})")
+        elif self.errors:
+            self.on_status(f"Операции завершены, ошибок: {len(self.errors)}{skipped_text}")
+        else:
+            self.on_status(f"Все операции завершены!{skipped_text}")
+
+
+class BackupStore:
+    # Хранилище оригиналов вместо .bak-файлов в папке игры. Содержимое лежит
+    # в objects/ под своим хэшем, поэтому одинаковые оригиналы разных игр
+    # хранятся один раз, а журнал в SQLite помнит, что и куда возвращать.
+    # Объекты создаются через reflink или жесткую ссылку: замена кладется
+    # в игру новым файлом (os.replace), и старый inode остается в хранилище.
+    # output_sha256 - хэш замены, которая кладется поверх результата
+    # прошлого применения; пишется до того, как файл попадет в игру.
+
+    def __init__(self, backup_dir=BACKUP_DIR):
+        self.backup_dir = backup_dir
+        self.objects_dir = os.path.join(backup_dir, 'objects')
+        self.db_path = os.path.join(backup_dir, 'journal.sqlite')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        with open_db(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS backups (
+                    game TEXT NOT NULL,
+                    game_path TEXT NOT NULL,
+                    rel_path TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    output_sha256 TEXT,
+                    PRIMARY KEY (game, rel_path)
+                );
+                CREATE INDEX IF NOT EXISTS backups_by_object ON backups (sha256);
+                CREATE TABLE IF NOT EXISTS superseded (
+                    sha256 TEXT PRIMARY KEY
+                ) WITHOUT ROWID;
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(backups)")}
+            if 'output_sha256' not in columns:
+                conn.execute("ALTER TABLE backups ADD COLUMN output_sha256 TEXT")
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def original_hash(self, game_path, original_rel):
+        with open_db(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT sha256 FROM backups WHERE game = ? AND rel_path = ?",
+                (ScanIndex.game_key(game_path), original_rel)).fetchone()
+        return row[0] if row else None
+
+    def original_path(self, game_path, original_rel):
+        digest = self.original_hash(game_path, original_rel)
+        return self.object_path(digest) if digest else None
+
+    def backup(self, game_path, original_rel, refresh=False):
+        # Сохраняет оригинал один раз: если запись уже есть, в игре лежит
+        # наша замена и трогать хранилище нельзя. refresh - в игре лежит уже
+        # не наша замена (игра обновилась или проверка файлов вернула
+        # оригинал), и копия снимается заново вместо устаревшей
+        with open_db(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT sha256, output_sha256 FROM backups WHERE game = ? AND rel_path = ?",
+                (ScanIndex.game_key(game_path), original_rel)).fetchone()
+        previous, placed = row if row else (None, None)
+        if previous is not None and not refresh:
+            return False
+
+        original_full = os.path.join(game_path, original_rel)
+        # .bak от старых версий программы содержит настоящий оригинал
+        legacy_backup = original_full + '.bak'
+        source = original_full
+        if previous is None and os.path.exists(legacy_backup):
+            source = legacy_backup
+
+        mtime_ns = audio_stat(source)[1]
+        digest = file_sha256(source)
+        if digest == placed:
+            # В игре наша замена, положенная перед сбоем, который помешал
+            # сохранить манифест: это не обновление игры, копия верна
+            return False
+        object_path = self.object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            if split_archive_path(source)[1] is None:
+                place_file(source, object_path)
+            else:
+                extract_entry(source, object_path)
+
+        with open_db(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO backups (game, game_path, rel_path, sha256, mtime_ns, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (ScanIndex.game_key(game_path), game_path, original_rel, digest,
+                 mtime_ns, time.time()))
+            # Прежний объект удаляется не здесь, а после сохранения манифестов
+            # (remove_superseded): до тех пор старый оригинал еще на месте
+            if previous is not None and previous != digest:
+                conn.execute("INSERT OR IGNORE INTO superseded VALUES (?)", (previous,))
+        if source == legacy_backup:
+            os.remove(legacy_backup)
+        return True
+
+    def note_outputs(self, outputs):
+        # outputs - тройки (папка игры, путь, хэш замены, которая сейчас
+        # ляжет в игру); все пишутся одной транзакцией
+        with open_db(self.db_path) as conn:
+            conn.executemany(
+                "UPDATE backups SET output_sha256 = ? WHERE game = ? AND rel_path = ?",
+                [(digest, ScanIndex.game_key(game_path), original_rel)
+                 for game_path, original_rel, digest in outputs])
+
+    def remove_superseded(self):
+        # Объекты оригиналов, вместо которых backup снял новые копии
+        with open_db(self.db_path) as conn:
+            digests = [digest for (digest,) in conn.execute("SELECT sha256 FROM superseded")]
+            conn.execute("DELETE FROM superseded")
+            self.remove_unused(conn, digests)
+
+    def entries(self, game_path=None, targets=None):
+        with open_db(self.db_path) as conn:
+            if game_path is None:
+                rows = conn.execute(
+                    "SELECT game, game_path, rel_path, sha256, mtime_ns FROM backups").fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT game, game_path, rel_path, sha256, mtime_ns FROM backups WHERE game = ?",
+                    (ScanIndex.game_key(game_path),)).fetchall()
+        if targets is not None:
+            targets = set(targets)
+            rows = [row for row in rows if row[2] in targets]
+        # Порядок по путям - соседние файлы пишутся подряд
+        rows.sort(key=lambda row: (row[0], row[2]))
+        return rows
+
+    def restore(self, game_path=None, targets=None):
+        # Возвращает оригиналы игры (или всех игр) одним проходом по журналу.
+        # Результат - (список пар (папка игры, путь), список ошибок)
+        restored = []
+        done = []
+        errors = []
+        archived = {}
+        for game, stored_game_path, original_rel, digest, mtime_ns in self.entries(game_path, targets):
+            original_full = os.path.join(game_path or stored_game_path, original_rel)
+            archive, entry = split_archive_path(original_full)
+            if entry is not None:
+                archived.setdefault(archive, []).append(
+                    (game, game_path or stored_game_path, original_rel, digest, entry))
+                continue
+            try:
+                place_file(self.object_path(digest), original_full)
+                os.utime(original_full, ns=(mtime_ns, mtime_ns))
+            except OSError as e:
+                errors.append((original_rel, str(e)))
+                continue
+            restored.append((game_path or stored_game_path, original_rel))
+            done.append((game, original_rel, digest))
+
+        # Записи одного архива возвращаются одной его перезаписью
+        for archive, items in archived.items():
+            try:
+                rewrite_archive(archive, {entry: self.object_path(digest) for *_, digest, entry in items})
+            except (OSError, ValueError) as e:
+                errors.extend((original_rel, str(e)) for _, _, original_rel, _, _ in items)
+                continue
+            for game, root, original_rel, digest, _ in items:
+                restored.append((root, original_rel))
+                done.append((game, original_rel, digest))
+
+        with open_db(self.db_path) as conn:
+            conn.executemany(
+                "DELETE FROM backups WHERE game = ? AND rel_path = ?",
+                [(game, original_rel) for game, original_rel, _ in done])
+            self.remove_unused(conn, {digest for _, _, digest in done})
+        return restored, errors
+
+    def remove_unused(self, conn, digests):
+        # Удаляет объекты, на которые больше не ссылается ни одна игра
+        for digest in digests:
+            if conn.execute("SELECT 1 FROM backups WHERE sha256 = ?", (digest,)).fetchone() is None:
+                try:
+                    os.remove(self.object_path(digest))
+                except FileNotFoundError:
+                    pass
+
+
+class ProfileStore:
+    # Профили модов: {имя: {'game_path': '', 'replacements': {}}}.
+    # Каждый профиль хранится отдельными строками в SQLite: сохранение или
+    # удаление одного профиля - одна транзакция, остальные не перезаписываются.
+    # Замены читаются только для запрошенного профиля (get), список профилей
+    # берется без них (names). mod_profiles.json старых версий переносится
+    # в базу при первом запуске и остается рядом как *.migrated.
+
+    def __init__(self, path=PROFILES_DB, legacy_path=PROFILES_FILE):
+        self.path = path
+        with open_db(self.path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS profiles (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE NOT NULL,
+                    game_path TEXT NOT NULL,
+                    updated REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS replacements (
+                    profile_id INTEGER NOT NULL,
+                    original_rel TEXT NOT NULL,
+                    replacement_path TEXT NOT NULL,
+                    PRIMARY KEY (profile_id, original_rel)
+                ) WITHOUT ROWID;
+            """)
+        if legacy_path and os.path.exists(legacy_path):
+            self.migrate(legacy_path)
+
+    def migrate(self, legacy_path):
+        try:
+            with open(legacy_path, 'r') as f:
+                profiles = json.load(f)
+        except json.JSONDecodeError:
+            return
+        # Импорт идет одной транзакцией: при сбое JSON остается на месте
+        # и перенос повторится при следующем запуске. Профили, уже
+        # сохраненные в базе, не перезаписываются
+        with open_db(self.path) as conn:
+            existing = {name for (name,) in conn.execute("SELECT name FROM profiles")}
+            for name, profile in profiles.items():
+                if name not in existing:
+                    self.write(conn, name, profile['game_path'], profile['replacements'])
+        os.replace(legacy_path, legacy_path + '.migrated')
+
+    @staticmethod
+    def write(conn, name, game_path, replacements):
+        row = conn.execute("SELECT id FROM profiles WHERE name = ?", (name,)).fetchone()
+        if row:
+            profile_id = row[0]
+            conn.execute(
+                "UPDATE profiles SET game_path = ?, updated = ? WHERE id = ?",
+                (game_path, time.time(), profile_id))
+            conn.execute("DELETE FROM replacements WHERE profile_id = ?", (profile_id,))
+        else:
+            profile_id = conn.execute(
+                "INSERT INTO profiles (name, game_path, updated) VALUES (?, ?, ?)",
+                (name, game_path, time.time())).lastrowid
+        conn.executemany(
+            "INSERT INTO replacements (profile_id, original_rel, replacement_path) VALUES (?, ?, ?)",
+            ((profile_id, original_rel, replacement_path)
+             for original_rel, replacement_path in replacements.items()))
+
+    def names(self):
+        with open_db(self.path) as conn:
+            return [name for (name,) in conn.execute("SELECT name FROM profiles ORDER BY id")]
+
+    def get(self, name):
+        with open_db(self.path) as conn:
+            row = conn.execute(
+                "SELECT id, game_path FROM profiles WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            profile_id, game_path = row
+            rows = conn.execute(
+                "SELECT original_rel, replacement_path FROM replacements WHERE profile_id = ?",
+                (profile_id,))
+            return {'game_path': game_path, 'replacements': dict(rows)}
+
+    def save_profile(self, name, game_path, replacements):
+        with open_db(self.path) as conn:
+            self.write(conn, name, game_path, replacements)
+
+    def delete(self, name):
+        with open_db(self.path) as conn:
+            row = conn.execute("SELECT id FROM profiles WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return False
+            conn.execute("DELETE FROM replacements WHERE profile_id = ?", row)
+            conn.execute("DELETE FROM profiles WHERE id = ?", row)
+            return True
+
+    def load(self):
+        return {name: self.get(name) for name in self.names()}
+
+    def save(self, profiles):
+        # Полная замена набора профилей одной транзакцией
+        with open_db(self.path) as conn:
+            stale = [
+                (profile_id,) for profile_id, name in conn.execute("SELECT id, name FROM profiles")
+                if name not in profiles
+            ]
+            conn.executemany("DELETE FROM replacements WHERE profile_id = ?", stale)
+            conn.executemany("DELETE FROM profiles WHERE id = ?", stale)
+            for name, profile in profiles.items():
+                self.write(conn, name, profile['game_path'], profile['replacements'])
+
+
+def restore_backups(game_path=None, targets=None, store=None):
+    # Возвращает оригиналы игры (или всех игр, если game_path не задан).
+    # Без списка targets восстанавливается все, что есть в журнале.
+    # Результат - (количество восстановленных, список ошибок)
+    store = store if store is not None else BackupStore()
+    restored, errors = store.restore(game_path, targets)
+
+    # .bak-файлы, оставшиеся от старых версий программы
+    if game_path is not None:
+        if targets is None:
+            legacy_targets = [
+                relative_path[:-len('.bak')]
+                for relative_path, _ in iter_files(game_path, ('.bak',))
+                if relative_path[:-len('.bak')].lower().endswith(AUDIO_EXTENSIONS)
+            ]
+        else:
+            legacy_targets = targets
+        for original_rel in legacy_targets:
+            original_full = os.path.join(game_path, original_rel)
+            if not os.path.exists(original_full + '.bak'):
+                continue
+            try:
+                os.replace(original_full + '.bak', original_full)
+                restored.append((game_path, original_rel))
+            except OSError as e:
+                errors.append((original_rel, str(e)))
+
+    by_game = {}
+    for restored_game, original_rel in restored:
+        by_game.setdefault(restored_game, []).append(original_rel)
+    for restored_game, restored_files in by_game.items():
+        manifest = ReplacementManifest(restored_game)
+        for original_rel in restored_files:
+            manifest.forget(original_rel)
+        manifest.save()
+    return len(restored), errors
+
+
+@contextmanager
+def wav_pcm(path):
+    # (каналы, байт на сэмпл, частота, сэмплы) PCM WAV без запуска ffmpeg и
+    # без копирования: сэмплы - срез отображенного в память файла, живой
+    # только внутри with. None - не PCM WAV (float, ADPCM, другой формат)
+    with open_audio_data(path) as data:
+        chunks = parse_wav(data)
+        if chunks is None or chunks[1] is None or len(chunks[0]) < 16:
+            yield None
+            return
+        tag, channels, sample_rate, bits = wav_format(chunks[0])
+        if tag != 1 or bits not in (8, 16, 24, 32) or not channels:
+            yield None
+            return
+        samples = memoryview(data)[chunks[1]:chunks[2]]
+        try:
+            yield channels, bits // 8, sample_rate, samples
+        finally:
+            samples.release()
+
+
+def decode_ffmpeg(path, sample_format, sample_rate=ANALYSIS_RATE, channels=1):
+    # Первая аудиодорожка в сырых сэмплах в stdout; по умолчанию - моно
+    # с частотой ANALYSIS_RATE для анализа волны
+    try:
+        result = run_on_audio(
+            [FFMPEG, "-v", "error", "-i"], path,
+            ["-map", "0:a:0", "-ac", str(channels), "-ar", str(sample_rate), "-f", sample_format, "-"])
+    except OSError as e:
+        raise EncoderError(f"Не удалось запустить ffmpeg: {e}", None)
+    if result.returncode != 0:
+        log = result.stderr.decode('utf-8', 'replace')[-4000:]
+        last_line = log.strip().splitlines()[-1] if log.strip() else ''
+        raise EncoderError(f"ffmpeg завершился с кодом {result.returncode}: {last_line}", log)
+    return result.stdout
+
+
+_numpy = False  # False - еще не загружался
+
+
+def load_numpy():
+    # NumPy нужен только анализу волны, а его импорт - десятки мс, поэтому
+    # он загружается при первом анализе, а не при каждом запуске CLI.
+    # Без NumPy (None) анализ идет медленнее, через модуль array
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+
+def pcm_to_float(data, width, channels):
+    np = load_numpy()
+    if width == 1:
+        samples = (np.frombuffer(data, np.uint8).astype(np.float32) - 128) / 128
+    elif width == 3:
+        # 24-битные сэмплы дополняются нулевым младшим байтом до int32
+        raw = np.frombuffer(data, np.uint8, len(data) // 3 * 3).reshape(-1, 3)
+        padded = np.zeros((len(raw), 4), np.uint8)
+        padded[:, 1:] = raw
+        samples = padded.view('<i4').ravel() / np.float32(2 ** 31)
+    else:
+        dtype = '<i2' if width == 2 else '<i4'
+        samples = np.frombuffer(data, dtype, len(data) // width) / np.float32(2 ** (8 * width - 1))
+    if channels > 1:
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    return samples.astype(np.float32, copy=False)
+
+
+def analyze_samples_numpy(samples, points):
+    np = load_numpy()
+    magnitude = np.abs(samples)
+    count = min(points, len(magnitude))
+    # Огибающая - максимум модуля на каждом из count равных отрезков
+    edges = np.linspace(0, len(magnitude), count + 1).astype(np.intp)[:-1]
+    envelope = np.maximum.reduceat(magnitude, edges)
+    return {
+        'peak': float(magnitude.max()),
+        'rms': float(np.sqrt(np.mean(np.square(samples, dtype=np.float64)))),
+        'envelope': np.clip(envelope * 255 + 0.5, 0, 255).astype(np.uint8).tobytes(),
+    }
+
+
+def analyze_samples_array(samples, points):
+    count = min(points, len(samples))
+    bounds = [len(samples) * i // count for i in range(count + 1)]
+    envelope = bytes(
+        min(255, max(max(chunk), -min(chunk)) * 255 // 32768)
+        for chunk in (samples[start:end] for start, end in zip(bounds, bounds[1:])))
+    return {
+        'peak': max(max(samples), -min(samples)) / 32768,
+        'rms': math.sqrt(sum(map(operator.mul, samples, samples)) / len(samples)) / 32768,
+        'envelope': envelope,
+    }
+
+
+def analyze_audio(path, points=WAVEFORM_POINTS):
+    # Длительность, пик и RMS (доли полной шкалы) и огибающая волны из points
+    # значений 0-255 для миниатюры
+    np = load_numpy()
+    if np is not None:
+        with wav_pcm(path) as wav:
+            if wav is not None:
+                channels, width, sample_rate, data = wav
+                samples = pcm_to_float(data, width, channels)
+        if wav is None:
+            sample_rate = ANALYSIS_RATE
+            samples = np.frombuffer(decode_ffmpeg(path, 'f32le'), '<f4')
+        analyze_samples = analyze_samples_numpy
+    else:
+        sample_rate = ANALYSIS_RATE
+        samples = array('h')
+        samples.frombytes(decode_ffmpeg(path, 's16le'))
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        analyze_samples = analyze_samples_array
+
+    if not len(samples):
+        return {'duration': 0.0, 'peak': 0.0, 'rms': 0.0, 'envelope': b''}
+    result = analyze_samples(samples, points)
+    result['duration'] = len(samples) / sample_rate
+    return result
+
+
+def duration_mismatch(original, replacement, ratio=DURATION_RATIO, slack=DURATION_SLACK):
+    return replacement > original * ratio and replacement - original > slack
+
+
+class AnalysisCache:
+    # Результаты analyze_audio: LRU в памяти поверх SQLite на диске. Ключ -
+    # путь, размер и mtime файла, так что измененный файл анализируется заново.
+    # Потокобезопасен: им пользуются фоновый анализ и проверка длительностей.
+
+    def __init__(self, db_path=ANALYSIS_DB, memory_items=2048, points=WAVEFORM_POINTS):
+        self.db_path = db_path
+        self.memory_items = memory_items
+        self.points = points
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        with open_db(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS analysis (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    duration REAL NOT NULL,
+                    peak REAL NOT NULL,
+                    rms REAL NOT NULL,
+                    envelope BLOB NOT NULL
+                )
+            """)
+
+    @staticmethod
+    def file_key(path):
+        size, mtime_ns = audio_stat(path)
+        return os.path.normcase(os.path.abspath(path)), size, mtime_ns
+
+    def remember(self, key, result):
+        with self._lock:
+            self._memory[key] = result
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def lookup(self, key):
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                return result
+        with open_db(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT duration, peak, rms, envelope FROM analysis "
+                "WHERE path = ? AND size = ? AND mtime_ns = ?", key).fetchone()
+        if row is None:
+            return None
+        result = {'duration': row[0], 'peak': row[1], 'rms': row[2], 'envelope': bytes(row[3])}
+        self.remember(key, result)
+        return result
+
+    def cached(self, path):
+        # Только готовый результат, без анализа; None - файла нет в кэше
+        try:
+            return self.lookup(self.file_key(path))
+        except OSError:
+            return None
+
+    def analyze(self, path):
+        key = self.file_key(path)
+        result = self.lookup(key)
+        if result is None:
+            result = analyze_audio(path, self.points)
+            with open_db(self.db_path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (*key, result['duration'], result['peak'], result['rms'], result['envelope']))
+            self.remember(key, result)
+        return result
+
+
+def decode_preview(path):
+    # (PCM s16le, частота, каналы) для воспроизведения из памяти: 16-битный
+    # WAV берется как есть, остальное ffmpeg декодирует в стерео PREVIEW_RATE
+    with wav_pcm(path) as wav:
+        if wav is not None and wav[1] == 2 and wav[0] <= 2:
+            channels, _, sample_rate, data = wav
+            if sys.byteorder == 'big':
+                samples = array('h', bytes(data))
+                samples.byteswap()
+                return samples.tobytes(), sample_rate, channels
+            return bytes(data), sample_rate, channels
+    return decode_ffmpeg(path, 's16le', PREVIEW_RATE, 2), PREVIEW_RATE, 2
+
+
+class PcmCache:
+    # Декодированный звук для прослушивания: LRU в памяти с ограничением по
+    # объему. Ключ, как у AnalysisCache, - путь, размер и mtime файла
+    def __init__(self, max_bytes=PREVIEW_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            key = AnalysisCache.file_key(path)
+        except OSError:
+            return None
+        with self._lock:
+            pcm = self._entries.get(key)
+            if pcm is not None:
+                self._entries.move_to_end(key)
+            return pcm
+
+    def load(self, path):
+        pcm = self.get(path)
+        if pcm is not None:
+            return pcm
+        key = AnalysisCache.file_key(path)
+        pcm = decode_preview(path)
+        # Файл больше всего кэша воспроизводится, но не вытесняет остальное
+        if len(pcm[0]) > self.max_bytes:
+            return pcm
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = pcm
+                self.size += len(pcm[0])
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted[0])
+        return pcm
+
+
+def original_audio_path(game_path, original_rel, backups=None):
+    # После применения замены в игре лежит она, а оригинал - в хранилище копий
+    backup = backups.original_path(game_path, original_rel) if backups is not None else None
+    return backup or os.path.join(game_path, original_rel)
+
+
+def check_durations(pairs, cache, max_workers=None, on_progress=None, cancel_event=None,
+                    ratio=DURATION_RATIO, slack=DURATION_SLACK):
+    # pairs - [(метка, путь к оригиналу, путь к замене)]. Все файлы
+    # анализируются параллельно (повторы - один раз), результат:
+    # {'mismatches': [(метка, длительность оригинала, длительность замены)],
+    #  'errors': [(метка, текст ошибки)]}
+    paths = {path for _, original, replacement in pairs for path in (original, replacement)}
+    results, failures = {}, {}
+
+    def analyze(path):
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        return cache.analyze(path)
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        futures = {executor.submit(analyze, path): path for path in paths}
+        for done, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                results[path] = future.result()
+            except (OSError, EncoderError, ValueError) as e:
+                failures[path] = str(e)
+            if on_progress:
+                on_progress(int(done / len(futures) * 100))
+
+    mismatches, errors = [], []
+    for label, original, replacement in pairs:
+        error = failures.get(original) or failures.get(replacement)
+        if error:
+            errors.append((label, error))
+            continue
+        first, second = results.get(original), results.get(replacement)
+        if first is None or second is None:
+            continue  # Отменено
+        if duration_mismatch(first['duration'], second['duration'], ratio, slack):
+            mismatches.append((label, first['duration'], second['duration']))
+    return {'mismatches': mismatches, 'errors': errors}
+
+
+def parse_ebur128(log):
+    # Итог фильтра ebur128 из stderr ffmpeg: {'integrated': LUFS, 'true_peak': dBTP};
+    # у тишины громкость и пик - None
+    summary = log.rpartition('Summary:')[2]
+    integrated = re.search(r'I:\s+(-?[\d.]+|-inf) LUFS', summary)
+    if integrated is None:
+        raise ValueError("ffmpeg не вернул итог измерения громкости")
+    peak = re.search(r'Peak:\s+(-?[\d.]+|-inf) dBFS', summary)
+    result = {'integrated': float(integrated.group(1)), 'true_peak': None}
+    if peak is not None and peak.group(1) != '-inf':
+        result['true_peak'] = float(peak.group(1))
+    if result['integrated'] <= LOUDNESS_SILENCE:
+        result['integrated'] = None
+    return result
+
+
+def measure_loudness(path):
+    try:
+        result = run_on_audio(
+            [FFMPEG, "-hide_banner", "-nostats", "-i"], path,
+            ["-map", "0:a:0", "-af", "ebur128=peak=true", "-f", "null", "-"])
+    except OSError as e:
+        raise EncoderError(f"Не удалось запустить ffmpeg: {e}", None)
+    log = result.stderr.decode('utf-8', 'replace')
+    if result.returncode != 0:
+        last_line = log.strip().splitlines()[-1] if log.strip() else ''
+        raise EncoderError(f"ffmpeg завершился с кодом {result.returncode}: {last_line}", log[-4000:])
+    return parse_ebur128(log)
+
+
+def loudness_gain(original, replacement, max_gain=LOUDNESS_MAX_GAIN, ceiling=LOUDNESS_PEAK_CEILING):
+    # Усиление замены в дБ (с точностью 0.1) до громкости оригинала; None -
+    # менять нечего или одна из записей - тишина
+    if original['integrated'] is None or replacement['integrated'] is None:
+        return None
+    gain = original['integrated'] - replacement['integrated']
+    if replacement['true_peak'] is not None:
+        gain = min(gain, ceiling - replacement['true_peak'])
+    gain = round(max(-max_gain, min(max_gain, gain)), 1)
+    return gain or None
+
+
+class LoudnessCache:
+    # Измерения громкости по хэшу содержимого: одна и та же запись в разных
+    # профилях и играх, в том числе переименованная, измеряется один раз.
+    # Лежит в той же базе, что и анализ волны
+
+    def __init__(self, db_path=ANALYSIS_DB, memory_items=65536):
+        self.db_path = db_path
+        self.memory_items = memory_items
+        self.measured = 0
+        self.hits = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        with open_db(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS loudness (
+                    sha256 TEXT PRIMARY KEY,
+                    integrated REAL,
+                    true_peak REAL
+                ) WITHOUT ROWID
+            """)
+
+    def remember(self, digest, result):
+        with self._lock:
+            self._memory[digest] = result
+            self._memory.move_to_end(digest)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def measure(self, path, digest=None):
+        digest = digest or file_sha256(path)
+        with self._lock:
+            result = self._memory.get(digest)
+        if result is None:
+            with open_db(self.db_path) as conn:
+                row = conn.execute(
+                    "SELECT integrated, true_peak FROM loudness WHERE sha256 = ?", (digest,)).fetchone()
+            if row is not None:
+                result = {'integrated': row[0], 'true_peak': row[1]}
+        if result is not None:
+            self.remember(digest, result)
+            with self._lock:
+                self.hits += 1
+            return result
+
+        result = measure_loudness(path)
+        with open_db(self.db_path) as conn:
+            conn.execute("INSERT OR REPLACE INTO loudness VALUES (?, ?, ?)",
+                         (digest, result['integrated'], result['true_peak']))
+        self.remember(digest, result)
+        with self._lock:
+            self.measured += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'measured': self.measured, 'hits': self.hits}
+
+
+def iter_files(root, extensions):
+    prefix_len = len(os.path.join(root, ''))
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.lower().endswith(extensions):
+                            yield entry.path[prefix_len:], entry.path
+                    except OSError:
+                        continue
+        except OSError:
+            continue
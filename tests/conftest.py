@@ -0,0 +1,58 @@
+# Общие заготовки тестов ядра: рабочая папка и заглушка ffmpeg из бенчмарков,
+# которая копирует i-й вход в i-й выход
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import gvt_core  # noqa: E402
+from bench_gvt import make_fake_ffmpeg, write_wav  # noqa: E402
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Индекс, манифесты, копии и журнал ядро держит в текущей папке
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(gvt_core, 'FFMPEG', make_fake_ffmpeg(str(tmp_path)))
+    return tmp_path
+
+
+def make_task(root, count, shared_replacement=False):
+    # Игра из count WAV 22 кГц и замены 44 кГц: формат разный, поэтому
+    # каждую замену нужно кодировать, а не копировать
+    game_path = os.path.join(root, 'game')
+    dub_path = os.path.join(root, 'dub')
+    os.makedirs(game_path, exist_ok=True)
+    os.makedirs(dub_path, exist_ok=True)
+    replacements = {}
+    for i in range(count):
+        original_rel = f'line_{i:04d}.wav'
+        write_wav(os.path.join(game_path, original_rel), value=i)
+        replacement = os.path.join(dub_path, 'line.wav' if shared_replacement else original_rel)
+        if not os.path.exists(replacement):
+            write_wav(replacement, sample_rate=44100, value=1000 + i)
+        replacements[original_rel] = replacement
+    return {'game_path': game_path, 'replacements': replacements}
+
+
+def run_to_end(processor, timeout=60):
+    # run() в отдельном потоке, как в GUI и CLI; зависание или исключение -
+    # провал теста, а не зависший прогон
+    errors = []
+
+    def target():
+        try:
+            processor.run()
+        except BaseException as e:
+            errors.append(e)
+
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    assert not worker.is_alive(), "run() не завершился"
+    assert errors == []
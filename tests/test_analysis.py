@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+import gvt_core
+from bench_gvt import write_wav
+from conftest import ROOT
+
+
+def test_import_does_not_load_numpy():
+    # NumPy загружается при первом анализе, а не при запуске CLI
+    code = "import sys, gvt_core; print('numpy' in sys.modules)"
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                            check=True)
+    assert result.stdout.strip() == 'False'
+
+
+def test_analyze_wav(tmp_path):
+    path = str(tmp_path / 'line.wav')
+    write_wav(path, frames=2205, value=16384)
+    result = gvt_core.analyze_audio(path, points=10)
+    assert result['duration'] == 0.1
+    assert result['peak'] == 0.5
+    assert abs(result['rms'] - 0.5) < 1e-6
+    assert len(result['envelope']) == 10
@@ -0,0 +1,161 @@
+import io
+import os
+import struct
+import zipfile
+
+import gvt_core
+from bench_gvt import write_wav
+from conftest import run_to_end
+
+
+def make_archive_task(root, entries):
+    # Архив игры с записями entries и одна запись озвучки на все строки
+    game_path = os.path.join(root, 'game')
+    os.makedirs(game_path)
+    original = os.path.join(root, 'original.wav')
+    write_wav(original)
+    archive = os.path.join(game_path, 'data.pk3')
+    with zipfile.ZipFile(archive, 'w') as f:
+        for entry in entries:
+            f.write(original, entry)
+    dub = os.path.join(root, 'line.wav')
+    write_wav(dub, sample_rate=44100, value=1000)
+    replacements = {f'data.pk3{gvt_core.ARCHIVE_SEPARATOR}{entry}': dub for entry in entries}
+    return {'game_path': game_path, 'replacements': replacements}, archive, dub
+
+
+def test_duplicate_entries_share_one_rewrite(workdir):
+    # Все записи архива получают одну и ту же конвертацию: первая
+    # кодируется, остальные попадают в ту же перезапись архива
+    entries = ['vo/a.wav', 'vo/b.wav', 'vo/c.wav']
+    task, archive, dub = make_archive_task(workdir, entries)
+    processor = gvt_core.ReplacementProcessor([task], 2, report_dir=None)
+    run_to_end(processor)
+
+    summary = processor.report.summary()
+    assert processor.errors == []
+    assert summary['done'] == 3
+    assert summary['cancelled'] == 0
+    with open(dub, 'rb') as f:
+        expected = f.read()
+    with zipfile.ZipFile(archive) as f:
+        assert f.testzip() is None
+        assert [f.read(entry) for entry in entries] == [expected] * 3
+
+
+class Unseekable(io.RawIOBase):
+    # Поток без seek: zipfile пишет такие записи с data descriptor
+
+    def __init__(self, f):
+        self.f = f
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.f.write(data)
+
+
+def make_archive(path, entries, comment=b'', unseekable=False, compression=zipfile.ZIP_DEFLATED):
+    with open(path, 'wb') as f:
+        with zipfile.ZipFile(Unseekable(f) if unseekable else f, 'w', compression) as archive:
+            archive.comment = comment
+            for name, data in entries.items():
+                archive.writestr(name, data)
+
+
+def write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def local_records(path):
+    # {имя: локальная запись целиком - заголовок, данные и data descriptor},
+    # от ее начала до следующей записи или central directory
+    with open(path, 'rb') as f:
+        data = f.read()
+    with zipfile.ZipFile(path) as archive:
+        infos = sorted(archive.infolist(), key=lambda info: info.header_offset)
+    ends = [info.header_offset for info in infos[1:]] + [data.index(b'PK\x01\x02')]
+    return {info.filename: data[info.header_offset:end] for info, end in zip(infos, ends)}
+
+
+def extra_ids(extra):
+    ids = []
+    while len(extra) >= 4:
+        field_id, size = struct.unpack('<HH', extra[:4])
+        ids.append(field_id)
+        extra = extra[4 + size:]
+    return ids
+
+
+def read_archive(path):
+    with zipfile.ZipFile(path) as archive:
+        assert archive.testzip() is None
+        # У записи не больше одного поля zip64
+        assert all(extra_ids(info.extra).count(1) <= 1 for info in archive.infolist())
+        return {info.filename: archive.read(info) for info in archive.infolist()}
+
+
+ENTRIES = {
+    'vo/a.wav': b'a' * 1000,
+    'vo/b.wav': bytes(range(256)) * 2,
+    'vo/c.wav': b'c' * 50,
+}
+
+
+def test_rewrite_entries_with_data_descriptors(tmp_path):
+    archive = str(tmp_path / 'data.pk3')
+    make_archive(archive, ENTRIES, unseekable=True)
+    with zipfile.ZipFile(archive) as f:
+        assert all(info.flag_bits & 0x08 for info in f.infolist())
+
+    before = local_records(archive)
+    new = write_file(str(tmp_path / 'new.wav'), b'n' * 700)
+    gvt_core.rewrite_archive(archive, {'vo/b.wav': new})
+    assert read_archive(archive) == dict(ENTRIES, **{'vo/b.wav': b'n' * 700})
+    # Неизмененные записи копируются байт в байт, вместе с data descriptor
+    after = local_records(archive)
+    assert after['vo/a.wav'] == before['vo/a.wav']
+    assert after['vo/c.wav'] == before['vo/c.wav']
+
+
+def test_rewrite_keeps_utf8_names_comment_and_method(tmp_path):
+    archive = str(tmp_path / 'data.zip')
+    entries = {'голос/привет.wav': b'x' * 200, 'vo/stored.wav': b'y' * 200}
+    make_archive(archive, {'голос/привет.wav': entries['голос/привет.wav']}, comment=b'game data')
+    with zipfile.ZipFile(archive, 'a', zipfile.ZIP_STORED) as f:
+        f.writestr('vo/stored.wav', entries['vo/stored.wav'])
+
+    updates = {
+        'голос/привет.wav': write_file(str(tmp_path / 'a.wav'), b'z' * 5000),
+        'vo/stored.wav': write_file(str(tmp_path / 'b.wav'), b'w' * 10),
+    }
+    gvt_core.rewrite_archive(archive, updates)
+    assert read_archive(archive) == {'голос/привет.wav': b'z' * 5000, 'vo/stored.wav': b'w' * 10}
+    with zipfile.ZipFile(archive) as f:
+        assert f.comment == b'game data'
+        assert f.getinfo('голос/привет.wav').flag_bits & 0x800
+        assert f.getinfo('голос/привет.wav').compress_type == zipfile.ZIP_DEFLATED
+        assert f.getinfo('vo/stored.wav').compress_type == zipfile.ZIP_STORED
+
+
+def test_rewrite_switches_to_zip64_past_limit(tmp_path, monkeypatch):
+    # Порог zip64 занижен: размеры и смещения записей его превышают
+    archive = str(tmp_path / 'data.pk3')
+    make_archive(archive, ENTRIES, comment=b'game data')
+    monkeypatch.setattr(gvt_core, 'ZIP64_LIMIT', 10)
+
+    new = write_file(str(tmp_path / 'new.wav'), b'n' * 700)
+    gvt_core.rewrite_archive(archive, {'vo/c.wav': new})
+    expected = dict(ENTRIES, **{'vo/c.wav': b'n' * 700})
+    assert read_archive(archive) == expected
+    with open(archive, 'rb') as f:
+        assert b'PK\x06\x06' in f.read()
+
+    # Повторная перезапись архива, уже содержащего поля zip64
+    gvt_core.rewrite_archive(archive, {'vo/a.wav': new})
+    assert read_archive(archive) == dict(expected, **{'vo/a.wav': b'n' * 700})
+    with zipfile.ZipFile(archive) as f:
+        assert f.comment == b'game data'
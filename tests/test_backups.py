@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+import gvt_core
+from bench_gvt import write_wav
+from conftest import make_task, run_to_end
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_backup_refreshed_after_game_update(workdir):
+    # Игра заменила нашу замену новым оригиналом: следующее применение
+    # снимает новую копию, и откат возвращает новый оригинал, а не старый
+    task = make_task(workdir, 2)
+    original_full = os.path.join(task['game_path'], 'line_0000.wav')
+    first_original = read(original_full)
+    run_to_end(gvt_core.ReplacementProcessor([task], 2, report_dir=None))
+
+    write_wav(original_full, frames=128, value=7)
+    updated_original = read(original_full)
+    assert updated_original != first_original
+    run_to_end(gvt_core.ReplacementProcessor([task], 2, report_dir=None))
+    assert read(original_full) == read(task['replacements']['line_0000.wav'])
+
+    restored, errors = gvt_core.restore_backups(task['game_path'])
+    assert errors == []
+    assert restored == 2
+    assert read(original_full) == updated_original
+
+
+def test_backup_kept_when_replacement_in_place(workdir):
+    # Повторное применение поверх собственной замены копию не трогает
+    task = make_task(workdir, 1)
+    original_full = os.path.join(task['game_path'], 'line_0000.wav')
+    first_original = read(original_full)
+    run_to_end(gvt_core.ReplacementProcessor([task], 1, report_dir=None))
+    run_to_end(gvt_core.ReplacementProcessor([task], 1, force=True, report_dir=None))
+
+    gvt_core.restore_backups(task['game_path'])
+    assert read(original_full) == first_original
+
+
+class Crash(BaseException):
+    pass
+
+
+class CrashBeforeManifest(gvt_core.ReplacementProcessor):
+    # Процесс обрывается сразу после того, как замена легла в игру:
+    # ни манифест, ни журнал сохранить не успели
+
+    def record(self, job):
+        raise Crash()
+
+
+def test_resume_after_crash_keeps_original(workdir):
+    task = make_task(workdir, 1)
+    original_full = os.path.join(task['game_path'], 'line_0000.wav')
+    first_original = read(original_full)
+    run_to_end(gvt_core.ReplacementProcessor([task], 1, report_dir=None))
+
+    # Новая версия записи: в манифесте остается результат прошлой
+    dub = task['replacements']['line_0000.wav']
+    write_wav(dub, sample_rate=44100, value=2000)
+    journal = gvt_core.JobJournal()
+    with pytest.raises(Crash):
+        CrashBeforeManifest([task], 1, journal=journal, report_dir=None).run()
+    assert read(original_full) == read(dub)
+
+    [(run_id, _, _, _)] = journal.unfinished()
+    tasks, _ = journal.pending(run_id)
+    processor = gvt_core.ReplacementProcessor(tasks, 1, journal=gvt_core.JobJournal(), run_id=run_id,
+                                              report_dir=None)
+    run_to_end(processor)
+    assert processor.errors == []
+
+    gvt_core.restore_backups(task['game_path'])
+    assert read(original_full) == first_original
+
+
+def test_refresh_keeps_previous_object_until_run_ends(workdir):
+    task = make_task(workdir, 1)
+    store = gvt_core.BackupStore()
+    store.backup(task['game_path'], 'line_0000.wav')
+    first = store.original_path(task['game_path'], 'line_0000.wav')
+
+    write_wav(os.path.join(task['game_path'], 'line_0000.wav'), frames=128, value=7)
+    assert store.backup(task['game_path'], 'line_0000.wav', refresh=True)
+    assert store.original_path(task['game_path'], 'line_0000.wav') != first
+    assert os.path.exists(first)
+
+    store.remove_superseded()
+    assert not os.path.exists(first)
@@ -0,0 +1,35 @@
+import os
+
+import gvt_core
+
+
+def task(*original_rels):
+    return {'game_path': 'game', 'replacements': {rel: f'dub/{rel}' for rel in original_rels}}
+
+
+def pending_files(journal, run_id):
+    tasks, _ = journal.pending(run_id)
+    return sorted(rel for task in tasks for rel in task['replacements'])
+
+
+def test_new_run_supersedes_covered_items(workdir):
+    journal = gvt_core.JobJournal()
+    first = journal.start([task('a.wav', 'b.wav')], {})
+    output = os.path.join(workdir, 'a.part.wav')
+    with open(output, 'wb') as f:
+        f.write(b'RIFF')
+    journal.mark(first, 'game', 'a.wav', 'encoded', output)
+    journal.flush()
+
+    # Второй запуск перекрывает a.wav: у первого остается только b.wav,
+    # а временный результат a.wav удаляется
+    second = journal.start([task('a.wav')], {})
+    assert [row[0] for row in journal.unfinished()] == [second, first]
+    assert pending_files(journal, first) == ['b.wav']
+    assert journal.encoded_outputs(first) == {}
+    assert not os.path.exists(output)
+
+    # Запуски, у которых не осталось замен, закрываются
+    third = journal.start([task('a.wav', 'b.wav')], {})
+    assert [row[0] for row in journal.unfinished()] == [third]
+    assert pending_files(journal, third) == ['a.wav', 'b.wav']
@@ -0,0 +1,47 @@
+import os
+
+import gvt_core
+from conftest import make_task, run_to_end
+
+
+def fake_measure(path):
+    # Оригиналы на 6 дБ громче записей озвучки
+    quiet = os.sep + 'dub' + os.sep in path
+    return {'integrated': -26.0 if quiet else -20.0, 'true_peak': -12.0}
+
+
+def test_reapply_skips_without_hashing_or_measuring(workdir, monkeypatch):
+    monkeypatch.setattr(gvt_core, 'measure_loudness', fake_measure)
+    task = make_task(workdir, 4)
+    loudness = gvt_core.LoudnessCache()
+    processor = gvt_core.ReplacementProcessor([task], 2, report_dir=None, loudness=loudness)
+    run_to_end(processor)
+    assert processor.report.summary()['done'] == 4
+    assert {metrics['gain_db'] for metrics in processor.report.files} == {6.0}
+    assert loudness.stats() == {'measured': 8, 'hits': 0}
+
+    hashed = []
+    file_sha256 = gvt_core.file_sha256
+    monkeypatch.setattr(gvt_core, 'file_sha256', lambda path: hashed.append(path) or file_sha256(path))
+    loudness = gvt_core.LoudnessCache()
+    processor = gvt_core.ReplacementProcessor([task], 2, report_dir=None, loudness=loudness)
+    run_to_end(processor)
+    assert processor.report.summary()['skipped'] == 4
+    assert hashed == []
+    assert loudness.stats() == {'measured': 0, 'hits': 0}
+
+    # Без выравнивания те же замены кодируются заново, уже без усиления
+    processor = gvt_core.ReplacementProcessor([task], 2, report_dir=None)
+    run_to_end(processor)
+    assert processor.report.summary()['done'] == 4
+
+
+def test_memory_is_bounded(workdir, monkeypatch):
+    monkeypatch.setattr(gvt_core, 'measure_loudness', fake_measure)
+    loudness = gvt_core.LoudnessCache(memory_items=2)
+    for i in range(5):
+        loudness.measure(f'line_{i}.wav', digest=str(i))
+    assert len(loudness._memory) == 2
+    # Вытесненное из памяти берется из SQLite, а не измеряется снова
+    loudness.measure('line_0.wav', digest='0')
+    assert loudness.stats() == {'measured': 5, 'hits': 1}
@@ -0,0 +1,52 @@
+import re
+
+from gvt_core import ReplacementMapper
+
+ORIGINALS = [
+    'Sound/Voice/Guard/hello.wav',
+    'Sound/Voice/Merchant/hello.wav',
+    'Sound/Voice/Guard/bye.wav',
+    'Sound/Voice/Guard/Need Help.ogg',
+]
+
+
+def recordings(*relative_paths):
+    return [(relative_path, '/dub/' + relative_path) for relative_path in relative_paths]
+
+
+def test_matches_by_path_then_by_name():
+    result = ReplacementMapper(ORIGINALS).match(
+        recordings('sound/voice/guard/hello.ogg', 'bye.wav', 'need--help.wav'))
+    assert result == {
+        'matched': {
+            'Sound/Voice/Guard/hello.wav': '/dub/sound/voice/guard/hello.ogg',
+            'Sound/Voice/Guard/bye.wav': '/dub/bye.wav',
+            'Sound/Voice/Guard/Need Help.ogg': '/dub/need--help.wav',
+        },
+        'unmatched': [],
+        'ambiguous': {},
+    }
+
+
+def test_same_name_resolved_by_directory_tail():
+    result = ReplacementMapper(ORIGINALS).match(recordings('merchant/hello.wav', 'hello.wav'))
+    assert result['matched'] == {'Sound/Voice/Merchant/hello.wav': '/dub/merchant/hello.wav'}
+    assert result['ambiguous'] == {
+        '/dub/hello.wav': ['Sound/Voice/Guard/hello.wav', 'Sound/Voice/Merchant/hello.wav']}
+
+
+def test_two_recordings_for_one_original_are_ambiguous():
+    result = ReplacementMapper(ORIGINALS).match(recordings('bye.wav', 'old/bye.ogg', 'missing.wav'))
+    assert result['matched'] == {}
+    assert result['unmatched'] == ['/dub/missing.wav']
+    assert result['ambiguous'] == {
+        '/dub/bye.wav': ['Sound/Voice/Guard/bye.wav'],
+        '/dub/old/bye.ogg': ['Sound/Voice/Guard/bye.wav'],
+    }
+
+
+def test_rename_rules_apply_to_both_sides():
+    rules = [(re.compile('^vo_'), '')]
+    result = ReplacementMapper(ORIGINALS, rules).match(recordings('VO_bye.wav'))
+    assert result['matched'] == {'Sound/Voice/Guard/bye.wav': '/dub/VO_bye.wav'}
+    assert ReplacementMapper(ORIGINALS).match(recordings('VO_bye.wav'))['unmatched'] == ['/dub/VO_bye.wav']
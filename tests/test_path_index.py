@@ -0,0 +1,35 @@
+from gvt_core import PathIndex
+
+PATHS = [
+    'Sound\\Voice\\NPC_Guard_01.wav',
+    'sound/voice/npc_merchant.ogg',
+    'Music/Theme.ogg',
+    'sound/sfx/door_open.wav',
+]
+
+
+def test_substring_ignores_case_and_separators():
+    index = PathIndex(PATHS)
+    assert index.search('voice/npc') == [0, 1]
+    assert index.search('VOICE\\NPC') == [0, 1]
+    # Без символов маски запрос ищется буквально
+    assert index.search('sound.voice') == []
+
+
+def test_glob_matches_inside_one_path():
+    index = PathIndex(PATHS)
+    assert index.search('*.ogg') == [1, 2]
+    assert index.search('npc_*_0?') == [0]
+    assert index.search('door_[a-o]pen') == [3]
+    assert index.search('[!m]usic') == []
+    # '?' не захватывает перевод строки между путями
+    assert index.search('theme.ogg?') == []
+
+
+def test_search_from_start_row_after_extend():
+    index = PathIndex(PATHS[:2])
+    assert index.search('npc') == [0, 1]
+    index.extend(PATHS[2:])
+    assert index.search('.ogg') == [1, 2]
+    assert index.search('sound', start=2) == [3]
+    assert index.search('  ', start=1) == [1, 2, 3]
@@ -0,0 +1,53 @@
+import time
+
+import gvt_core
+from conftest import make_task, run_to_end
+
+
+def test_cancel_with_queued_jobs_finishes(workdir):
+    # Отмена, пока большая часть заданий еще в очереди пула: run() должен
+    # дождаться отмененных заданий, закрыть запуск в журнале и выйти
+    journal = gvt_core.JobJournal()
+    processor = gvt_core.ReplacementProcessor(
+        [make_task(workdir, 200)], 2, batch=False, journal=journal, report_dir=None,
+        on_progress=lambda percent: processor.cancel())
+    run_to_end(processor)
+
+    assert processor.cancelled
+    assert processor.errors == []
+    assert processor.report.summary()['cancelled'] > 0
+    assert journal.unfinished() == []
+
+
+class CancelOnDuplicate(gvt_core.ReplacementProcessor):
+    # Второй подготовленный повтор отменяет запуск и возвращается, когда
+    # первый (лидер конвертации) уже ждет кодирования в пачке
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = 0
+
+    def convert(self, game_path, original_rel, replacement, manifest):
+        result = super().convert(game_path, original_rel, replacement, manifest)
+        with self._lock:
+            self.prepared += 1
+            second = self.prepared == 2
+        if second:
+            self.cancel()
+            time.sleep(0.5)
+        return result
+
+
+def test_cancel_with_duplicate_replacements(workdir):
+    # Одна запись на все строки игры: все задания - повторы одной конвертации
+    journal = gvt_core.JobJournal()
+    processor = CancelOnDuplicate(
+        [make_task(workdir, 6, shared_replacement=True)], 2, journal=journal, report_dir=None)
+    run_to_end(processor)
+
+    summary = processor.report.summary()
+    assert processor.cancelled
+    assert processor.errors == []
+    assert summary['cancelled'] > 0
+    assert summary['failed'] == 0
+    assert journal.unfinished() == []
@@ -0,0 +1,82 @@
+import os
+import threading
+
+import pytest
+
+from gvt_core import ScanIndex
+
+EXTENSIONS = ('.wav', '.ogg')
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'RIFF')
+
+
+def bump_mtime(path):
+    # mtime каталога меняется явно: на некоторых ФС его точность - секунды
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def scan_paths(index, game_path):
+    return sorted(rel_path for rel_path, _ in index.scan(game_path, EXTENSIONS))
+
+
+@pytest.fixture
+def game(tmp_path):
+    game_path = str(tmp_path / 'game')
+    for rel_path in ('a.wav', 'notes.txt', os.path.join('voice', 'b.ogg'),
+                     os.path.join('voice', 'en', 'c.WAV')):
+        touch(os.path.join(game_path, rel_path))
+    return game_path
+
+
+@pytest.fixture
+def index(tmp_path):
+    return ScanIndex(str(tmp_path / 'index.db'))
+
+
+def test_scan_finds_audio_recursively(game, index):
+    expected = sorted(['a.wav', os.path.join('voice', 'b.ogg'), os.path.join('voice', 'en', 'c.WAV')])
+    assert scan_paths(index, game) == expected
+    assert sorted(index.load(game)) == expected
+
+
+def test_unchanged_rescan_does_not_read_directories(game, index, monkeypatch):
+    expected = scan_paths(index, game)
+
+    def scandir(path):
+        raise AssertionError(f"каталог прочитан повторно: {path}")
+
+    monkeypatch.setattr(os, 'scandir', scandir)
+    assert scan_paths(index, game) == expected
+
+
+def test_changed_directory_is_rescanned(game, index):
+    scan_paths(index, game)
+    voice = os.path.join(game, 'voice')
+    os.remove(os.path.join(voice, 'b.ogg'))
+    touch(os.path.join(voice, 'd.ogg'))
+    bump_mtime(voice)
+
+    expected = sorted(['a.wav', os.path.join('voice', 'd.ogg'), os.path.join('voice', 'en', 'c.WAV')])
+    assert scan_paths(index, game) == expected
+    assert sorted(index.load(game)) == expected
+
+
+def test_cancelled_scan_does_not_hide_unvisited_directories(tmp_path, index):
+    game_path = str(tmp_path / 'deep')
+    expected = []
+    for i in range(3):
+        for j in range(4):
+            expected.append(os.path.join(f'd{i}', f'e{j}', 'line.wav'))
+            touch(os.path.join(game_path, expected[-1]))
+    touch(os.path.join(game_path, 'root.wav'))
+    expected = sorted(expected + ['root.wav'])
+
+    cancel_event = threading.Event()
+    for _ in index.scan(game_path, EXTENSIONS, cancel_event):
+        cancel_event.set()
+    assert scan_paths(index, game_path) == expected